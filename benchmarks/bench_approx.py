@@ -0,0 +1,95 @@
+"""Compare the exact and the --approx processors on high cardinality records: accuracy of `top request_path` and of
+the client counts of the stream view, and memory (traced allocations and peak RSS of a process running each one).
+
+Run from the repository root with `python -m benchmarks.bench_approx`.
+
+Usage:
+    bench_approx [options]
+
+Options:
+    -n <records>, --records <records>  number of generated records [default: 1000000]
+    -c <clients>, --clients <clients>  number of distinct clients [default: 300000]
+"""
+from __future__ import print_function
+import multiprocessing
+import random
+import resource
+import tracemalloc
+
+from docopt import docopt
+
+from ngxtop.aggregator import GroupAggregation, ApproxTopAggregation, Count
+from ngxtop.dict_processor import DictProcessor
+from ngxtop.sql_processor import SQLProcessor
+
+TOP = 10
+
+
+def generate_records(count, clients, seed=0):
+    """
+    HLS edge like records: playlists of popular streams are requested over and over, fragment paths are nearly unique.
+    """
+    rand = random.Random(seed)
+    for idx in range(count):
+        stream = min(int(rand.paretovariate(1.1)), 500)
+        if rand.random() < 0.3:
+            path = '/live/%d.m3u8' % stream
+        else:
+            path = '/live/%d-%d.ts' % (stream, idx // 3)
+        yield {'request': 'GET %s HTTP/1.1' % path, 'request_path': path, 'bytes_sent': 1000,
+               'remote_addr': '10.%d.%d.%d' % (rand.randrange(clients) >> 16, rand.randrange(256), rand.randrange(256))}
+
+
+def build(mode):
+    if mode == 'top exact':
+        return SQLProcessor([GroupAggregation('top', ['request_path'], [Count('count')], 'count', TOP)],
+                            ['request_path'])
+    if mode == 'top approx':
+        return SQLProcessor([ApproxTopAggregation('top', ['request_path'], TOP)], ['request_path'])
+    return DictProcessor(approx=mode == 'streams approx')
+
+
+def run(mode, count, clients, results):
+    tracemalloc.start()
+    processor = build(mode)
+    processor.process(generate_records(count, clients))
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    if mode.startswith('top'):
+        answer = [row[:2] for row in processor.report_queries[0].rows()]
+    else:
+        answer = dict((stream.name, stream.client_count()) for stream in processor.streams.values())
+    results.put((size, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, answer))
+
+
+def measure(mode, count, clients):
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=run, args=(mode, count, clients, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def main():
+    arguments = docopt(__doc__)
+    count, clients = int(arguments['--records']), int(arguments['--clients'])
+
+    for name in ('top', 'streams'):
+        exact_size, exact_rss, exact = measure(name + ' exact', count, clients)
+        approx_size, approx_rss, approx = measure(name + ' approx', count, clients)
+        if name == 'top':
+            expected = dict(exact)
+            recall = len(set(expected) & set(path for path, _ in approx)) / float(TOP)
+            error = max(abs(count - expected.get(path, 0)) / float(expected.get(path, 1)) for path, count in approx)
+            accuracy = 'top %d recall %.0f%%, max count error %.2f%%' % (TOP, recall * 100, error * 100)
+        else:
+            error = max(abs(approx[stream] - exact[stream]) / float(exact[stream]) for stream in exact)
+            accuracy = 'max client count error %.2f%% over %d streams' % (error * 100, len(exact))
+        print('%s: %s' % (name, accuracy))
+        print('  exact:  %6.1f MiB traced, %6.1f MiB peak RSS' % (exact_size / 2.0 ** 20, exact_rss / 1024.0))
+        print('  approx: %6.1f MiB traced, %6.1f MiB peak RSS' % (approx_size / 2.0 ** 20, approx_rss / 1024.0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Compare the engines of the `top` / `avg` / `sum` commands on the same parsed records: sqlite running the generated
+SQL, the incremental aggregations (default sqlite engine) and the numpy columnar engine.
+
+Run from the repository root with `python -m benchmarks.bench_engine`, numpy must be installed.
+
+Usage:
+    bench_engine [options]
+
+Options:
+    -n <lines>, --lines <lines>  number of generated log lines [default: 500000]
+"""
+from __future__ import print_function
+import time
+
+from docopt import docopt
+
+from ngxtop.aggregator import GroupAggregation, Count, Avg, Sum
+from ngxtop.columnar import ColumnarProcessor
+from ngxtop.httptop import NginxHttpInfo
+from ngxtop.sql_processor import SQLProcessor
+from benchmarks.generate import generate_lines
+
+QUERIES = [
+    GroupAggregation('top request_path', ['request_path'], [Count('count')], 'count', 10),
+    GroupAggregation('top remote_addr', ['remote_addr'], [Count('count')], 'count', 10),
+    GroupAggregation('average', [], [Avg('avg(bytes_sent)', 'bytes_sent'), Avg('avg(request_time)', 'request_time')]),
+    GroupAggregation('sum', [], [Sum('sum(bytes_sent)', 'bytes_sent')]),
+]
+FIELDS = ['request_path', 'remote_addr', 'bytes_sent', 'request_time']
+
+
+def parse(lines):
+    http_info = NginxHttpInfo({'--log-format': 'combined', '--filter': None})
+    http_info.set_processor(SQLProcessor([], FIELDS))
+    return list(http_info.parse_log(lines))
+
+
+def measure(processor, records):
+    begin = time.time()
+    processor.process(iter(records))
+    processed = time.time()
+    processor.report()
+    return processed - begin, time.time() - processed
+
+
+def main():
+    count = int(docopt(__doc__)['--lines'])
+    records = parse(generate_lines(count))
+
+    engines = [
+        ('sqlite queries', SQLProcessor([(query.label, query.sql()) for query in QUERIES], FIELDS)),
+        ('incremental', SQLProcessor([query.fresh() for query in QUERIES], FIELDS)),
+        ('numpy columns', ColumnarProcessor([query.fresh() for query in QUERIES], FIELDS)),
+    ]
+    results = [(name, measure(processor, records)) for name, processor in engines]
+    baseline = sum(results[0][1])
+    for name, (process, report) in results:
+        total = process + report
+        print('%-15s process %.2fs, report %.3fs: %.0f records/sec, %.1fx' %
+              (name, process, report, count / total, baseline / total))
+
+
+if __name__ == '__main__':
+    main()
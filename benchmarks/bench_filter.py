@@ -0,0 +1,57 @@
+"""Compare parsing throughput with a --filter evaluated from source per record, compiled once, and compiled with
+line hints checked before the log format pattern.
+
+Run from the repository root with `python -m benchmarks.bench_filter`.
+
+Usage:
+    bench_filter [options]
+
+Options:
+    -n <lines>, --lines <lines>  number of generated log lines [default: 500000]
+    -i <filter>, --filter <filter>  filter expression [default: status == 404]
+"""
+from __future__ import print_function
+import time
+from collections import deque
+
+from docopt import docopt
+
+from ngxtop import httptop
+from ngxtop.httptop import NginxHttpInfo
+from benchmarks.generate import generate_lines
+
+
+class EvalHttpInfo(NginxHttpInfo):
+    """
+    Filters like before: the expression source is evaluated against every record.
+    """
+    def build_records(self, lines):
+        filter_exp = self.arguments['--filter']
+        return (r for r in self.parse_log(lines) if eval(filter_exp, {}, r))
+
+
+def run(http_info, lines):
+    begin = time.time()
+    records = deque(http_info.build_records(lines), maxlen=1)
+    return len(records), time.time() - begin
+
+
+def main():
+    args = docopt(__doc__)
+    lines = list(generate_lines(int(args['--lines'])))
+    arguments = {'--log-format': 'combined', '--pre-filter': None, '--filter': args['--filter']}
+
+    variants = [('eval', EvalHttpInfo(arguments), httptop.line_hints),
+                ('compiled', NginxHttpInfo(arguments), lambda expression: []),
+                ('hints', NginxHttpInfo(arguments), httptop.line_hints)]
+    for name, http_info, line_hints in variants:
+        httptop.line_hints, original = line_hints, httptop.line_hints
+        try:
+            _, duration = run(http_info, lines)
+        finally:
+            httptop.line_hints = original
+        print('%-10s %.2fs: %.0f lines/sec' % (name, duration, len(lines) / duration))
+
+
+if __name__ == '__main__':
+    main()
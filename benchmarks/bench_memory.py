@@ -0,0 +1,68 @@
+"""Report bytes per tracked client of DictProcessor with the slotted classes and with plain __dict__ classes.
+
+Run from the repository root with `python -m benchmarks.bench_memory`.
+
+Usage:
+    bench_memory [options]
+
+Options:
+    -c <clients>, --clients <clients>  number of distinct clients [default: 200000]
+"""
+from __future__ import print_function
+import tracemalloc
+
+from docopt import docopt
+
+from ngxtop import dict_processor
+from benchmarks.generate import USER_AGENTS
+
+
+def without_slots(cls):
+    """
+    Same class as given one, with instance attributes stored in a __dict__ like before.
+    """
+    namespace = dict((k, v) for k, v in vars(cls).items() if k not in cls.__slots__ and k != '__slots__')
+    return type(cls.__name__, (object,), namespace)
+
+
+def build_records(clients):
+    for idx in range(clients):
+        yield {
+            'request': 'GET /live/801-%d-%d.ts HTTP/1.1' % (idx % 20, idx),
+            'remote_addr': '10.%d.%d.%d' % (idx >> 16 & 255, idx >> 8 & 255, idx & 255),
+            'time_local': '16/May/2016:10:38:08 +0000',
+            'status': 200,
+            'bytes_sent': 1024,
+            'body_bytes_sent': '1024',
+            # user agents are decoded from every line, so each record carries its own copy
+            'http_user_agent': ''.join(list(USER_AGENTS[idx % len(USER_AGENTS)])),
+        }
+
+
+def measure(clients):
+    tracemalloc.start()
+    processor = dict_processor.DictProcessor()
+    processor.process(build_records(clients))
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size / float(clients)
+
+
+def main():
+    clients = int(docopt(__doc__)['--clients'])
+
+    slotted = measure(clients)
+    client_info, stream_info, intern = dict_processor.ClientInfo, dict_processor.StreamInfo, dict_processor.intern
+    dict_processor.ClientInfo, dict_processor.StreamInfo = without_slots(client_info), without_slots(stream_info)
+    dict_processor.intern = lambda value: value
+    try:
+        plain = measure(clients)
+    finally:
+        dict_processor.ClientInfo, dict_processor.StreamInfo, dict_processor.intern = client_info, stream_info, intern
+
+    print('before (__dict__, no interning): %.0f bytes per client' % plain)
+    print('after (__slots__, interned):     %.0f bytes per client' % slotted)
+
+
+if __name__ == '__main__':
+    main()
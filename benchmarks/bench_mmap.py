@@ -0,0 +1,68 @@
+"""Compare parsing a historical access log through text file objects against the memory-mapped source.
+
+Run from the repository root with `python -m benchmarks.bench_mmap`. Use `-n 10000000` for a multi-GB file.
+
+Usage:
+    bench_mmap [options]
+
+Options:
+    -n <lines>, --lines <lines>  number of generated log lines [default: 1000000]
+    -s <lines>, --sample <lines>  number of lines traced for allocations [default: 100000]
+"""
+from __future__ import print_function
+import os
+import time
+import tempfile
+import tracemalloc
+from itertools import islice
+
+from docopt import docopt
+
+from ngxtop.dict_processor import DictProcessor
+from ngxtop.httptop import NginxHttpInfo
+from ngxtop.sources import MmapSource
+from benchmarks.generate import write_log
+
+
+def text_source(path):
+    with open(path) as f:
+        for line in f:
+            yield line
+
+
+def consume(records, limit=None):
+    count = 0
+    for _ in islice(records, limit):
+        count += 1
+    return count
+
+
+def main():
+    args = docopt(__doc__)
+    http_info = NginxHttpInfo({'--log-format': 'combined', '--filter': None})
+    # only decode the fields the default view needs
+    http_info.set_processor(DictProcessor())
+
+    fd, path = tempfile.mkstemp(suffix='.log')
+    os.close(fd)
+    try:
+        write_log(path, int(args['--lines']))
+        size = os.path.getsize(path) / 1024.0 / 1024.0
+        sample = int(args['--sample'])
+        for name, source in (('text', text_source), ('mmap', MmapSource)):
+            begin = time.time()
+            count = consume(http_info.parse_log(source(path)))
+            duration = time.time() - begin
+
+            tracemalloc.start()
+            consume(http_info.parse_log(source(path)), sample)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print('%-5s %d records from %.0f MB in %.2fs: %.0f lines/sec, %.1f MB/sec, peak traced %d KB' %
+                  (name, count, size, duration, count / duration, size / duration, peak / 1024))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""Measure --no-follow wall-clock time of a generated access log against the number of worker processes.
+
+Run from the repository root with `python -m benchmarks.bench_parallel`.
+
+Usage:
+    bench_parallel [options]
+
+Options:
+    -n <lines>, --lines <lines>  number of generated log lines [default: 1000000]
+    -j <workers>, --workers <workers>  comma separated worker counts to measure [default: 1,2,4,8]
+"""
+from __future__ import print_function
+import os
+import time
+import tempfile
+
+from docopt import docopt
+
+from ngxtop.dict_processor import DictProcessor
+from ngxtop.httptop import NginxHttpInfo
+from ngxtop.parallel import parallel_process
+from benchmarks.generate import write_log
+
+
+def run(path, workers):
+    arguments = {'--access-log': path, '--log-format': 'combined', '--no-follow': True, '--workers': str(workers),
+                 '--pre-filter': None, '--filter': None}
+    http_info = NginxHttpInfo(arguments)
+    http_info.access_log = path
+    http_info.set_processor(DictProcessor())
+
+    begin = time.time()
+    if http_info.use_workers():
+        parallel_process(http_info, workers)
+    else:
+        with open(path) as lines:
+            http_info.processor.process(http_info.build_records(lines))
+    return time.time() - begin
+
+
+def main():
+    args = docopt(__doc__)
+    fd, path = tempfile.mkstemp(suffix='.log')
+    os.close(fd)
+    try:
+        write_log(path, int(args['--lines']))
+        baseline = None
+        for workers in [int(w) for w in args['--workers'].split(',')]:
+            duration = run(path, workers)
+            baseline = baseline or duration
+            print('%2d workers: %.2fs, speedup %.2fx' % (workers, duration, baseline / duration))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""Compare access log line parsing throughput of the compiled pattern against the legacy greedy regex.
+
+Run from the repository root with `python -m benchmarks.bench_parser`.
+
+Usage:
+    bench_parser [options]
+
+Options:
+    -n <lines>, --lines <lines>  number of generated log lines [default: 1000000]
+    -f <format>, --log-format <format>  log format used to parse lines [default: combined]
+"""
+from __future__ import print_function
+import re
+import time
+
+from docopt import docopt
+
+from ngxtop.config_parser import build_pattern, LOG_FORMAT_COMBINED, \
+    REGEX_SPECIAL_CHARS, REGEX_LOG_FORMAT_VARIABLE
+from benchmarks.generate import generate_lines
+
+
+def build_legacy_pattern(log_format):
+    if log_format == 'combined':
+        log_format = LOG_FORMAT_COMBINED
+    pattern = re.sub(REGEX_SPECIAL_CHARS, r'\\\1', log_format)
+    pattern = re.sub(REGEX_LOG_FORMAT_VARIABLE, '(?P<\\1>.*)', pattern)
+    return re.compile(pattern)
+
+
+def run(pattern, lines):
+    begin = time.time()
+    matched = 0
+    for line in lines:
+        match = pattern.match(line)
+        if match is not None:
+            match.groupdict()
+            matched += 1
+    return matched, time.time() - begin
+
+
+def main():
+    args = docopt(__doc__)
+    lines = list(generate_lines(int(args['--lines'])))
+    log_format = args['--log-format']
+
+    for name, pattern in (('legacy', build_legacy_pattern(log_format)), ('compiled', build_pattern(log_format))):
+        matched, duration = run(pattern, lines)
+        print('%-10s %d/%d lines matched in %.2fs: %.0f lines/sec' %
+              (name, matched, len(lines), duration, len(lines) / duration))
+
+
+if __name__ == '__main__':
+    main()
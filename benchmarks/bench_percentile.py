@@ -0,0 +1,80 @@
+"""Compare request time percentiles of every group estimated by histograms (the percentile command and stream view)
+against exact percentiles of all values kept and sorted: accuracy, time and memory (peak of traced allocations, in a
+second run as tracing slows allocations down).
+
+Run from the repository root with `python -m benchmarks.bench_percentile`.
+
+Usage:
+    bench_percentile [options]
+
+Options:
+    -n <records>, --records <records>  number of generated records [default: 1000000]
+    -g <groups>, --groups <groups>  number of groups [default: 100]
+"""
+from __future__ import print_function
+import random
+import time
+import tracemalloc
+
+from docopt import docopt
+
+from ngxtop.aggregator import GroupAggregation, Percentile, PERCENTILES
+from ngxtop.sketch import percentile_rank
+
+
+def generate_records(count, groups, seed=0):
+    # request times are log-normal, most requests are fast, some are very slow
+    rand = random.Random(seed)
+    for _ in range(count):
+        yield {'request_path': '/live/%d.ts' % rand.randrange(groups),
+               'request_time': round(rand.lognormvariate(-3, 1.5), 3)}
+
+
+def exact(records):
+    values = {}
+    for record in records:
+        values.setdefault((record['request_path'],), []).append(record['request_time'])
+    rows = []
+    for key, times in values.items():
+        times.sort()
+        rows.append(key + tuple(times[percentile_rank(percent / 100.0, len(times)) - 1] for percent in PERCENTILES))
+    return rows
+
+
+def estimated(records):
+    query = GroupAggregation('percentiles', ['request_path'],
+                             [Percentile('p%d' % percent, 'request_time', percent) for percent in PERCENTILES])
+    for record in records:
+        query.update(record)
+    return query.rows()
+
+
+def measure(function, count, groups):
+    begin = time.time()
+    rows = function(generate_records(count, groups))
+    elapsed = time.time() - begin
+    tracemalloc.start()
+    function(generate_records(count, groups))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, dict((row[0], row[1:]) for row in rows)
+
+
+def main():
+    arguments = docopt(__doc__)
+    count, groups = int(arguments['--records']), int(arguments['--groups'])
+
+    exact_time, exact_size, expected = measure(exact, count, groups)
+    estimated_time, estimated_size, estimates = measure(estimated, count, groups)
+    error = max(abs(estimate - value) / value for key, values in expected.items()
+                for value, estimate in zip(values, estimates[key]) if value)
+
+    print('max relative error of p%s over %d groups: %.2f%%'
+          % ('/p'.join(str(percent) for percent in PERCENTILES), groups, error * 100))
+    print('exact (sorted):     %.0f records/sec, %6.1f MiB peak' % (count / exact_time, exact_size / 2.0 ** 20))
+    print('estimated (digest): %.0f records/sec, %6.1f MiB peak'
+          % (count / estimated_time, estimated_size / 2.0 ** 20))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Compare parsing throughput of the former pipeline, converting and deriving every field of every line, against
+the projected one capturing and converting only the fields the processor reads.
+
+Run from the repository root with `python -m benchmarks.bench_projection`.
+
+Usage:
+    bench_projection [options]
+
+Options:
+    -n <lines>, --lines <lines>  number of generated log lines [default: 500000]
+"""
+from __future__ import print_function
+import time
+
+from docopt import docopt
+
+from ngxtop.config_parser import build_pattern
+from ngxtop.dict_processor import DictProcessor
+from ngxtop.httptop import NginxHttpInfo, parse_request_path, parse_status_type
+from ngxtop.utils import to_int, to_float
+from benchmarks.generate import generate_lines
+
+
+def map_field(field, func, dict_sequence):
+    for item in dict_sequence:
+        try:
+            item[field] = func(item.get(field, None))
+            yield item
+        except ValueError:
+            pass
+
+
+def add_field(field, func, dict_sequence):
+    for item in dict_sequence:
+        if field not in item:
+            item[field] = func(item)
+        yield item
+
+
+def parse_legacy(pattern, lines):
+    matches = (pattern.match(l) for l in lines)
+    records = (m.groupdict() for m in matches if m is not None)
+    records = map_field('status', to_int, records)
+    records = add_field('status_type', parse_status_type, records)
+    records = add_field('bytes_sent', lambda r: r.get('body_bytes_sent'), records)
+    records = map_field('bytes_sent', to_int, records)
+    records = map_field('request_time', to_float, records)
+    return add_field('request_path', parse_request_path, records)
+
+
+def run(records, fields):
+    begin = time.time()
+    for record in records:
+        for field in fields:
+            record.get(field)
+    return time.time() - begin
+
+
+def main():
+    args = docopt(__doc__)
+    lines = list(generate_lines(int(args['--lines'])))
+    processor = DictProcessor()
+    http_info = NginxHttpInfo({'--log-format': 'combined', '--filter': None})
+    http_info.set_processor(processor)
+
+    for name, records in (('legacy', parse_legacy(build_pattern('combined'), lines)),
+                          ('projected', http_info.parse_log(lines))):
+        duration = run(records, processor.fields)
+        print('%-10s %.2fs: %.0f lines/sec' % (name, duration, len(lines) / duration))
+
+
+if __name__ == '__main__':
+    main()
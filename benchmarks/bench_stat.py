@@ -0,0 +1,71 @@
+"""Compare parsing time of a nginx-rtmp /stat document by the streaming parser against the legacy minidom walk.
+
+Run from the repository root with `python -m benchmarks.bench_stat`.
+
+Usage:
+    bench_stat [options]
+
+Options:
+    -c <clients>, --clients <clients>  number of playing clients [default: 10000]
+    -s <streams>, --streams <streams>  number of live streams [default: 50]
+"""
+from __future__ import print_function
+import io
+import time
+import xml.dom.minidom
+
+from docopt import docopt
+
+from ngxtop.rtmptop import StatServer
+from benchmarks.generate import generate_stat
+
+
+def legacy_value(root, node_name):
+    child = root.getElementsByTagName(node_name)
+    if len(child) >= 1 and child[0].firstChild:
+        return child[0].firstChild.data
+    return 0
+
+
+def parse_legacy(document):
+    """
+    Parse the document like the minidom based parser did, returning the number of clients found.
+    """
+    root = xml.dom.minidom.parseString(document).documentElement
+    for name in ('nginx_version', 'nginx_rtmp_version', 'compiler', 'built', 'pid', 'uptime', 'naccepted',
+                 'bw_in', 'bw_out', 'bytes_in', 'bytes_out'):
+        legacy_value(root, name)
+    live = root.getElementsByTagName('server')[0].getElementsByTagName(
+        'application')[0].getElementsByTagName('live')[0]
+    clients = 0
+    for stream in live.getElementsByTagName('stream'):
+        for name in ('name', 'time', 'bw_in', 'bytes_in', 'bw_out', 'bytes_out', 'bw_audio', 'bw_video', 'nclients'):
+            legacy_value(stream, name)
+        for client in stream.getElementsByTagName('client'):
+            for name in ('id', 'address', 'time', 'flashver', 'dropped', 'avsync', 'timestamp', 'pageurl', 'swfurl'):
+                legacy_value(client, name)
+            client.getElementsByTagName('publishing')
+            clients += 1
+    return clients
+
+
+def parse_streaming(document):
+    info = StatServer('http://127.0.0.1:8080/stat')
+    stream_infos = info.parse_stat(io.BytesIO(document))
+    return sum(len(stream.clients) for stream in stream_infos.values())
+
+
+def main():
+    args = docopt(__doc__)
+    document = generate_stat(int(args['--clients']), streams=int(args['--streams']))
+    print('document: %d bytes' % len(document))
+
+    for name, parse in (('minidom', parse_legacy), ('iterparse', parse_streaming)):
+        begin = time.time()
+        clients = parse(document)
+        duration = time.time() - begin
+        print('%-10s %d clients parsed in %.3fs' % (name, clients, duration))
+
+
+if __name__ == '__main__':
+    main()
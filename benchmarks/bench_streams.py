@@ -0,0 +1,62 @@
+"""Compare classifying requests into streams with the former regular expressions against the stream classifier
+(prefix / suffix matching and a cache of recent requests).
+
+Run from the repository root with `python -m benchmarks.bench_streams`.
+
+Usage:
+    bench_streams [options]
+
+Options:
+    -n <requests>, --requests <requests>  number of generated requests [default: 1000000]
+"""
+from __future__ import print_function
+import re
+import time
+
+from docopt import docopt
+
+from ngxtop.config_parser import REGEX_LOG_FORMAT_VARIABLE, REGEX_SPECIAL_CHARS
+from ngxtop.streams import StreamClassifier
+from benchmarks.generate import generate_lines
+
+LEGACY_PATTERNS = ['GET /live/$stream.m3u8 HTTP/1.1', 'GET /live/$stream-$frag.ts HTTP/1.1']
+
+
+def legacy_classifier():
+    patterns = []
+    for pattern in LEGACY_PATTERNS:
+        pattern = re.sub(REGEX_SPECIAL_CHARS, r'\\\1', pattern)
+        patterns.append(re.compile(re.sub(REGEX_LOG_FORMAT_VARIABLE, '(?P<\\1>.*)', pattern)))
+
+    def get_stream(request):
+        for pattern in patterns:
+            match = pattern.match(request)
+            if match is not None:
+                return match.groupdict()['stream']
+        return request
+    return get_stream
+
+
+def measure(get_stream, requests):
+    begin = time.time()
+    streams = [get_stream(request) for request in requests]
+    return time.time() - begin, streams
+
+
+def main():
+    count = int(docopt(__doc__)['--requests'])
+    requests = [line.split('"')[1] for line in generate_lines(count)]
+
+    legacy, expected = measure(legacy_classifier(), requests)
+    uncached, streams = measure(StreamClassifier(cache_size=0).classify, requests)
+    assert streams == expected
+    cached, streams = measure(StreamClassifier(), requests)
+    assert streams == expected
+
+    print('before (regex):          %.0f requests/sec' % (count / legacy))
+    print('after (prefix / suffix): %.0f requests/sec' % (count / uncached))
+    print('after (cached):          %.0f requests/sec' % (count / cached))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+"""Compare parsing time_local of access log lines with dateutil, like before, against the specialized cached parser.
+
+Run from the repository root with `python -m benchmarks.bench_time`, dateutil is only needed by this benchmark.
+
+Usage:
+    bench_time [options]
+
+Options:
+    -n <lines>, --lines <lines>  number of generated log lines [default: 1000000]
+"""
+from __future__ import print_function
+import time
+import calendar
+
+from docopt import docopt
+from dateutil import parser
+
+from ngxtop.utils import TimeLocalParser
+from benchmarks.generate import generate_lines
+
+
+def parse_dateutil(value):
+    return calendar.timegm(parser.parse(value.replace(':', ' ', 1)).utctimetuple())
+
+
+def main():
+    args = docopt(__doc__)
+    values = [line.split('[', 1)[1][:26] for line in generate_lines(int(args['--lines']))]
+
+    results = {}
+    for name, parse in (('dateutil', parse_dateutil), ('uncached', lambda value: TimeLocalParser(0)(value)),
+                        ('cached', TimeLocalParser())):
+        begin = time.time()
+        results[name] = [parse(value) for value in values]
+        duration = time.time() - begin
+        print('%-10s %.2fs: %.0f values/sec' % (name, duration, len(values) / duration))
+    assert results['dateutil'] == results['uncached'] == results['cached']
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Synthetic nginx access log generator shared by the benchmarks.
+"""
+import random
+
+USER_AGENTS = [
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_4) AppleWebKit/537.36 (KHTML, like Gecko) '
+    'Chrome/49.0.2623.110 Safari/537.36',
+    'Mozilla/5.0 (Linux; Android 4.4.2; GT-I9500 Build/KOT49H) AppleWebKit/537.36 (KHTML, like Gecko) '
+    'Version/4.0 Chrome/37.0.0.0 Mobile MQQBrowser/6.2 TBS/036215 Safari/537.36',
+    'AppleCoreMedia/1.0.0.13E238 (iPhone; U; CPU OS 9_3_1 like Mac OS X; zh_cn)',
+]
+COMBINED_LINE = '%s - - [%02d/May/2016:10:%02d:%02d +0000] "GET %s HTTP/1.1" %d %d "%s" "%s"\n'
+
+
+def generate_lines(count, streams=50, clients=5000, seed=0):
+    """
+    Generate HLS edge like access log lines in combined format.
+    :param count: number of lines to generate
+    :param streams: number of distinct live streams
+    :param clients: number of distinct remote addresses
+    :param seed: random seed, the same seed always gives the same log
+    :return: iterator over generated lines
+    """
+    rand = random.Random(seed)
+    for idx in range(count):
+        second = idx // 1000
+        stream = '801-%d' % rand.randrange(streams)
+        if rand.random() < 0.2:
+            request = '/live/%s.m3u8' % stream
+            status, size = 200, rand.randrange(100, 300)
+        else:
+            request = '/live/%s-%d.ts' % (stream, second // 5)
+            status, size = rand.choice((200, 200, 200, 206, 404)), rand.randrange(100000, 900000)
+        remote_addr = '10.%d.%d.%d' % (rand.randrange(clients) // 65536, rand.randrange(256), rand.randrange(256))
+        yield COMBINED_LINE % (remote_addr, 16 + second // 86400, (second // 60) % 60, second % 60, request,
+                               status, size, 'http://192.168.1.12:8080/?cname=801', rand.choice(USER_AGENTS))
+
+
+def write_log(path, count, **kwargs):
+    """
+    Write a generated access log to given path.
+    :param path: file to write
+    :param count: number of lines to generate
+    """
+    with open(path, 'w') as f:
+        f.writelines(generate_lines(count, **kwargs))
+
+
+STAT_HEADER = '<?xml version="1.0" encoding="utf-8" ?>\n<rtmp><nginx_version>1.9.15</nginx_version>' \
+              '<nginx_rtmp_version>1.1.4</nginx_rtmp_version><compiler>gcc 4.8.4</compiler>' \
+              '<built>May 16 2016 10:00:00</built><pid>1234</pid><uptime>3600</uptime><naccepted>%d</naccepted>' \
+              '<bw_in>1000000</bw_in><bytes_in>450000000</bytes_in><bw_out>9000000</bw_out>' \
+              '<bytes_out>4050000000</bytes_out><server><application><name>live</name><live>'
+STAT_STREAM = '<stream><name>%s</name><time>%d</time><bw_in>1000000</bw_in><bytes_in>450000000</bytes_in>' \
+              '<bw_out>%d</bw_out><bytes_out>%d</bytes_out><bw_audio>64000</bw_audio><bw_video>936000</bw_video>'
+STAT_CLIENT = '<client><id>%d</id><address>%s</address><time>%d</time><flashver>%s</flashver>' \
+              '<pageurl>http://192.168.1.12:8080/?cname=801</pageurl><swfurl>http://192.168.1.12/player.swf</swfurl>' \
+              '<dropped>0</dropped><avsync>-3</avsync><timestamp>%d</timestamp><active/></client>'
+STAT_META = '<meta><video><width>1280</width><height>720</height><frame_rate>25</frame_rate><codec>H264</codec>' \
+            '<profile>Main</profile><compat>0</compat><level>3.1</level></video><audio><codec>AAC</codec>' \
+            '<profile>LC</profile><channels>2</channels><sample_rate>44100</sample_rate></audio></meta>'
+
+
+def generate_stat(clients, streams=50, seed=0):
+    """
+    Generate a nginx-rtmp-module /stat document.
+    :param clients: number of playing clients, spread over the streams
+    :param streams: number of live streams
+    :param seed: random seed
+    :return: document as bytes
+    """
+    rand = random.Random(seed)
+    parts = [STAT_HEADER % clients]
+    for stream in range(streams):
+        count = clients // streams + (1 if stream < clients % streams else 0)
+        parts.append(STAT_STREAM % ('801-%d' % stream, rand.randrange(10 ** 7), 1000000 * count, 450000000 * count))
+        parts.append(STAT_CLIENT.replace('<active/>', '<publishing/><active/>') %
+                     (stream, '192.168.1.%d' % stream, rand.randrange(10 ** 7), 'FMLE/3.0', 0))
+        for idx in range(count):
+            parts.append(STAT_CLIENT % (streams + stream * count + idx, '10.%d.%d.%d' % (stream, idx >> 8, idx & 255),
+                                        rand.randrange(10 ** 7), rand.choice(USER_AGENTS), rand.randrange(10 ** 7)))
+        parts.append(STAT_META)
+        parts.append('<nclients>%d</nclients><publishing/><active/></stream>' % (count + 1))
+    parts.append('<nclients>%d</nclients></live></application></server></rtmp>\n' % (clients + streams))
+    return ''.join(parts).encode('utf-8')
@@ -0,0 +1,301 @@
+"""
+Report queries maintained incrementally while records are processed.
+
+A query keeps one accumulator per group and updates it with every record, so building a report costs O(groups)
+instead of rescanning every record processed so far. Arbitrary SQL of the query command is still run by sqlite.
+"""
+import heapq
+
+if __package__ is None:
+    from sketch import LogHistogram, SpaceSaving, TOP_CAPACITY
+    from utils import to_number
+else:
+    from .sketch import LogHistogram, SpaceSaving, TOP_CAPACITY
+    from .utils import to_number
+
+# percentiles reported by the percentile command and the stream view
+PERCENTILES = [50, 95, 99]
+
+
+class Count(object):
+    """
+    count(1), or count(CASE WHEN <field> = <value> THEN 1 END) when field and value are given.
+    """
+    initial = [0]
+
+    def __init__(self, name, field=None, value=None):
+        self.name = name
+        self.field = field
+        self.value = value
+
+    def sql(self):
+        if self.field is None:
+            return "count(1) AS '%s'" % self.name
+        return "count(CASE WHEN %s = %r THEN 1 END) AS '%s'" % (self.field, self.value, self.name)
+
+    def update(self, acc, offset, record):
+        if self.field is None or record.get(self.field) == self.value:
+            acc[offset] += 1
+
+    @staticmethod
+    def merge(acc, offset, other):
+        acc[offset] += other[offset]
+
+    @staticmethod
+    def result(acc, offset):
+        return acc[offset]
+
+
+class Sum(object):
+    """
+    sum(<field>), NULL values are ignored and the sum of no values is NULL.
+    """
+    function = 'sum'
+    # total, number of values
+    initial = [0, 0]
+
+    def __init__(self, name, field):
+        self.name = name
+        self.field = field
+
+    def sql(self):
+        return "%s(%s) AS '%s'" % (self.function, self.field, self.name)
+
+    def update(self, acc, offset, record):
+        # fields captured but not converted when parsed are text
+        value = to_number(record.get(self.field))
+        if value is not None:
+            acc[offset] += value
+            acc[offset + 1] += 1
+
+    @staticmethod
+    def merge(acc, offset, other):
+        acc[offset] += other[offset]
+        acc[offset + 1] += other[offset + 1]
+
+    @staticmethod
+    def result(acc, offset):
+        return acc[offset] if acc[offset + 1] else None
+
+
+class Avg(Sum):
+    """
+    avg(<field>), NULL values are ignored and the average of no values is NULL.
+    """
+    function = 'avg'
+
+    @staticmethod
+    def result(acc, offset):
+        return acc[offset] / float(acc[offset + 1]) if acc[offset + 1] else None
+
+
+class Min(Sum):
+    """
+    min(<field>), NULL values are ignored.
+    """
+    function = 'min'
+    initial = [None]
+
+    def update(self, acc, offset, record):
+        value = to_number(record.get(self.field))
+        if value is not None and (acc[offset] is None or value < acc[offset]):
+            acc[offset] = value
+
+    @staticmethod
+    def merge(acc, offset, other):
+        if other[offset] is not None and (acc[offset] is None or other[offset] < acc[offset]):
+            acc[offset] = other[offset]
+
+    @staticmethod
+    def result(acc, offset):
+        return acc[offset]
+
+
+class Max(Min):
+    """
+    max(<field>), NULL values are ignored.
+    """
+    function = 'max'
+
+    def update(self, acc, offset, record):
+        value = to_number(record.get(self.field))
+        if value is not None and (acc[offset] is None or value > acc[offset]):
+            acc[offset] = value
+
+    @staticmethod
+    def merge(acc, offset, other):
+        if other[offset] is not None and (acc[offset] is None or other[offset] > acc[offset]):
+            acc[offset] = other[offset]
+
+
+class Percentile(object):
+    """
+    percentile(<field>, <percent>), estimated within 1% by a LogHistogram of the field (see PercentileAggregate for
+    sqlite), NULL values are ignored and the percentile of no values is NULL.
+    """
+    initial = [None]
+
+    def __init__(self, name, field, percent):
+        self.name = name
+        self.field = field
+        self.percent = percent
+
+    def sql(self):
+        return "percentile(%s, %s) AS '%s'" % (self.field, self.percent, self.name)
+
+    def update(self, acc, offset, record):
+        value = to_number(record.get(self.field))
+        if value is not None:
+            histogram = acc[offset]
+            if histogram is None:
+                histogram = acc[offset] = LogHistogram()
+            histogram.add(value)
+
+    @staticmethod
+    def merge(acc, offset, other):
+        if other[offset] is not None:
+            if acc[offset] is None:
+                # histograms of the other query keep being updated, e.g. window buckets
+                acc[offset] = other[offset].copy()
+            else:
+                acc[offset].merge(other[offset])
+
+    def result(self, acc, offset):
+        return acc[offset].quantile(self.percent / 100.0) if acc[offset] is not None else None
+
+
+class PercentileAggregate(object):
+    """
+    sqlite aggregate function percentile(<value>, <percent>), e.g. for `query` commands.
+    """
+    def __init__(self):
+        self.histogram = LogHistogram()
+        self.percent = None
+
+    def step(self, value, percent):
+        self.percent = percent
+        value = to_number(value)
+        if value is not None:
+            self.histogram.add(value)
+
+    def finalize(self):
+        if self.percent is None:
+            return None
+        return self.histogram.quantile(self.percent / 100.0)
+
+
+def sort_key(index):
+    # sqlite orders NULL below any value
+    return lambda row: (row[index] is not None, row[index])
+
+
+class GroupAggregation(object):
+    """
+    Incremental equivalent of
+    `SELECT <group_by>, <columns> FROM log GROUP BY <group_by> ORDER BY <order_by> DESC LIMIT <limit>`.
+    """
+    def __init__(self, label, group_by, columns, order_by=None, limit=None):
+        self.label = label
+        self.group_by = list(group_by)
+        self.columns = list(columns)
+        self.order_by = order_by
+        self.limit = limit
+
+        # accumulators of all columns of a group are stored in a single flat list
+        self.initial = []
+        self.offsets = []
+        for column in self.columns:
+            self.offsets.append(len(self.initial))
+            self.initial.extend(column.initial)
+        self.slots = list(zip(self.columns, self.offsets))
+
+        self.groups = {}
+        if not self.group_by:
+            # like sqlite, an aggregation without group by always returns one row
+            self.groups[()] = list(self.initial)
+
+    def fresh(self):
+        """
+        Create the same query without any records.
+        :return: new GroupAggregation
+        """
+        return GroupAggregation(self.label, self.group_by, self.columns, self.order_by, self.limit)
+
+    def headers(self):
+        return self.group_by + [column.name for column in self.columns]
+
+    def sql(self):
+        selections = ', '.join(self.group_by + [column.sql() for column in self.columns])
+        query = 'SELECT %s FROM log' % selections
+        if self.group_by:
+            query += ' GROUP BY %s' % ', '.join(self.group_by)
+        if self.order_by:
+            query += ' ORDER BY %s DESC' % self.order_by
+        if self.limit:
+            query += ' LIMIT %d' % self.limit
+        return query
+
+    def update(self, record):
+        key = tuple([record.get(field) for field in self.group_by])
+        acc = self.groups.get(key)
+        if acc is None:
+            acc = self.groups[key] = list(self.initial)
+        for column, offset in self.slots:
+            column.update(acc, offset, record)
+
+    def merge(self, other):
+        """
+        Merge accumulators of the same query maintained by another processor.
+        :param other: GroupAggregation to merge
+        """
+        for key, other_acc in other.groups.items():
+            acc = self.groups.get(key)
+            if acc is None:
+                # merged column by column, accumulators may hold objects of the other query
+                acc = self.groups[key] = list(self.initial)
+            for column, offset in self.slots:
+                column.merge(acc, offset, other_acc)
+
+    def rows(self):
+        rows = [key + tuple([column.result(acc, offset) for column, offset in self.slots])
+                for key, acc in self.groups.items()]
+        if self.order_by:
+            key = sort_key(self.headers().index(self.order_by))
+            if self.limit:
+                return heapq.nlargest(self.limit, rows, key=key)
+            return sorted(rows, key=key, reverse=True)
+        if self.limit:
+            return rows[:self.limit]
+        return rows
+
+
+class ApproxTopAggregation(GroupAggregation):
+    """
+    Approximate `SELECT <group_by>, count(1) FROM log GROUP BY <group_by> ORDER BY count DESC LIMIT <limit>` in
+    fixed memory, for group-bys with too many distinct values (e.g. `top request_path` of hls fragments).
+
+    Groups are counted by a SpaceSaving sketch: counts may be overestimated, by at most the `max_error` column,
+    itself at most the number of records / capacity.
+    """
+    def __init__(self, label, group_by, limit=None, capacity=None):
+        GroupAggregation.__init__(self, label, group_by, [Count('count')], 'count', limit)
+        if capacity is None:
+            capacity = max(TOP_CAPACITY, 10 * (limit or 0))
+        self.capacity = capacity
+        self.sketch = SpaceSaving(capacity)
+        self.groups = {}
+
+    def fresh(self):
+        return ApproxTopAggregation(self.label, self.group_by, self.limit, self.capacity)
+
+    def headers(self):
+        return self.group_by + ['count', 'max_error']
+
+    def update(self, record):
+        self.sketch.add(tuple([record.get(field) for field in self.group_by]))
+
+    def merge(self, other):
+        self.sketch.merge(other.sketch)
+
+    def rows(self):
+        return [key + (count, error) for key, count, error in self.sketch.top(self.limit)]
@@ -0,0 +1,56 @@
+"""
+Time source of processors, reporters and stat polling.
+
+Wall clock time is only used for timestamps compared with the ones found in logs, durations, windows and schedules
+use a monotonic clock so they don't jump with the system clock. Both are in seconds.
+"""
+import time
+
+try:
+    monotonic = time.monotonic
+except AttributeError:
+    # python 2
+    monotonic = time.time
+
+
+class Clock(object):
+    """
+    Real time. Users read it once per batch of records or per report, tests inject their own.
+    """
+    @staticmethod
+    def time():
+        """
+        :return: wall clock time, epoch seconds
+        """
+        return time.time()
+
+    @staticmethod
+    def monotonic():
+        """
+        :return: monotonic time in seconds, only meaningful compared with another reading
+        """
+        return monotonic()
+
+
+CLOCK = Clock()
+
+
+class ResumedClock(object):
+    """
+    Clock of a processor restored from a previous run: monotonic time carries on from the one saved, the time spent
+    stopped counting as elapsed, so durations and windows computed from saved monotonic times stay meaningful.
+    """
+    def __init__(self, saved_time, saved_monotonic, clock=CLOCK):
+        """
+        :param saved_time: wall clock time when the state was saved
+        :param saved_monotonic: monotonic time of the saving processor at the same moment
+        :param clock: real time
+        """
+        self.clock = clock
+        self.shift = saved_monotonic + max(clock.time() - saved_time, 0) - clock.monotonic()
+
+    def time(self):
+        return self.clock.time()
+
+    def monotonic(self):
+        return self.clock.monotonic() + self.shift
@@ -0,0 +1,289 @@
+"""
+Columnar record storage with vectorized aggregation, the numpy engine of the print / top / avg / sum / percentile
+queries.
+
+Records are appended field by field to typed arrays: numeric fields as doubles (NULL being NaN), other fields as
+integer codes into a dictionary of their distinct values. Reports group and aggregate whole columns with numpy
+instead of updating a group per record, which pays off when analysing large logs with --no-follow.
+"""
+import array
+import logging
+from itertools import islice
+
+import tabulate
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+if __package__ is None:
+    from aggregator import Count, Avg, Min, Max, Percentile
+    from clock import CLOCK
+    from utils import to_number as read_number
+else:
+    from .aggregator import Count, Avg, Min, Max, Percentile
+    from .clock import CLOCK
+    from .utils import to_number as read_number
+
+# numeric fields of parsed records, integers are reported as such
+INTEGER_FIELDS = set(['status', 'status_type', 'bytes_sent'])
+FLOAT_FIELDS = set(['request_time'])
+NAN = float('nan')
+# records are appended to the columns a chunk at a time
+CHUNK_SIZE = 4096
+
+
+class NumericColumn(object):
+    def __init__(self, integer):
+        self.integer = integer
+        self.data = array.array('d')
+
+    def append_values(self, values):
+        self.data.extend([NAN if value is None else value for value in values])
+
+    def extend(self, other):
+        self.data.extend(other.data)
+
+    def values(self):
+        return numpy.frombuffer(self.data, dtype=numpy.float64) if self.data else numpy.empty(0)
+
+    def numbers(self):
+        return self.values()
+
+    def group_codes(self):
+        """
+        :return: (number of distinct values, code of the value of every record)
+        """
+        distinct, codes = numpy.unique(self.values(), return_inverse=True)
+        return len(distinct), codes.reshape(-1)
+
+    def equal(self, value):
+        return self.values() == value
+
+    def decode(self, index):
+        value = self.data[index]
+        if value != value:
+            return None
+        return int(value) if self.integer else value
+
+
+class EncodedColumn(object):
+    """
+    Column of any other values, stored as codes into a dictionary of distinct values.
+    """
+    def __init__(self):
+        self.codes = array.array('l')
+        self.index = {}
+        self.distinct = []
+
+    def code(self, value):
+        code = self.index.get(value)
+        if code is None:
+            code = self.index[value] = len(self.distinct)
+            self.distinct.append(value)
+        return code
+
+    def append_values(self, values):
+        get, code = self.index.get, self.code
+        codes = [get(value) for value in values]
+        if None in codes:
+            codes = [code(value) for value in values]
+        self.codes.extend(codes)
+
+    def extend(self, other):
+        mapping = numpy.array([self.code(value) for value in other.distinct], dtype=self.codes.typecode)
+        if other.codes:
+            self.codes.extend(array.array(self.codes.typecode, mapping[other.values()].tobytes()))
+
+    def values(self):
+        return numpy.frombuffer(self.codes, dtype=self.codes.typecode) if self.codes else numpy.empty(0, dtype=int)
+
+    def numbers(self):
+        """
+        Numeric values of the column, like sqlite reading text as numbers in sum and avg.
+        """
+        table = numpy.array([to_number(value) for value in self.distinct], dtype=numpy.float64)
+        return table[self.values()] if len(table) else numpy.empty(0)
+
+    def group_codes(self):
+        return len(self.distinct), self.values()
+
+    def equal(self, value):
+        code = self.index.get(value)
+        if code is None:
+            return numpy.zeros(len(self.codes), dtype=bool)
+        return self.values() == code
+
+    def decode(self, index):
+        return self.distinct[self.codes[index]]
+
+
+def to_number(value):
+    try:
+        value = read_number(value)
+        return float(value) if value is not None else NAN
+    except (TypeError, ValueError):
+        return NAN
+
+
+def create_column(field):
+    if field in INTEGER_FIELDS or field in FLOAT_FIELDS:
+        return NumericColumn(field in INTEGER_FIELDS)
+    return EncodedColumn()
+
+
+class ColumnarProcessor(object):
+    """
+    Processor of GroupAggregation report queries keeping records in columns and aggregating them with numpy.
+    """
+    def __init__(self, report_queries, fields, clock=CLOCK):
+        """
+        :param report_queries: GroupAggregation queries to report
+        :param fields: fields of records to keep
+        :param clock: time source, read once per batch of records and per report
+        """
+        if numpy is None:
+            raise ImportError('the numpy engine needs numpy')
+        self.clock = clock
+        # monotonic time of the first record
+        self.begin = False
+        self.report_queries = report_queries
+        self.fields = list(fields)
+        self.columns = dict((field, create_column(field)) for field in self.fields)
+        self.record_count = 0
+
+    def process(self, records):
+        if not self.begin:
+            self.begin = self.clock.monotonic()
+        columns = [(field, self.columns[field]) for field in self.fields]
+        records = iter(records)
+        while True:
+            chunk = list(islice(records, CHUNK_SIZE))
+            if not chunk:
+                return
+            self.record_count += len(chunk)
+            for field, column in columns:
+                column.append_values([r.get(field) for r in chunk])
+
+    def discard(self, records):
+        """
+        Records of departed clients are kept, the log is a history of requests.
+        """
+        pass
+
+    def merge(self, other):
+        """
+        Append records collected by another processor, e.g. a worker process parsing a part of the log.
+        :param other: ColumnarProcessor to merge
+        """
+        if other.begin and (not self.begin or other.begin < self.begin):
+            self.begin = other.begin
+        self.record_count += other.record_count
+        for field in self.fields:
+            self.columns[field].extend(other.columns[field])
+
+    def count(self):
+        return self.record_count
+
+    def group(self, group_by):
+        """
+        Find the group of every record.
+        :param group_by: fields to group by
+        :return: (number of groups, group of every record, index of a record of every group)
+        """
+        if not group_by:
+            return 1, numpy.zeros(self.record_count, dtype=numpy.intp), None
+        keys = numpy.zeros(self.record_count, dtype=numpy.int64)
+        for field in group_by:
+            size, codes = self.columns[field].group_codes()
+            keys = keys * size + codes
+        _, first, groups = numpy.unique(keys, return_index=True, return_inverse=True)
+        return len(first), groups.reshape(-1), first
+
+    def aggregate(self, column, groups, size):
+        """
+        Compute a column of a report query for every group.
+        :return: list of values, one per group
+        """
+        if isinstance(column, Count):
+            weights = None if column.field is None else self.columns[column.field].equal(column.value)
+            return [int(value) for value in numpy.bincount(groups, weights=weights, minlength=size)]
+
+        numbers = self.columns[column.field].numbers()
+        present = ~numpy.isnan(numbers)
+        counts = numpy.bincount(groups, weights=present, minlength=size)
+        if isinstance(column, Percentile):
+            results = self.percentile(numbers, present, groups, counts, column.percent / 100.0)
+        elif isinstance(column, Min):
+            # Max derives from Min
+            fill, function = (-numpy.inf, numpy.maximum) if isinstance(column, Max) else (numpy.inf, numpy.minimum)
+            results = numpy.full(size, fill)
+            function.at(results, groups, numpy.where(present, numbers, fill))
+        else:
+            results = numpy.bincount(groups, weights=numpy.where(present, numbers, 0), minlength=size)
+            if isinstance(column, Avg):
+                results = results / numpy.maximum(counts, 1)
+        integer = column.field in INTEGER_FIELDS and not isinstance(column, (Avg, Percentile))
+        return [(int(value) if integer else float(value)) if count else None
+                for value, count in zip(results, counts)]
+
+    @staticmethod
+    def percentile(numbers, present, groups, counts, q):
+        """
+        Exact percentile of every group, all values being at hand: the value of nearest rank once sorted.
+        :return: array of percentiles, one per group, undefined for groups without values
+        """
+        indexes = numpy.flatnonzero(present)
+        values = numbers[indexes][numpy.lexsort((numbers[indexes], groups[indexes]))]
+        counts = counts.astype(numpy.int64)
+        if not len(values):
+            return numpy.zeros(len(counts))
+        # same rank as percentile_rank
+        ranks = numpy.maximum(numpy.ceil(numpy.round(q * counts, 9)), 1).astype(numpy.int64)
+        positions = numpy.cumsum(counts) - counts + ranks - 1
+        return values[numpy.minimum(positions, len(values) - 1)]
+
+    def rows(self, query):
+        """
+        Run a report query over the columns.
+        :param query: GroupAggregation
+        :return: rows ordered and limited like the query
+        """
+        size, groups, first = self.group(query.group_by)
+        results = [self.aggregate(column, groups, size) for column in query.columns]
+        order = range(size)
+        if query.order_by:
+            index = [column.name for column in query.columns].index(query.order_by)
+            # NULL last, like sqlite ordering descending
+            keys = numpy.array([value if value is not None else -numpy.inf for value in results[index]])
+            order = numpy.argsort(-keys, kind='stable')
+        if query.limit:
+            order = order[:query.limit]
+
+        rows = []
+        for group in order:
+            key = tuple(self.columns[field].decode(first[group]) for field in query.group_by)
+            rows.append(key + tuple(result[group] for result in results))
+        return rows
+
+    def report(self, max_lines=None):
+        """
+        Build the report.
+        :param max_lines: number of lines of the screen, None for no limit
+        :return: report text
+        """
+        if not self.begin:
+            return ''
+        duration = self.clock.monotonic() - self.begin
+        count = self.count()
+        status = 'running for %.0f seconds, %d records processed: %.2f req/sec'
+        output = [status % (duration, count, count / duration if duration else 0)]
+        for query in self.report_queries:
+            logging.debug('columnar query for "%s"', query.label)
+            result = tabulate.tabulate(self.rows(query), headers=query.headers(), tablefmt='orgtbl', floatfmt='.3f')
+            output.append('%s\n%s' % (query.label, result))
+        output = '\n\n'.join(output)
+        if max_lines is not None:
+            output = '\n'.join(output.split('\n')[:max_lines])
+        return output
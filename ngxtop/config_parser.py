@@ -10,14 +10,29 @@ from pyparsing import Literal, Word, ZeroOrMore, OneOrMore, Group, \
 
 
 if __package__ is None:
-    from utils import choose_one, error_exit
+    from utils import error_exit
 else:
-    from .utils import choose_one, error_exit
+    from .utils import error_exit
 
 
 REGEX_SPECIAL_CHARS = r'([\.\*\+\?\|\(\)\{\}\[\]])'
 REGEX_LOG_FORMAT_VARIABLE = r'\$([a-zA-Z0-9\_]+)'
 
+# value patterns of variables with a well known shape
+VARIABLE_PATTERNS = {
+    'status': r'\d{3}|-',
+    'body_bytes_sent': r'\d+|-',
+    'bytes_sent': r'\d+|-',
+    'request_length': r'\d+|-',
+    'connection': r'\d+|-',
+    'connection_requests': r'\d+|-',
+    'request_time': r'[\d\.]+|-',
+    'msec': r'[\d\.]+|-',
+    'time_local': r'\d{2}/\w{3}/\d{4}:\d{2}:\d{2}:\d{2} [\+\-]\d{4}',
+}
+# delimiters nginx never leaves unescaped inside a variable value
+VARIABLE_DELIMITERS = [('"', '"'), ('[', ']')]
+
 """
 1. COMBINED
 
@@ -135,9 +150,9 @@ def get_log_formats(config):
 
 def detect_log_config(arguments):
     """
-    Detect access log config (path and format) of nginx. Offer user to select if multiple access logs are detected.
+    Detect access log config (paths and formats) of nginx.
     :param arguments: arguments from user input
-    :return: path and format of detected / selected access log
+    :return: list of (path, format) of every configured access log
     """
     config = arguments['--config']
     if config is None:
@@ -147,32 +162,24 @@ def detect_log_config(arguments):
 
     with open(config) as f:
         config_str = f.read()
-    access_logs = dict(get_access_logs(config_str))
-    if not access_logs:
-        error_exit('Access log file is not provided and ngxtop cannot detect it from your config file (%s).' % config)
-
     log_formats = dict(get_log_formats(config_str))
-    if len(access_logs) == 1:
-        log_path, format_name = list(access_logs.items())[0]
-        if format_name == 'combined':
-            return log_path, LOG_FORMAT_COMBINED
+    log_formats.setdefault('combined', LOG_FORMAT_COMBINED)
+    access_logs = []
+    for log_path, format_name in get_access_logs(config_str):
         if format_name not in log_formats:
             error_exit('Incorrect format name set in config for access log file "%s"' % log_path)
-        return log_path, log_formats[format_name]
-
-    # multiple access logs configured, offer to select one
-    print('Multiple access logs detected in configuration:')
-    log_path = choose_one(list(access_logs.keys()), 'Select access log file to process: ')
-    format_name = access_logs[log_path]
-    if format_name not in log_formats:
-        error_exit('Incorrect format name set in config for access log file "%s"' % log_path)
-    return log_path, log_formats[format_name]
+        if log_path not in [path for path, _ in access_logs]:
+            access_logs.append((log_path, log_formats[format_name]))
+    if not access_logs:
+        error_exit('Access log file is not provided and ngxtop cannot detect it from your config file (%s).' % config)
+    return access_logs
 
 
-def build_pattern(log_format):
+def build_pattern(log_format, fields=None):
     """
     Build regular expression to parse given format.
     :param log_format: format string to parse
+    :param fields: variables to capture, None to capture all of them
     :return: regular expression to parse given format
     """
     if log_format == 'combined':
@@ -183,9 +190,48 @@ def build_pattern(log_format):
         log_format = LOG_FORMAT_HLS_OUT
     elif log_format == 'hls_in':
         log_format = LOG_FORMAT_HLS_IN
-    pattern = re.sub(REGEX_SPECIAL_CHARS, r'\\\1', log_format)
-    pattern = re.sub(REGEX_LOG_FORMAT_VARIABLE, '(?P<\\1>.*)', pattern)
-    return re.compile(pattern)
+    # splitting on the (single group) variable regex alternates literals and variable names
+    parts = re.split(REGEX_LOG_FORMAT_VARIABLE, log_format)
+    pattern = []
+    for idx, part in enumerate(parts):
+        if idx % 2 == 0:
+            pattern.append(re.sub(REGEX_SPECIAL_CHARS, r'\\\1', part))
+        else:
+            variable_pattern = build_variable_pattern(part, parts[idx - 1], parts[idx + 1])
+            if fields is None or part in fields:
+                pattern.append('(?P<%s>%s)' % (part, variable_pattern))
+            else:
+                pattern.append('(?:%s)' % variable_pattern)
+    return re.compile(''.join(pattern))
+
+
+def build_binary_pattern(log_format, fields=None):
+    """
+    Build regular expression to parse given format straight from undecoded bytes.
+    :param log_format: format string to parse
+    :param fields: variables to capture, None to capture all of them
+    :return: bytes regular expression to parse given format
+    """
+    return re.compile(build_pattern(log_format, fields).pattern.encode('utf-8'))
+
+
+def build_variable_pattern(name, before, after):
+    """
+    Pick the tightest sub-pattern for a variable, so matching a line never has to backtrack over greedy groups.
+    :param name: variable name
+    :param before: literal text preceding the variable in the format string
+    :param after: literal text following the variable in the format string
+    :return: regular expression matching the value of the variable
+    """
+    if name in VARIABLE_PATTERNS:
+        return VARIABLE_PATTERNS[name]
+    if not after:
+        # last variable of the line, take everything left
+        return '.*'
+    for opening, closing in VARIABLE_DELIMITERS:
+        if before.endswith(opening) and after.startswith(closing):
+            return '[^%s]*' % re.escape(closing)
+    return '.*?'
 
 
 def extract_variables(log_format):
@@ -1,57 +1,133 @@
 """
 Records and statistic processor - dict
 """
-import re
-import time
-import calendar
-from datetime import datetime
-from dateutil import parser
+import heapq
+import math
 
 if __package__ is None:
-    from utils import to_int
-    from config_parser import REGEX_LOG_FORMAT_VARIABLE, REGEX_SPECIAL_CHARS
+    from clock import CLOCK
+    from utils import intern, to_int, to_float, parse_time_local
+    from aggregator import PERCENTILES
+    from sketch import HyperLogLog, LogHistogram, SpaceSaving, TOP_CAPACITY
+    from streams import StreamClassifier
+    from window import RateRing, TimeBuckets, RATE_INTERVAL, RATE_SLOTS, interval
 else:
-    from .utils import to_int
-    from .config_parser import REGEX_LOG_FORMAT_VARIABLE, REGEX_SPECIAL_CHARS
-
-REGEX_GET_STREAM = 'GET /live/$stream.m3u8 HTTP/1.1'
-REGEX_GET_STREAM_TS = 'GET /live/$stream-$frag.ts HTTP/1.1'
-TOTAL_SUMMARY_INFO = '\tClients: %d OutMBytes: %d OutKBytes/s %d Time %ds\n'
-STREAM_SUMMARY_INFO = '\tStream: %s OutMBytes: %d OutKBytes/s %d Time %ds\n'
-CLIENT_SUMMARY_INFO = '\t\tClient: %s Info: %s Time %ds\n'
+    from .clock import CLOCK
+    from .utils import intern, to_int, to_float, parse_time_local
+    from .aggregator import PERCENTILES
+    from .sketch import HyperLogLog, LogHistogram, SpaceSaving, TOP_CAPACITY
+    from .streams import StreamClassifier
+    from .window import RateRing, TimeBuckets, RATE_INTERVAL, RATE_SLOTS, interval
+
+TOTAL_SUMMARY_INFO = '\tClients: %d OutMBytes: %d OutKBytes/s %d Time %ds'
+STREAM_SUMMARY_INFO = '\tStream: %s OutMBytes: %d OutKBytes/s %d Time %ds'
+LATENCY_INFO = ' Latency ' + ' '.join('p%d %%.3fs' % percent for percent in PERCENTILES)
+STREAM_RATE_INFO = ' NowKBytes/s %d AvgKBytes/s %d Req/s %.1f |%s|'
+CLIENT_RATE_INFO = ' NowKBytes/s %d |%s|'
+# the client rates, if any, come before the user agent which often runs off the screen
+CLIENT_SUMMARY_INFO = '\t\tClient: %s%s Info: %s Time %ds'
+WINDOW_SUMMARY_INFO = '\tLast %ds: Clients: %d OutMBytes: %d OutKBytes/s %d'
+MORE_STREAMS_INFO = '\t... %d more streams'
+MORE_CLIENTS_INFO = '\t\t... %d more clients'
+# sparkline levels, from no traffic to the busiest interval of the line, ascii to display on any terminal
+SPARK_CHARS = ' _.-=+*#'
+# intervals of the rate ring of every client, float counts keep it small
+CLIENT_RATE_SLOTS = 10
+
+# --order-by of the report: (stream sort key, client sort key), both called with the report time
+ORDER_KEYS = {
+    'count': (lambda stream, now: stream.client_count(), lambda client, now: now - client.join_ts),
+    'bandwidth': (lambda stream, now: stream.out_bw,
+                  lambda client, now: client.out_bytes / max(now - client.join_ts, 1)),
+    'bytes': (lambda stream, now: stream.out_bytes, lambda client, now: client.out_bytes),
+    'duration': (lambda stream, now: now - (stream.start_ts or now), lambda client, now: now - client.join_ts),
+}
+
+
+# timestamps are epoch seconds, durations seconds, byte counts bytes and bandwidths bytes per second
+
+
+def sparkline(values):
+    """
+    :return: one character per value, scaled to the largest one
+    """
+    top = max(values)
+    if not top:
+        return SPARK_CHARS[0] * len(values)
+    # any traffic shows, only empty intervals are blank
+    levels = len(SPARK_CHARS) - 1
+    scale = levels / float(top)
+    return ''.join(SPARK_CHARS[min(int(math.ceil(value * scale)), levels)] for value in values)
 
 
 class ClientInfo(object):
+    # hundreds of thousands of clients are tracked on busy hls edges, keep them compact
+    __slots__ = ('name', 'join_ts', 'status', 'detail', 'out_bytes', 'last_bucket', 'rates')
+
     def __init__(self, name):
         self.name = name
         self.join_ts = None
         self.status = None
         self.detail = ''
+        # bytes of the client's own requests, rtmp stream counters aren't split between clients
+        self.out_bytes = 0
+        # index of the window bucket the client was last seen in
+        self.last_bucket = None
+        # bytes and requests of recent intervals
+        self.rates = RateRing(CLIENT_RATE_SLOTS, 'f')
 
     @staticmethod
     def parse_time(time_str):
-        return calendar.timegm(parser.parse(time_str.replace(':', ' ', 1)).utctimetuple())
+        return parse_time_local(time_str)
 
-    def parse_info(self, records):
+    def parse_info(self, records, now):
+        """
+        :param records: record of the client
+        :param now: wall clock time the record is processed at
+        """
         if self.join_ts is None:
             if 'time' in records:
-                self.join_ts = calendar.timegm(datetime.utcfromtimestamp(time.time()).utctimetuple()) - \
-                               to_int(records['time']) * 1000
+                # milliseconds the rtmp client has been connected for
+                self.join_ts = now - to_int(records['time']) / 1000.0
             elif 'time_local' in records:
                 self.join_ts = self.parse_time(records['time_local'])
             else:
-                self.join_ts = calendar.timegm(datetime.utcfromtimestamp(time.time()).utctimetuple())
+                self.join_ts = now
 
         if 'status' in records:
             status = to_int(records['status'])
             self.status = status
 
         if 'http_user_agent' in records:
-            self.detail = records['http_user_agent']
+            detail = records['http_user_agent']
+            if detail != self.detail:
+                # user agents are shared by many clients
+                self.detail = intern(detail)
+
+    def merge(self, other):
+        """
+        Merge info of the same client collected by another processor.
+        :param other: ClientInfo to merge
+        """
+        if self.join_ts is None or (other.join_ts is not None and other.join_ts < self.join_ts):
+            self.join_ts = other.join_ts
+        self.out_bytes += other.out_bytes
+        self.rates.merge(other.rates)
+        if other.status is not None:
+            self.status = other.status
+        if other.detail:
+            self.detail = other.detail
 
 
 class StreamInfo(object):
-    def __init__(self, name):
+    __slots__ = ('name', 'in_bytes', 'in_bw', 'out_bytes', 'out_bw', 'start_ts', 'clients', 'heavy', 'distinct',
+                 'latency', 'rates')
+
+    def __init__(self, name, capacity=None):
+        """
+        :param name: stream name
+        :param capacity: number of clients tracked in approximate mode, the most active ones, None to track all
+        """
         self.name = name
         self.in_bytes = 0
         self.in_bw = 0
@@ -61,113 +137,336 @@ class StreamInfo(object):
 
         # request_path - ClientInfo
         self.clients = {}
-
-    def parse_info(self, records):
-        if 'remote_addr' not in records:
-            return
-
-        client = records['remote_addr']
+        # approximate mode: requests of tracked clients and distinct count of all of them
+        self.heavy = self.distinct = None
+        if capacity is not None:
+            self.heavy = SpaceSaving(capacity)
+            self.distinct = HyperLogLog()
+        # histogram of request_time, when the access log has it
+        self.latency = None
+        # bytes and requests of recent intervals
+        self.rates = RateRing()
+
+    def client_count(self):
+        if self.distinct is None:
+            return len(self.clients)
+        return max(self.distinct.count(), len(self.clients))
+
+    def forget(self, client):
+        """
+        Stop tracking a client.
+        """
+        self.clients.pop(client, None)
+        if self.heavy is not None:
+            self.heavy.discard(client)
+
+    def parse_info(self, records, now, index=None):
+        """
+        :param records: record of the stream
+        :param now: wall clock time the record is processed at
+        :param index: rate interval of the record, the one of now by default
+        """
+        if index is None:
+            index = interval(now)
+        # records of the rtmp stat diff may only carry stream counters
         client_info = None
-        if client not in self.clients:
-            client_info = ClientInfo(client)
-            client_info.parse_info(records)
-            self.clients[client] = client_info
-        else:
-            client_info = self.clients[client]
-            client_info.parse_info(records)
-
-        if self.start_ts == 0 or self.start_ts > client_info.join_ts:
-            self.start_ts = client_info.join_ts
-
-        duration = calendar.timegm(datetime.utcfromtimestamp(time.time()).utctimetuple()) - self.clients[client].join_ts
+        if 'remote_addr' in records:
+            client = records['remote_addr']
+            client_info = self.clients.get(client)
+            if client_info is None:
+                client_info = self.clients[client] = ClientInfo(client)
+                if self.distinct is not None:
+                    self.distinct.add(client)
+            if self.heavy is not None:
+                evicted = self.heavy.add(client)
+                if evicted is not None:
+                    del self.clients[evicted]
+            client_info.parse_info(records, now)
+
+            if self.start_ts == 0 or self.start_ts > client_info.join_ts:
+                self.start_ts = client_info.join_ts
+
+        request_time = records.get('request_time')
+        if request_time is not None:
+            if self.latency is None:
+                self.latency = LogHistogram()
+            self.latency.add(request_time)
 
         if 'in_bytes' in records:
             self.in_bytes += to_int(records['in_bytes'])
 
         if 'in_bw' in records:
-            self.in_bw = to_int(records['in_bw'])
+            self.in_bw = to_float(records['in_bw'])
 
         if 'out_bytes' in records:
-            self.out_bytes += to_int(records['out_bytes'])
+            # rtmp stat counters since the previous snapshot
+            out_bytes = to_int(records['out_bytes'])
+            self.out_bytes += out_bytes
+            self.rates.add(index, out_bytes, 0)
         elif 'bytes_sent' in records:
-            self.out_bytes += to_int(records['body_bytes_sent'])
+            sent = to_int(records['body_bytes_sent'] if 'body_bytes_sent' in records else records['bytes_sent'])
+            self.out_bytes += sent
+            self.rates.add(index, sent)
+            if client_info is not None:
+                client_info.out_bytes += sent
+                client_info.rates.add(index, sent)
 
         if 'out_bw' in records:
-            self.out_bw = to_int(records['out_bw'])
+            self.out_bw = to_float(records['out_bw'])
         else:
-            if duration > 0:
-                self.out_bw = self.out_bytes / duration * 1000 / 1024.0
+            # average since the first client joined
+            duration = now - self.start_ts
+            self.out_bw = self.out_bytes / duration if duration > 0 else float(self.out_bytes)
+
+    def merge(self, other):
+        """
+        Merge info of the same stream collected by another processor.
+        :param other: StreamInfo to merge
+        """
+        self.in_bytes += other.in_bytes
+        self.out_bytes += other.out_bytes
+        self.in_bw = max(self.in_bw, other.in_bw)
+        self.out_bw = max(self.out_bw, other.out_bw)
+        self.rates.merge(other.rates)
+        if self.start_ts == 0 or 0 < other.start_ts < self.start_ts:
+            self.start_ts = other.start_ts
+
+        if other.latency is not None:
+            if self.latency is None:
+                self.latency = LogHistogram()
+            self.latency.merge(other.latency)
+
+        for name, client_info in other.clients.items():
+            if name in self.clients:
+                self.clients[name].merge(client_info)
             else:
-                self.out_bw = self.out_bytes / 1024.0
+                self.clients[name] = client_info
+
+        if self.heavy is not None and other.heavy is not None:
+            self.heavy.merge(other.heavy)
+            self.distinct.merge(other.distinct)
+            for name in [name for name in self.clients if name not in self.heavy]:
+                del self.clients[name]
 
 
 class DictProcessor(object):
-    def __init__(self):
+    # record fields read by the processor
+    fields = ('request', 'remote_addr', 'time', 'time_local', 'status', 'http_user_agent',
+              'in_bytes', 'in_bw', 'out_bytes', 'out_bw', 'bytes_sent', 'body_bytes_sent')
+
+    def __init__(self, window=0, clock=CLOCK, limit=None, order_by='count', stream_patterns=None, approx=False,
+                 latency=False):
+        """
+        :param window: seconds clients are kept for after they were last seen, 0 to keep them forever
+        :param clock: time source, read once per batch of records and per report
+        :param limit: number of streams, and of clients per stream, listed in reports, None to list all of them
+        :param order_by: order of streams and clients in reports, one of ORDER_KEYS
+        :param stream_patterns: request path patterns of hls streams, see StreamClassifier
+        :param approx: only track the most active clients of every stream and estimate the number of clients, in
+        fixed memory per stream
+        :param latency: report percentiles of request_time per stream, only when the access log has it as it would be
+        0 otherwise
+        """
+        if order_by not in ORDER_KEYS:
+            raise ValueError('order must be one of %s: %s' % (', '.join(sorted(ORDER_KEYS)), order_by))
+        if approx and window:
+            raise ValueError('clients can\'t be dropped from approximate counts, no window in approximate mode')
+        if latency:
+            self.fields = DictProcessor.fields + ('request_time',)
+        # clients tracked per stream
+        self.capacity = TOP_CAPACITY if approx else None
+        self.clock = clock
+        self.limit = limit
+        self.order_by = order_by
+        # monotonic time of the first record
         self.begin = False
-        self.patterns = []
-
-        pattern = re.sub(REGEX_SPECIAL_CHARS, r'\\\1', REGEX_GET_STREAM)
-        pattern = re.sub(REGEX_LOG_FORMAT_VARIABLE, '(?P<\\1>.*)', pattern)
-        pattern = re.compile(pattern)
-        self.patterns.append(pattern)
-        pattern = re.sub(REGEX_SPECIAL_CHARS, r'\\\1', REGEX_GET_STREAM_TS)
-        pattern = re.sub(REGEX_LOG_FORMAT_VARIABLE, '(?P<\\1>.*)', pattern)
-        pattern = re.compile(pattern)
-        self.patterns.append(pattern)
+        # request -> stream name
+        self.get_stream = StreamClassifier(stream_patterns)
 
         # stream - StreamInfo
         self.streams = {}
 
-    def process(self, records):
-        self.begin = time.time()
+        # clients not seen for a whole window are dropped, bucket by bucket
+        self.buckets = None
+        if window:
+            self.buckets = TimeBuckets(window, self.create_bucket)
+            self.roll(clock.monotonic())
 
+    @staticmethod
+    def create_bucket(index):
+        # (bucket index, (stream, client) seen in the bucket, stream - bytes sent in the bucket)
+        return index, set(), {}
+
+    def roll(self, now):
+        """
+        Move to the window bucket covering given time and drop clients only seen in the expired buckets.
+        :param now: monotonic time
+        """
+        for index, seen, _ in self.buckets.advance(now):
+            for stream, client in seen:
+                stream_info = self.streams.get(stream)
+                if stream_info is None:
+                    continue
+                client_info = stream_info.clients.get(client)
+                if client_info is not None and client_info.last_bucket == index:
+                    del stream_info.clients[client]
+                    if not stream_info.clients:
+                        del self.streams[stream]
+
+    def track(self, stream_info, record, out_bytes):
+        """
+        Record activity of a client in the current window bucket.
+        :param stream_info: stream the record belongs to
+        :param record: processed record
+        :param out_bytes: bytes the record added to the stream
+        """
+        index, seen, stream_bytes = self.buckets.current
+        stream_bytes[stream_info.name] = stream_bytes.get(stream_info.name, 0) + out_bytes
+
+        client = record.get('remote_addr')
+        client_info = stream_info.clients.get(client)
+        if client_info is not None:
+            client_info.last_bucket = index
+            seen.add((stream_info.name, client))
+
+    def process(self, records):
+        # records of a batch are processed at the same time
+        now, monotonic = self.clock.time(), self.clock.monotonic()
+        if not self.begin:
+            self.begin = monotonic
+        if self.buckets is not None and monotonic >= self.buckets.end:
+            self.roll(monotonic)
+
+        # rate interval of records: the one of their time_local, which consecutive records nearly always share, or
+        # the one of now for records without it
+        now_index = index = interval(now)
+        time_local = None
         for record in records:
             if 'request' not in record:
                 return
 
-            stream = 'none'
-            match = None
-            for pattern in self.patterns:
-                match = pattern.match(record['request'])
-                if match is not None:
-                    break
-
-            if match is not None:
-                stream = match.groupdict()['stream']
-            else:
-                stream = record['request']
-
-            if stream not in self.streams:
-                stream_info = StreamInfo(stream)
-                stream_info.parse_info(record)
-                self.streams[stream] = stream_info
-            else:
-                self.streams[stream].parse_info(record)
-
-    def report(self):
-        output = 'Summary:\n'
-
-        client_cnt = out_bytes = out_bw = run_time = 0
-        stream_output = ''
-        for stream in self.streams.itervalues():
-            client_cnt += len(stream.clients)
-            out_bytes += stream.out_bytes
-            out_bw += stream.out_bw
-            if run_time != 0:
-                run_time = min(stream.start_ts, run_time)
+            stream = self.get_stream(record['request'])
+            stream_info = self.streams.get(stream)
+            if stream_info is None:
+                stream = intern(stream)
+                stream_info = self.streams[stream] = StreamInfo(stream, self.capacity)
+            out_bytes = stream_info.out_bytes
+            if record.get('time_local') != time_local:
+                time_local = record.get('time_local')
+                index = now_index
+                if time_local is not None:
+                    try:
+                        index = interval(parse_time_local(time_local))
+                    except ValueError:
+                        pass
+            stream_info.parse_info(record, now, index)
+
+            if self.buckets is not None:
+                self.track(stream_info, record, stream_info.out_bytes - out_bytes)
+
+    def discard(self, records):
+        """
+        Forget clients which left, e.g. as found by diffing rtmp stat snapshots. Streams left without clients go too.
+        :param records: records with the request and remote_addr of the departed clients
+        """
+        for record in records:
+            stream = self.get_stream(record['request'])
+            stream_info = self.streams.get(stream)
+            if stream_info is None:
+                continue
+            stream_info.forget(record.get('remote_addr'))
+            if not stream_info.clients:
+                del self.streams[stream]
+
+    def merge(self, other):
+        """
+        Merge streams collected by another processor, e.g. a worker process parsing a part of the log.
+        :param other: DictProcessor to merge
+        """
+        if other.begin and (not self.begin or other.begin < self.begin):
+            self.begin = other.begin
+
+        for name, stream_info in other.streams.items():
+            if name in self.streams:
+                self.streams[name].merge(stream_info)
             else:
-                run_time = stream.start_ts
-
-            stream_output += STREAM_SUMMARY_INFO % (
-                stream.name, stream.out_bytes / 1024.0 / 1024.0, stream.out_bw, (calendar.timegm(
-                    datetime.utcfromtimestamp(time.time()).utctimetuple()) - stream.start_ts) / 1000)
-
-            for client in stream.clients.itervalues():
-                stream_output += CLIENT_SUMMARY_INFO % (client.name, client.detail, (calendar.timegm(
-                    datetime.utcfromtimestamp(time.time()).utctimetuple()) - client.join_ts) / 1000)
-
-        run_time = (calendar.timegm(datetime.utcfromtimestamp(time.time()).utctimetuple()) - run_time) / 1000
-        output += TOTAL_SUMMARY_INFO % (client_cnt, out_bytes / 1024.0 / 1024.0, out_bw, run_time)
-        output += '\nDetail:\n'
-        output += stream_output
-        return output
+                self.streams[name] = stream_info
+
+    def top(self, items, key, now, room=None):
+        """
+        Pick the items listed in a report, O(n log limit).
+        :param items: streams or clients
+        :param key: sort key called with an item and the report time
+        :param now: report time
+        :param room: number of lines left on screen, None for no limit
+        :return: list of items, in report order
+        """
+        sort_key = lambda item: key(item, now)
+        limits = [n for n in (self.limit, room) if n is not None]
+        if not limits:
+            return sorted(items, key=sort_key, reverse=True)
+        return heapq.nlargest(min(limits), items, key=sort_key)
+
+    def report(self, max_lines=None):
+        """
+        Build the report, listing only what fits in given number of lines.
+        :param max_lines: number of lines of the screen, None for no limit
+        :return: report text
+        """
+        now, monotonic = self.clock.time(), self.clock.monotonic()
+        if self.buckets is not None:
+            self.roll(monotonic)
+
+        streams = list(self.streams.values())
+        client_cnt = sum(stream.client_count() for stream in streams)
+        out_bytes = sum(stream.out_bytes for stream in streams)
+        out_bw = sum(stream.out_bw for stream in streams)
+        start_ts = min([stream.start_ts for stream in streams if stream.start_ts] or [now])
+        lines = ['Summary:', TOTAL_SUMMARY_INFO % (client_cnt, out_bytes / 1024.0 / 1024.0, out_bw / 1024.0,
+                                                   now - start_ts)]
+        if self.buckets is not None:
+            window_bytes = sum(sum(stream_bytes.values()) for _, _, stream_bytes in self.buckets.values())
+            window_time = max(min(self.buckets.window, monotonic - self.begin), 1) if self.begin else 1
+            lines.append(WINDOW_SUMMARY_INFO % (self.buckets.window, client_cnt, window_bytes / 1024.0 / 1024.0,
+                                                window_bytes / 1024.0 / window_time))
+        lines.append('')
+        lines.append('Detail:')
+
+        # rates of a log ending before the time covered by the rings (--no-follow) are shown as of its end
+        latest = max([stream.rates.last for stream in streams if stream.rates.last is not None] or [None])
+        rate_time = now
+        if latest is not None and now - latest * RATE_INTERVAL > RATE_SLOTS * RATE_INTERVAL:
+            rate_time = (latest + 1) * RATE_INTERVAL
+
+        stream_key, client_key = ORDER_KEYS[self.order_by]
+        room = lambda: max_lines - len(lines) if max_lines is not None else None
+        listed = 0
+        for stream in self.top(streams, stream_key, now, room()):
+            if max_lines is not None and len(lines) >= max_lines:
+                break
+            listed += 1
+            line = STREAM_SUMMARY_INFO % (stream.name, stream.out_bytes / 1024.0 / 1024.0, stream.out_bw / 1024.0,
+                                          now - (stream.start_ts or now))
+            rates = stream.rates
+            line += STREAM_RATE_INFO % (rates.rate(rate_time) / 1024.0, rates.rate(rate_time, len(rates)) / 1024.0,
+                                        rates.rate(rate_time, requests=True), sparkline(rates.series(rate_time)))
+            if stream.latency is not None:
+                line += LATENCY_INFO % tuple(stream.latency.quantile(percent / 100.0) for percent in PERCENTILES)
+            lines.append(line)
+            clients = self.top(stream.clients.values(), client_key, now, room())
+            for client in clients:
+                rates = ''
+                if client.rates.last is not None:
+                    # rtmp clients only have the counters of their stream
+                    rates = CLIENT_RATE_INFO % (client.rates.rate(rate_time) / 1024.0,
+                                                sparkline(client.rates.series(rate_time)))
+                lines.append(CLIENT_SUMMARY_INFO % (client.name, rates, client.detail, now - client.join_ts))
+            if stream.client_count() > len(clients):
+                lines.append(MORE_CLIENTS_INFO % (stream.client_count() - len(clients)))
+        if len(streams) > listed:
+            lines.append(MORE_STREAMS_INFO % (len(streams) - listed))
+
+        if max_lines is not None:
+            lines = lines[:max_lines]
+        lines.append('')
+        return '\n'.join(lines)
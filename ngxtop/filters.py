@@ -0,0 +1,132 @@
+"""
+Filter and pre-filter expressions compiled once into functions.
+
+Names of a filter expression are record fields. The expression is compiled into a function taking those fields as
+arguments, fetched from every record with a single itemgetter, instead of evaluating its source against each record.
+
+Simple predicates of a filter are also turned into substrings every matching line has to contain, so most lines
+filtered out are dropped before the log format pattern is even tried on them.
+"""
+import ast
+import operator
+
+try:
+    import __builtin__ as builtins
+except ImportError:
+    import builtins
+
+# fields computed from the line which don't appear in it as is
+NOT_IN_LINE = set(['status_type', 'bytes_sent'])
+# marks a node which isn't a literal
+NOT_LITERAL = object()
+
+
+def expression_names(expression):
+    """
+    Get names an expression reads, other than builtins.
+    :param expression: python expression source
+    :return: sorted list of names
+    """
+    tree = ast.parse(expression.strip(), '<filter>', 'eval')
+    names = set(node.id for node in ast.walk(tree) if isinstance(node, ast.Name))
+    return sorted(name for name in names if not hasattr(builtins, name))
+
+
+def compile_function(expression, names):
+    """
+    Compile an expression into a function of given names.
+    """
+    source = 'lambda %s: (%s)' % (', '.join(names), expression.strip())
+    return eval(compile(source, '<filter>', 'eval'), {})
+
+
+def compile_filter(expression):
+    """
+    Compile a filter expression on record fields.
+    :param expression: python expression, e.g. `status >= 400`
+    :return: function telling whether a record satisfies the expression
+    """
+    names = expression_names(expression)
+    function = compile_function(expression, names)
+    if not names:
+        value = bool(function())
+        return lambda record: value
+    getter = operator.itemgetter(*names)
+    if len(names) == 1:
+        return lambda record: function(getter(record))
+    return lambda record: function(*getter(record))
+
+
+def compile_pre_filter(expression):
+    """
+    Compile a pre-filter expression on the raw line.
+    :param expression: python expression of `line`, e.g. `'/live/' in line`
+    :return: function telling whether a line satisfies the expression
+    """
+    return compile_function(expression, ['line'])
+
+
+def literal(node):
+    try:
+        return ast.literal_eval(node)
+    except ValueError:
+        return NOT_LITERAL
+
+
+def field_name(node):
+    if isinstance(node, ast.Name) and node.id not in NOT_IN_LINE and not hasattr(builtins, node.id):
+        return node.id
+    return None
+
+
+def predicate_hint(node):
+    """
+    Get a substring implied by a simple predicate: `field == 'text'`, `'text' in field`, `field.startswith('text')`,
+    `field.endswith('text')` and `status == 404`.
+    :return: the substring, None if the predicate doesn't imply any
+    """
+    if isinstance(node, ast.Compare) and len(node.ops) == 1:
+        left, op, right = node.left, node.ops[0], node.comparators[0]
+        if isinstance(op, ast.Eq):
+            if field_name(left) is None:
+                left, right = right, left
+            name, value = field_name(left), literal(right)
+            if name is None:
+                return None
+        elif isinstance(op, ast.In):
+            name, value = field_name(right), literal(left)
+            if name is None or not isinstance(value, str):
+                return None
+        else:
+            return None
+    elif isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and len(node.args) == 1 \
+            and node.func.attr in ('startswith', 'endswith') and not node.keywords:
+        name, value = field_name(node.func.value), literal(node.args[0])
+        if name is None or not isinstance(value, str):
+            return None
+    else:
+        return None
+
+    if isinstance(value, str) and value:
+        return value
+    # numbers are only written as is for the status, `-` is read as 0
+    if name == 'status' and isinstance(value, int) and not isinstance(value, bool) and value > 0:
+        return str(value)
+    return None
+
+
+def line_hints(expression):
+    """
+    Get substrings every line satisfying a filter expression contains, from the simple predicates of the top level
+    conjunction of the expression.
+    :param expression: filter expression
+    :return: list of substrings, empty if nothing is known
+    """
+    node = ast.parse(expression.strip(), '<filter>', 'eval').body
+    predicates = node.values if isinstance(node, ast.BoolOp) and isinstance(node.op, ast.And) else [node]
+    hints = []
+    for predicate in predicates:
+        hint = predicate_hint(predicate)
+        if hint is not None and hint not in hints:
+            hints.append(hint)
+    return hints
@@ -1,9 +1,9 @@
 """
 Nginx access.log parser.
 """
+import glob
 import os
 import sys
-import time
 import logging
 
 try:
@@ -12,114 +12,294 @@ except ImportError:
     import urllib.parse as urlparse
 
 if __package__ is None:
-    from config_parser import detect_log_config, build_pattern
+    from config_parser import detect_log_config, build_pattern, build_binary_pattern, extract_variables
+    from filters import compile_filter, compile_pre_filter, expression_names, line_hints
+    from parallel import parallel_process
+    from sources import GzipSource, MmapSource, merge_by_time
+    from state import file_position, resume_offset
+    from tail import MultiTailer, Tailer
     from utils import error_exit, to_float, to_int
 else:
-    from .config_parser import detect_log_config, build_pattern
+    from .config_parser import detect_log_config, build_pattern, build_binary_pattern, extract_variables
+    from .filters import compile_filter, compile_pre_filter, expression_names, line_hints
+    from .parallel import parallel_process
+    from .sources import GzipSource, MmapSource, merge_by_time
+    from .state import file_position, resume_offset
+    from .tail import MultiTailer, Tailer
     from .utils import error_exit, to_float, to_int
 
 
+# fields added by parse_log and the fields they are computed from
+DERIVED_FIELDS = {
+    'status_type': ('status',),
+    'bytes_sent': ('body_bytes_sent',),
+    'request_path': ('request_uri', 'request'),
+}
+# fields converted from the text captured in the line, records without a valid value are dropped
+CONVERTED_FIELDS = {
+    'status': to_int,
+    'bytes_sent': to_int,
+    'request_time': to_float,
+}
+
+
+def parse_request_path(record):
+    if 'request_uri' in record:
+        uri = record['request_uri']
+    elif 'request' in record:
+        uri = ' '.join(record['request'].split(' ')[1:-1])
+    else:
+        uri = None
+    return urlparse.urlparse(uri).path if uri else None
+
+
+def parse_status_type(record):
+    return record['status'] // 100 if 'status' in record else None
+
+
+# fields computed when missing from the line, in order of computation
+DERIVATIONS = [
+    ('status', lambda record: 0),
+    ('request_time', lambda record: 0.0),
+    ('bytes_sent', lambda record: to_int(record.get('body_bytes_sent'))),
+    ('status_type', parse_status_type),
+    ('request_path', parse_request_path),
+]
+
+
+class LogRecord(dict):
+    """
+    Record of a parsed line, used when the fields read from records aren't known.
+
+    Derived fields are computed on first access only, so records never pay for fields nobody reads.
+    """
+    __slots__ = ()
+
+    derive = dict(DERIVATIONS)
+
+    def __missing__(self, key):
+        derive = self.derive.get(key)
+        if derive is None:
+            raise KeyError(key)
+        value = self[key] = derive(self)
+        return value
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in self.derive
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+def expand_paths(access_logs):
+    """
+    Expand globs of access log paths, e.g. `/var/log/nginx/*.access.log*` matching rotated and compressed logs too.
+    :param access_logs: list of (path or glob, log format)
+    :return: list of (path, log format) of every file, in path order for each glob
+    """
+    expanded = []
+    for pattern, log_format in access_logs:
+        if pattern == 'stdin':
+            expanded.append((pattern, log_format))
+            continue
+        paths = sorted(glob.glob(pattern))
+        if not paths:
+            error_exit('access log file "%s" does not exist' % pattern)
+        expanded.extend((path, log_format) for path in paths if path not in [p for p, _ in expanded])
+    return expanded
+
+
+def is_compressed(path):
+    return path.endswith('.gz')
+
+
 class NginxHttpInfo(object):
     def __init__(self, arguments):
         self.arguments = arguments
         self.processor = None
+        # (path, log format) of every access log, and the path of the first one
+        self.access_logs = None
         self.access_log = None
-        self.pattern = None
+        # log format - pattern
+        self.patterns = {}
+        self.binary_patterns = {}
+        # fields captured by the patterns, False before they are built
+        self.projection = False
+        # called with the (inode, offset) position the processor covers the access log up to
+        self.checkpoint = None
+        # position reached by a previous run, and the processor as it was before its state was restored
+        self.position = None
+        self.empty_processor = None
 
     @staticmethod
-    def map_field(field, func, dict_sequence):
+    def convert_fields(records, captured, fields):
         """
-        Apply given function to value of given key in every dictionary in sequence and
-        set the result as new value for that key.
-        :param field:
-        :param func:
-        :param dict_sequence:
+        Convert captured text of numeric fields and add derived fields, dropping records with invalid values.
+        :param records: records with captured fields only
+        :param captured: fields captured by the pattern
+        :param fields: fields to derive, None if records derive them lazily
+        :return: iterator over complete records
         """
-        for item in dict_sequence:
+        conversions = [(field, func) for field, func in CONVERTED_FIELDS.items() if field in captured]
+        derivations = [(field, func) for field, func in DERIVATIONS if fields is not None and field in fields]
+        for record in records:
             try:
-                item[field] = func(item.get(field, None))
-                yield item
+                for field, func in conversions:
+                    record[field] = func(record[field])
             except ValueError:
-                pass
+                continue
+            for field, func in derivations:
+                if field not in record:
+                    record[field] = func(record)
+            yield record
 
-    @staticmethod
-    def add_field(field, func, dict_sequence):
+    def set_processor(self, processor):
+        self.processor = processor
+
+    def set_state(self, checkpoint, position=None, empty_processor=None):
         """
-        Apply given function to the record and store result in given field of current record.
-        Do nothing if record already contains given field.
-        :param field:
-        :param func:
-        :param dict_sequence:
+        Resume from a saved state and save it as parsing goes.
+        :param checkpoint: function called with the position reached and whether saving can't be postponed
+        :param position: (inode, offset) reached by the previous run, None to start as usual
+        :param empty_processor: processor before the saved one was restored
         """
-        for item in dict_sequence:
-            if field not in item:
-                item[field] = func(item)
-            yield item
+        self.checkpoint = checkpoint
+        self.position = position
+        self.empty_processor = empty_processor
 
-    @staticmethod
-    def parse_request_path(record):
-        if 'request_uri' in record:
-            uri = record['request_uri']
-        elif 'request' in record:
-            uri = ' '.join(record['request'].split(' ')[1:-1])
-        else:
-            uri = None
-        return urlparse.urlparse(uri).path if uri else None
+    def required_fields(self):
+        """
+        Get fields the processor and the filter expression look at
+        :return: set of field names, None if every field is required
+        """
+        fields = getattr(self.processor, 'fields', None)
+        if fields is None:
+            return None
+
+        fields = set(fields)
+        filter_exp = self.arguments['--filter']
+        if filter_exp:
+            fields.update(expression_names(filter_exp))
+        for field, sources in DERIVED_FIELDS.items():
+            if field in fields:
+                fields.update(sources)
+        if self.access_logs is not None and len(self.access_logs) > 1:
+            # records of several logs are merged on it
+            fields.add('time_local')
+        return fields
 
     @staticmethod
-    def parse_status_type(record):
-        return record['status'] // 100 if 'status' in record else None
+    def decode_matches(matches, groupindex, record_class=dict):
+        """
+        Turn matches of the bytes pattern into records, decoding every captured field
+        :param matches: match objects, None for lines not matching
+        :param groupindex: group numbers of the pattern
+        :param record_class: type of records
+        :return: iterator over records
+        """
+        names = sorted(groupindex, key=groupindex.get)
+        for m in matches:
+            if m is not None:
+                yield record_class(zip(names, [value.decode('utf-8', 'replace') for value in m.groups()]))
 
-    def set_processor(self, processor):
-        self.processor = processor
+    def parse_log(self, lines, hints=(), log_format=None):
+        """
+        Parse lines into records, capturing only the fields required by the processor and the filter
+        :param lines: lines to parse
+        :param hints: substrings lines must all contain to be parsed at all
+        :param log_format: format of the lines, --log-format by default
+        :return: iterator over records
+        """
+        return self.log_parser(hints, log_format)(lines)
 
-    def parse_log(self, lines):
-        matches = (self.pattern.match(l) for l in lines)
-        records = (m.groupdict() for m in matches if m is not None)
+    def log_parser(self, hints=(), log_format=None):
+        """
+        Get the fields required and the patterns of a log format once, for the many batches of lines of a followed log
+        :param hints: substrings lines must all contain to be parsed at all
+        :param log_format: format of the lines, --log-format by default
+        :return: function parsing lines into records, see parse_log
+        """
+        if log_format is None:
+            log_format = self.arguments['--log-format']
+        fields = self.required_fields()
+        if fields != self.projection:
+            self.projection = fields
+            self.patterns, self.binary_patterns = {}, {}
+        record_class = dict if fields is not None else LogRecord
+        binary_hints = [hint.encode('utf-8') for hint in hints]
 
-        records = self.map_field('status', to_int, records)
-        records = self.add_field('status_type', self.parse_status_type, records)
-        records = self.add_field('bytes_sent', lambda r: r['body_bytes_sent'], records)
-        records = self.map_field('bytes_sent', to_int, records)
-        records = self.map_field('request_time', to_float, records)
-        records = self.add_field('request_path', self.parse_request_path, records)
-        return records
+        def parse(lines):
+            if isinstance(lines, MmapSource):
+                # match the mapped bytes in place and only decode captured fields
+                pattern = self.binary_patterns.get(log_format)
+                if pattern is None:
+                    pattern = self.binary_patterns[log_format] = build_binary_pattern(log_format, fields)
+                records = self.decode_matches(lines.matches(pattern, binary_hints), pattern.groupindex, record_class)
+            else:
+                pattern = self.patterns.get(log_format)
+                if pattern is None:
+                    pattern = self.patterns[log_format] = build_pattern(log_format, fields)
+                if hints:
+                    lines = (l for l in lines if all(hint in l for hint in hints))
+                matches = (pattern.match(l) for l in lines)
+                records = (record_class(m.groupdict()) for m in matches if m is not None)
+            return self.convert_fields(records, pattern.groupindex, fields)
+        return parse
 
-    def get_access_log(self):
+    def get_access_logs(self):
         """
-        Get nginx access.log file path
-        :return: access.log file path and log format
+        Get nginx access log files: --access-log paths and globs, separated by commas, stdin when piped, or every
+        access log of the nginx config
+        :return: list of (path, log format) of access logs, 'stdin' being the path of stdin
         """
-        if self.access_log is not None:
-            return self.access_log
+        if self.access_logs is not None:
+            return self.access_logs
 
-        self.access_log = self.arguments['--access-log']
-        log_format = self.arguments['--log-format']
-        if self.access_log is None and not sys.stdin.isatty():
+        access_log = self.arguments['--access-log']
+        if access_log is None and not sys.stdin.isatty():
             # assume logs can be fetched directly from stdin when piped
-            self.access_log = 'stdin'
-        if self.access_log is None:
-            self.access_log, log_format = detect_log_config(self.arguments)
+            access_log = 'stdin'
+        if access_log is None:
+            access_logs = detect_log_config(self.arguments)
+        else:
+            access_logs = [(path.strip(), self.arguments['--log-format']) for path in access_log.split(',')]
+        self.access_logs = expand_paths(access_logs)
+        self.access_log = self.access_logs[0][0]
+        if len(self.access_logs) > 1 and 'stdin' in [path for path, _ in self.access_logs]:
+            error_exit('stdin cannot be read together with other access logs')
 
-        logging.info('access_log: %s', self.access_log)
-        logging.info('log_format: %s', log_format)
-        if self.access_log != 'stdin' and not os.path.exists(self.access_log):
-            error_exit('access log file "%s" does not exist' % self.access_log)
-        return self.access_log, log_format
+        for path, log_format in self.access_logs:
+            logging.info('access_log: %s', path)
+            logging.info('log_format: %s', log_format)
+        return self.access_logs
 
     def follow(self):
         """
-        Follow a given file and yield new lines when they are available, like `tail -f`.
+        Follow a given file and yield new lines when they are available, like `tail -F`.
         :return: new lines appended
         """
-        with open(self.access_log) as f:
-            f.seek(0, 2)  # seek to eof
-            while True:
-                line = f.readline()
-                if not line:
-                    time.sleep(0.1)  # sleep briefly before trying again
-                    continue
-                yield line
+        checkpoint = None
+        if self.checkpoint is not None:
+            checkpoint = lambda position: self.checkpoint(position, False)
+        return Tailer(self.access_log, start=resume_offset(self.access_log, self.position),
+                      checkpoint=checkpoint).lines()
+
+    @staticmethod
+    def open_log(path, start=0):
+        """
+        Load the current content of an access log
+        :param path: access log file, gzip compressed if it ends with .gz
+        :param start: offset to start from, in a regular file
+        :return: lines of the file
+        """
+        if is_compressed(path):
+            return GzipSource(path)
+        if os.path.isfile(path):
+            return MmapSource(path, start)
+        return open(path)
 
     def build_source(self):
         """
@@ -130,31 +310,111 @@ class NginxHttpInfo(object):
         if self.access_log == 'stdin':
             lines = sys.stdin
         elif self.arguments['--no-follow']:
-            lines = open(self.access_log)
+            lines = self.open_log(self.access_log, resume_offset(self.access_log, self.position) or 0)
         else:
+            if is_compressed(self.access_log):
+                error_exit('compressed access log "%s" can only be read with --no-follow' % self.access_log)
             lines = self.follow()
         return lines
 
-    def process_log(self, lines):
-        pre_filer_exp = self.arguments['--pre-filter']
-        if pre_filer_exp:
-            lines = (line for line in lines if eval(pre_filer_exp, {}, dict(line=line)))
+    def merge_logs(self):
+        """
+        Parse the current content of every access log into one stream of records ordered by time_local
+        :return: records of all access logs
+        """
+        sources = []
+        for path, log_format in self.access_logs:
+            if 'time_local' not in extract_variables(log_format):
+                logging.warning('log format of %s has no $time_local, its records come first', path)
+            sources.append(self.build_records(self.open_log(path), log_format))
+        return merge_by_time(sources)
+
+    def follow_logs(self):
+        """
+        Follow every access log, compressed ones aside as nothing is written to them anymore, parsing lines of each
+        with its own format
+        :return: records of all access logs, interleaved as they are written
+        """
+        access_logs = [(path, log_format) for path, log_format in self.access_logs if not is_compressed(path)]
+        if not access_logs:
+            error_exit('compressed access logs can only be read with --no-follow')
+        tailers = [Tailer(path) for path, _ in access_logs]
+        # compiled once per log, not for every batch of lines read
+        builders = [self.record_builder(log_format) for _, log_format in access_logs]
+        for index, lines in MultiTailer(tailers).batches():
+            for record in builders[index](lines):
+                yield record
 
-        records = self.parse_log(lines)
+    def build_records(self, lines, log_format=None):
+        """
+        Filter and parse lines into records
+        :param lines: lines to parse
+        :param log_format: format of the lines, --log-format by default
+        :return: records satisfying the pre-filter and filter expressions
+        """
+        return self.record_builder(log_format)(lines)
 
+    def record_builder(self, log_format=None):
+        """
+        Compile the pre-filter and filter expressions and get the parser of a log format once
+        :param log_format: format of the lines, --log-format by default
+        :return: function filtering and parsing lines into records, see build_records
+        """
+        pre_filer_exp = self.arguments['--pre-filter']
+        pre_filter = compile_pre_filter(pre_filer_exp) if pre_filer_exp else None
         filter_exp = self.arguments['--filter']
-        if filter_exp:
-            records = (r for r in records if eval(filter_exp, {}, r))
+        record_filter = compile_filter(filter_exp) if filter_exp else None
+        parse = self.log_parser(line_hints(filter_exp) if filter_exp else [], log_format)
 
-        self.processor.process(records)
+        def build(lines):
+            if pre_filter is not None:
+                lines = (line for line in lines if pre_filter(line))
+            records = parse(lines)
+            if record_filter is not None:
+                records = (r for r in records if record_filter(r))
+            return records
+        return build
+
+    def process_log(self, lines, log_format=None):
+        self.processor.process(self.build_records(lines, log_format))
+        if self.checkpoint is not None and isinstance(lines, MmapSource):
+            self.checkpoint(file_position(self.access_log, lines.offset), True)
         print(self.processor.report())  # this will only run when start in --no-follow mode
 
+    def use_workers(self):
+        """
+        Check whether the access log should be parsed by a pool of worker processes
+        :return: number of workers to use, 0 to parse in this process
+        """
+        workers = int(self.arguments['--workers'])
+        if workers <= 1 or not self.arguments['--no-follow'] or self.access_log == 'stdin':
+            return 0
+        if len(self.access_logs) > 1 or is_compressed(self.access_log):
+            # ranges are split in a single regular file
+            return 0
+        return workers
+
     def parse_info(self):
-        if self.access_log is None:
-            self.get_access_log()
+        if self.access_logs is None:
+            self.get_access_logs()
+
+        if len(self.access_logs) > 1:
+            if self.arguments['--no-follow']:
+                self.processor.process(self.merge_logs())
+                print(self.processor.report())
+            else:
+                self.processor.process(self.follow_logs())
+            return
 
-        if self.pattern is None:
-            self.pattern = build_pattern(self.arguments['--log-format'])
+        log_format = self.access_logs[0][1]
+        workers = self.use_workers()
+        if workers:
+            start = resume_offset(self.access_log, self.position) or 0
+            end = parallel_process(self, workers, start, self.empty_processor, log_format)
+            if self.checkpoint is not None:
+                self.checkpoint(file_position(self.access_log, end), True)
+            print(self.processor.report())
+            return
 
         lines = self.build_source()
-        self.process_log(lines)
+        self.process_log(lines, log_format)
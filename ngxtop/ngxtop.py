@@ -2,25 +2,46 @@
 
 Usage:
     ngxtop [options]
-    ngxtop [options] (print|top|avg|sum) <var> ...
+    ngxtop [options] (print|top|avg|sum|percentile) <var> ...
     ngxtop info
     ngxtop [options] query <query> ...
 
 Options:
-    -l <file>, --access-log <file>  access log file to parse.
-    -r <url>, --rtmp-stat-url <url>  rtmp stat url to parse.
+    -l <file>, --access-log <file>  access log files to parse, several paths or globs are separated by commas,
+                     .gz files are decompressed. Records of several logs are merged in time_local order
+                     with --no-follow, and interleaved as they are written otherwise.
+    -r <url>, --rtmp-stat-url <url>  rtmp stat url to parse, several urls are separated by commas.
+    --rtmp-stat-file <file>  file listing rtmp stat urls to parse, one per line.
+    --rtmp-stat-timeout <seconds>  timeout of rtmp stat requests in seconds,
+                     failing servers are retried with an increasing delay [default: 2.0]
     -f <format>, --log-format <format>  log format as specify in log_format directive. [default: combined]
     --no-follow  ngxtop default behavior is to ignore current lines in log
                      and only watch for new lines as they are written to the access log.
                      Use this flag to tell ngxtop to process the current content of the access log instead.
     -t <seconds>, --interval <seconds>  report interval when running in follow mode [default: 2.0]
+    -j <workers>, --workers <workers>  number of processes parsing the access log in --no-follow mode [default: 1]
+    --window <seconds>  drop records and clients not seen within the given number of seconds,
+                     reports cover the window as well as the time since start. 0 keeps everything [default: 0]
     -s <samples>, --samples <samples>  Use logging mode and display samples, even if standard output is a terminal.
-
-    -g <var>, --group-by <var>  group by variable [default: request_path]
-    -w <var>, --having <expr>  having clause [default: 1]
-    -o <var>, --order-by <var>  order of output for default query [default: count]
-    -n <number>, --limit <number>  limit the number of records included in report for top command [default: 10]
+    --state <file>  save aggregates and the position reached in the access log to the given file, and resume from it:
+                     follow mode picks up where it stopped, --no-follow only parses lines appended since.
+                     The state is ignored when started with other query, filter or log options.
+
+    -g <var>, --group-by <var>  group by variable of the percentile command [default: request_path]
+    -o <var>, --order-by <var>  order of streams and clients of the stream view: count (of clients), bandwidth,
+                     bytes or duration, or a column of the percentile command, e.g. p95(request_time)
+                     [default: count]
+    -n <number>, --limit <number>  limit the number of records included in report for top command,
+                     and of streams and clients per stream in the stream view [default: 10]
+    --stream-pattern <patterns>  comma separated request paths of hls streams in the stream view, $stream marking
+                     the stream name [default: /live/$stream.m3u8,/live/$stream-$frag.ts]
     -a <exp> ..., --a <exp> ...  add exp (must be aggregation exp: sum, avg, min, max, etc.) into output
+    --approx  approximate counts in fixed memory for values with too many distinct values: top only counts the most
+                     frequent values (within the max_error column), the stream view only tracks the 1024 most
+                     active clients of every stream and estimates the number of clients (standard error 1.6%)
+    -e <engine>, --engine <engine>  engine of the print, top, avg, sum and percentile commands: sqlite, or numpy to
+                     keep records in columnar arrays aggregated all at once, faster on large --no-follow runs
+                     and computing exact percentiles [default: sqlite]
 
     -v, --verbose  more verbose output
     -d, --debug  print every line and parsed record
@@ -42,11 +63,11 @@ Examples:
     Top 10 requested path with status 404:
     $ ngxtop top request_path --filter 'status == 404'
 
-    Top 10 requests with highest total bytes sent
-    $ ngxtop --order-by 'avg(bytes_sent) * count'
+    Streams sending the most bytes, and their clients sending the most
+    $ ngxtop --order-by bytes
 
     Top 10 remote address, e.g., who's hitting you the most
-    $ ngxtop --group-by remote_addr
+    $ ngxtop top remote_addr
 
     Print requests with 4xx or 5xx status, together with status and http referer
     $ ngxtop -i 'status >= 400' print request status http_referer
@@ -54,15 +75,22 @@ Examples:
     Average body bytes sent of 200 responses of requested path begin with 'foo':
     $ ngxtop avg bytes_sent --filter 'status == 200 and request_path.startswith("foo")'
 
+    p50, p95 and p99 of the request time (estimated within 1%) of the 10 most requested paths, the stream view
+    reports them per stream when the log format has $request_time
+    $ ngxtop percentile request_time
+
+    Streams of all virtual hosts over the current and rotated logs, merged in time order
+    $ ngxtop --no-follow -l '/var/log/nginx/*.access.log*'
+
     Analyze apache access log from remote machine using 'common' log format
     $ ssh remote tail -f /var/log/apache2/access.log | ngxtop -f common
 """
 from __future__ import print_function
 import atexit
 import curses
+import functools
 import logging
 import sys
-import signal
 
 try:
     import urlparse
@@ -72,17 +100,29 @@ except ImportError:
 from docopt import docopt
 
 if __name__ == '__main__' and __package__ is None:
+    from aggregator import GroupAggregation, ApproxTopAggregation, Count, Sum, Avg, Percentile, PERCENTILES
     from config_parser import detect_config_path, extract_variables
+    from columnar import ColumnarProcessor, numpy
     from sql_processor import SQLProcessor
-    from dict_processor import DictProcessor
+    from dict_processor import DictProcessor, ORDER_KEYS
     from rtmptop import NginxRtmpInfo
-    from httptop import NginxHttpInfo
+    from httptop import NginxHttpInfo, DERIVATIONS, DERIVED_FIELDS
+    from reporter import PeriodicThread, SynchronizedProcessor
+    from screen import KEY_INTERVAL, ScreenRenderer
+    from state import StateFile, state_key
+    from utils import error_exit
 else:
+    from .aggregator import GroupAggregation, ApproxTopAggregation, Count, Sum, Avg, Percentile, PERCENTILES
     from .config_parser import detect_config_path, extract_variables
+    from .columnar import ColumnarProcessor, numpy
     from .sql_processor import SQLProcessor
-    from .dict_processor import DictProcessor
+    from .dict_processor import DictProcessor, ORDER_KEYS
     from .rtmptop import NginxRtmpInfo
-    from .httptop import NginxHttpInfo
+    from .httptop import NginxHttpInfo, DERIVATIONS, DERIVED_FIELDS
+    from .reporter import PeriodicThread, SynchronizedProcessor
+    from .screen import KEY_INTERVAL, ScreenRenderer
+    from .state import StateFile, state_key
+    from .utils import error_exit
 
 """
 * RTMP&HLS HLS
@@ -119,36 +159,8 @@ Detail:
         Server: addr -, flashver -
         Client: addr -, flashver -, page -, swf -
 """
-DEFAULT_QUERIES = [
-    ('Summary:',
-     '''SELECT
-       count(1)                                    AS count,
-       avg(bytes_sent)                             AS avg_bytes_sent,
-       count(CASE WHEN status_type = 2 THEN 1 END) AS '2xx',
-       count(CASE WHEN status_type = 3 THEN 1 END) AS '3xx',
-       count(CASE WHEN status_type = 4 THEN 1 END) AS '4xx',
-       count(CASE WHEN status_type = 5 THEN 1 END) AS '5xx'
-     FROM log
-     ORDER BY %(--order-by)s DESC
-     LIMIT %(--limit)s
-     '''),
-
-    ('Detailed:',
-     '''SELECT
-       %(--group-by)s,
-       count(1)                                    AS count,
-       avg(bytes_sent)                             AS avg_bytes_sent,
-       count(CASE WHEN status_type = 2 THEN 1 END) AS '2xx',
-       count(CASE WHEN status_type = 3 THEN 1 END) AS '3xx',
-       count(CASE WHEN status_type = 4 THEN 1 END) AS '4xx',
-       count(CASE WHEN status_type = 5 THEN 1 END) AS '5xx'
-     FROM log
-     GROUP BY %(--group-by)s
-     HAVING %(--having)s
-     ORDER BY %(--order-by)s DESC
-     LIMIT %(--limit)s''')
-]
-DEFAULT_FIELDS = set(['stream', 'request_path', 'join_ts', 'time', 'status_type', 'detail'])
+QUERY_COMMANDS = ['print', 'top', 'avg', 'sum', 'percentile', 'query']
+ENGINES = ['sqlite', 'numpy']
 LOGGING_SAMPLES = None
 
 
@@ -158,80 +170,181 @@ class NginxTop(object):
         self.arguments = arguments
         self.http_top = NginxHttpInfo(arguments)
         self.rtmp_top = NginxRtmpInfo(arguments)
-        self.rtmp_stat_url = arguments['--rtmp-stat-url']
+        self.rtmp_stat_url = arguments['--rtmp-stat-url'] or arguments['--rtmp-stat-file']
+        self.state = None
+        if arguments['--state']:
+            self.state = StateFile(arguments['--state'], state_key(arguments))
+        self.reporters = []
         self.logging_samples = arguments['--samples']
         if self.logging_samples is not None:
             self.logging_samples = int(self.logging_samples)
         self.scr = curses.initscr()
         atexit.register(curses.endwin)
+        self.screen = None
 
     def build_processor(self):
         if self.sql_processor is not None:
             return
 
-        self.sql_processor = DictProcessor()
-        self.http_top.set_processor(self.sql_processor)
-        self.rtmp_top.set_processor(self.sql_processor)
-        return
+        if not any(self.arguments[command] for command in QUERY_COMMANDS):
+            # default view lists rtmp / hls streams and their clients
+            order_by = self.arguments['--order-by']
+            if order_by not in ORDER_KEYS:
+                error_exit('--order-by of the stream view must be one of %s' % ', '.join(sorted(ORDER_KEYS)))
+            stream_patterns = [pattern.strip() for pattern in self.arguments['--stream-pattern'].split(',')]
+            if not all('$stream' in pattern for pattern in stream_patterns):
+                error_exit('--stream-pattern must mark the stream name with $stream in every pattern')
+            if self.arguments['--approx'] and float(self.arguments['--window']):
+                error_exit('--approx does not support --window')
+            latency = all('request_time' in extract_variables(log_format)
+                          for _, log_format in self.http_top.get_access_logs())
+            self.sql_processor = DictProcessor(window=float(self.arguments['--window']),
+                                               limit=int(self.arguments['--limit']), order_by=order_by,
+                                               stream_patterns=stream_patterns, approx=self.arguments['--approx'],
+                                               latency=latency)
+            self.http_top.set_processor(self.sql_processor)
+            self.rtmp_top.set_processor(self.sql_processor)
+            return
 
         fields = self.arguments['<var>']
         if self.arguments['print']:
             label = ', '.join(fields) + ':'
-            selections = ', '.join(fields)
-            query = 'select %s from log group by %s' % (selections, selections)
-            report_queries = [(label, query)]
+            report_queries = [GroupAggregation(label, fields, [])]
         elif self.arguments['top']:
             limit = int(self.arguments['--limit'])
             report_queries = []
             for var in fields:
                 label = 'top %s' % var
-                query = 'select %s, count(1) as count from log group by %s order by count desc limit %d' % (var, var, limit)
-                report_queries.append((label, query))
+                if self.arguments['--approx']:
+                    report_queries.append(ApproxTopAggregation(label + ' (approximate)', [var], limit))
+                else:
+                    report_queries.append(GroupAggregation(label, [var], [Count('count')], 'count', limit))
         elif self.arguments['avg']:
             label = 'average %s' % fields
-            selections = ', '.join('avg(%s)' % var for var in fields)
-            query = 'select %s from log' % selections
-            report_queries = [(label, query)]
+            report_queries = [GroupAggregation(label, [], [Avg('avg(%s)' % var, var) for var in fields])]
         elif self.arguments['sum']:
             label = 'sum %s' % fields
-            selections = ', '.join('sum(%s)' % var for var in fields)
-            query = 'select %s from log' % selections
-            report_queries = [(label, query)]
-        elif self.arguments['query']:
-            report_queries = self.arguments['<query>']
-            fields = self.arguments['<fields>']
+            report_queries = [GroupAggregation(label, [], [Sum('sum(%s)' % var, var) for var in fields])]
+        elif self.arguments['percentile']:
+            group_by = self.arguments['--group-by'].split(',')
+            for _, log_format in self.http_top.get_access_logs():
+                variables = extract_variables(log_format)
+                missing = [var for var in fields if var not in variables and
+                           not any(source in variables for source in DERIVED_FIELDS.get(var, ()))]
+                if missing:
+                    # records would report the default of the field, e.g. 0 for request_time
+                    error_exit('percentile of %s which is not in the log format:\n %s'
+                               % (', '.join(missing), log_format))
+            columns = [Count('count')] + [Percentile('p%d(%s)' % (percent, var), var, percent)
+                                          for var in fields for percent in PERCENTILES]
+            order_by = self.arguments['--order-by']
+            names = [column.name for column in columns]
+            if order_by not in names:
+                error_exit('--order-by of the percentile command must be one of %s' % ', '.join(names))
+            label = 'percentiles %s by %s' % (fields, ', '.join(group_by))
+            report_queries = [GroupAggregation(label, group_by, columns, order_by, int(self.arguments['--limit']))]
+            fields = fields + group_by
         else:
-            report_queries = [(name, query % self.arguments) for name, query in DEFAULT_QUERIES]
-            fields = DEFAULT_FIELDS.union(set([self.arguments['--group-by']]))
-
-        for label, query in report_queries:
+            report_queries = self.arguments['<query>']
+            # queries may read any variable of the log formats and any field derived from them
+            fields = set(field for field, _ in DERIVATIONS)
+            for _, log_format in self.http_top.get_access_logs():
+                fields.update(extract_variables(log_format))
+            fields = sorted(fields)
+
+        for query in report_queries:
+            if isinstance(query, GroupAggregation):
+                label, query = query.label, query.sql()
+            elif isinstance(query, tuple):
+                label, query = query
+            else:
+                label = ''
             logging.info('query for "%s":\n %s', label, query)
 
         processor_fields = []
         for field in fields:
             processor_fields.extend(field.split(','))
 
-        self.sql_processor = SQLProcessor(report_queries, processor_fields)
+        engine = self.arguments['--engine']
+        if engine not in ENGINES:
+            error_exit('--engine must be one of %s' % ', '.join(ENGINES))
+        if engine == 'numpy':
+            if numpy is None:
+                error_exit('--engine numpy needs numpy, install it with `pip install numpy`')
+            if not all(isinstance(query, GroupAggregation) for query in report_queries):
+                error_exit('--engine numpy only runs the print, top, avg, sum and percentile commands')
+            if float(self.arguments['--window']):
+                error_exit('--engine numpy does not support --window')
+            if self.arguments['--approx']:
+                error_exit('--engine numpy keeps every record, it does not support --approx')
+            self.sql_processor = ColumnarProcessor(report_queries, processor_fields)
+        else:
+            self.sql_processor = SQLProcessor(report_queries, processor_fields,
+                                              window=float(self.arguments['--window']))
         self.http_top.set_processor(self.sql_processor)
         self.rtmp_top.set_processor(self.sql_processor)
 
-    def print_report(self, sig, frame):
+    def restore_state(self):
+        """
+        Replace the processor with the one saved in the state file, if any, and save it as parsing goes.
+        """
+        if self.state is None:
+            return
+        if self.http_top.access_log == 'stdin':
+            error_exit('--state needs an access log file, not stdin')
+        if len(self.http_top.get_access_logs()) > 1 or self.http_top.access_log.endswith('.gz'):
+            error_exit('--state needs a single uncompressed access log file')
+
+        saved = self.state.load()
+        if saved is None:
+            self.http_top.set_state(self.checkpoint)
+            return
+        logging.info('resuming from %s at %s', self.state.path, saved['position'])
+        empty_processor = self.sql_processor
+        self.sql_processor = saved['processor']
+        self.http_top.set_processor(self.sql_processor)
+        self.rtmp_top.set_processor(self.sql_processor)
+        self.http_top.set_state(self.checkpoint, saved['position'], empty_processor)
         if self.rtmp_stat_url is not None:
-            self.rtmp_top.parse_info()
-            # output = output + '\n\n' + '\n'.join(self.rtmp_top.print_info())
-
-        output = self.sql_processor.report()
-
-        if self.logging_samples is None:
-            self.scr.erase()
-
-            try:
-                self.scr.addstr(output)
-            except curses.error:
-                pass
-
-            self.scr.refresh()
+            # stat counters keep being sent as differences with the last snapshot processed
+            for server in self.rtmp_top.get_servers():
+                server.stream_infos = saved['rtmp'].get(server.url)
+
+    def checkpoint(self, position, force=False):
+        """
+        Save the state, at most every checkpoint interval unless forced.
+        :param position: (inode, offset) the processor covers the access log up to
+        :param force: save now
+        """
+        if not force and not self.state.due():
+            return
+        processor = self.sql_processor
+        if isinstance(processor, SynchronizedProcessor):
+            # reporting and stat polling threads must not change the processor while it is pickled, nor apply a
+            # snapshot of a stat server without its changes (see NginxRtmpInfo.apply)
+            with processor.lock:
+                # records of the lines up to the position may still be queued
+                processor.flush()
+                self.state.save(processor.processor, position, self.rtmp_snapshots())
+        else:
+            self.state.save(processor, position, self.rtmp_snapshots())
+
+    def rtmp_snapshots(self):
+        """
+        :return: dict of stat url - current stream infos of the server, saved in the state
+        """
+        if self.rtmp_stat_url is None:
+            return {}
+        return dict((server.url, server.stream_infos) for server in self.rtmp_top.get_servers())
+
+    def report(self, max_lines):
+        return self.sql_processor.report(max_lines)
+
+    def print_report(self):
+        if self.screen is not None:
+            self.screen.draw()
         else:
+            output = self.sql_processor.report()
             print(output)
             self.logging_samples -= 1
             if self.logging_samples == 0:
@@ -241,23 +354,52 @@ class NginxTop(object):
         if self.arguments['--no-follow']:
             return
 
-        signal.signal(signal.SIGALRM, self.print_report)
+        # ingestion keeps this thread, reports and rtmp stat polling get their own
+        self.sql_processor = SynchronizedProcessor(self.sql_processor)
+        self.http_top.set_processor(self.sql_processor)
+        self.rtmp_top.set_processor(self.sql_processor)
+
+        if self.logging_samples is None:
+            curses.noecho()
+            curses.cbreak()
+            self.screen = ScreenRenderer(self.scr, self.report)
+
         interval = float(self.arguments['--interval'])
-        signal.setitimer(signal.ITIMER_REAL, 0.1, interval)
+        self.reporters.append(PeriodicThread('reporter', interval, self.print_report))
+        if self.screen is not None:
+            self.reporters.append(PeriodicThread('keys', KEY_INTERVAL, self.screen.poll_keys, delay=0))
+        if self.rtmp_stat_url is not None:
+            for server in self.rtmp_top.get_servers():
+                self.reporters.append(PeriodicThread('rtmp-stat %s' % server.url, interval,
+                                                     functools.partial(self.rtmp_top.poll, server)))
+        for reporter in self.reporters:
+            reporter.start()
 
     def run(self):
-        access_log, log_format = self.http_top.get_access_log()
+        access_logs = self.http_top.get_access_logs()
         if self.arguments['info']:
             print('nginx configuration file:\n ', detect_config_path())
             print('nginx rtmp stat url:\n ', self.rtmp_top.get_rtmp_url())
-            print('access log file:\n ', access_log)
-            print('access log format:\n ', log_format)
-            print('available variables:\n ', ', '.join(sorted(extract_variables(log_format))))
+            for access_log, log_format in access_logs:
+                print('access log file:\n ', access_log)
+                print('access log format:\n ', log_format)
+                print('available variables:\n ', ', '.join(sorted(extract_variables(log_format))))
             return
 
         self.build_processor()
+        self.restore_state()
         self.setup_reporter()
-        self.http_top.parse_info()
+        try:
+            self.http_top.parse_info()
+        except KeyboardInterrupt:
+            # a reporter thread asking to exit interrupts ingestion
+            for reporter in self.reporters:
+                if reporter.exit_status is not None:
+                    sys.exit(reporter.exit_status)
+            raise
+        finally:
+            for reporter in self.reporters:
+                reporter.stop()
 
 
 def main():
@@ -0,0 +1,77 @@
+"""
+Parallel ingestion of large access log files in --no-follow mode.
+
+The file is split into newline aligned byte ranges, every range is parsed by a worker process into a partial
+processor and the partial processors are merged back into the main one.
+"""
+import os
+import copy
+import multiprocessing
+
+if __package__ is None:
+    from sources import MmapSource
+else:
+    from .sources import MmapSource
+
+# ranges per worker, more ranges than workers keeps all of them busy until the end
+RANGES_PER_WORKER = 4
+
+
+def split_file(path, parts, start=0):
+    """
+    Split file into byte ranges which all start at the beginning of a line.
+    :param path: file to split
+    :param parts: number of ranges wanted
+    :param start: offset of a line to start from
+    :return: list of (start, end) offsets, end excluded
+    """
+    size = os.path.getsize(path)
+    offsets = [start]
+    with open(path, 'rb') as f:
+        for idx in range(1, parts):
+            # step back one byte, so a range boundary falling exactly at a line start is kept
+            f.seek(max(start + (size - start) * idx // parts, offsets[-1] + 1) - 1)
+            f.readline()
+            offsets.append(min(f.tell(), size))
+    offsets.append(size)
+    return [(start, end) for start, end in zip(offsets, offsets[1:]) if start < end]
+
+
+def parse_range(task):
+    """
+    Worker entry: parse one byte range with the (pickled) http info and its processor.
+    :param task: (http_info, start, end, log_format) tuple
+    :return: partial processor filled with records of given range
+    """
+    http_info, start, end, log_format = task
+    http_info.processor.process(http_info.build_records(MmapSource(http_info.access_log, start, end), log_format))
+    return http_info.processor
+
+
+def parallel_process(http_info, workers, start=0, empty_processor=None, log_format=None):
+    """
+    Parse access log of given http info in a pool of processes and merge the results into its processor.
+    :param http_info: NginxHttpInfo with access log, pattern and processor set
+    :param workers: number of worker processes
+    :param start: offset of the line to start from
+    :param empty_processor: processor workers start from, a copy of the processor of http_info by default, which must
+    then be empty
+    :param log_format: format of the access log, --log-format by default
+    :return: offset parsed up to
+    """
+    processor = http_info.processor
+    # tasks are pickled lazily while partials are merged, so they must not share the processor being merged into
+    template = copy.copy(http_info)
+    template.processor = copy.deepcopy(empty_processor if empty_processor is not None else processor)
+    template.checkpoint = template.empty_processor = None
+
+    ranges = split_file(http_info.access_log, workers * RANGES_PER_WORKER, start)
+    pool = multiprocessing.Pool(workers)
+    try:
+        tasks = [(template, start, end, log_format) for start, end in ranges]
+        for partial in pool.imap_unordered(parse_range, tasks):
+            processor.merge(partial)
+    finally:
+        pool.close()
+        pool.join()
+    return ranges[-1][1] if ranges else start
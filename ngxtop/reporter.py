@@ -0,0 +1,113 @@
+"""
+Reporting and rtmp stat polling running next to log ingestion.
+
+Ingestion keeps the main thread, report rendering and stat polling run in their own threads on their own schedule.
+The processor is shared through a lock taken for a batch of records or a single report, so a slow /stat fetch or
+screen redraw never stalls ingestion and ingestion never blocks a report for longer than one batch.
+"""
+import collections
+import logging
+import threading
+
+try:
+    import thread as _thread
+except ImportError:
+    import _thread
+
+if __package__ is None:
+    from clock import CLOCK
+else:
+    from .clock import CLOCK
+
+# records handed to the processor under a single acquisition of the lock
+BATCH_RECORDS = 256
+
+
+class SynchronizedProcessor(object):
+    """
+    Processor shared between the ingestion thread and the reporting threads.
+
+    Records are pulled from the (possibly blocking) source without holding the lock and queued, the queue is handed
+    to the processor once it holds BATCH_RECORDS records, when the source is exhausted, and before any report,
+    discard or checkpoint (see flush), so records waiting for more lines are never left out.
+    """
+    def __init__(self, processor, lock=None):
+        self.processor = processor
+        # reentrant, the stat polling threads process the changes of a snapshot while holding it
+        self.lock = lock if lock is not None else threading.RLock()
+        # appended and popped without the lock, both are atomic
+        self.pending = collections.deque()
+
+    def __getattr__(self, name):
+        return getattr(self.processor, name)
+
+    def process(self, records):
+        pending = self.pending
+        for record in records:
+            pending.append(record)
+            if len(pending) >= BATCH_RECORDS:
+                self.flush()
+        self.flush()
+
+    def flush(self):
+        """
+        Hand the queued records to the processor.
+        """
+        with self.lock:
+            records = []
+            try:
+                while True:
+                    records.append(self.pending.popleft())
+            except IndexError:
+                pass
+            if records:
+                self.processor.process(records)
+
+    def discard(self, records):
+        with self.lock:
+            self.flush()
+            self.processor.discard(records)
+
+    def report(self, max_lines=None):
+        with self.lock:
+            self.flush()
+            return self.processor.report(max_lines)
+
+
+class PeriodicThread(threading.Thread):
+    """
+    Daemon thread calling a function every interval seconds until stopped.
+
+    SystemExit raised by the function (e.g. error_exit) stops the thread and interrupts the main thread, the exit
+    status is kept in `exit_status`.
+    """
+    def __init__(self, name, interval, func, delay=0.1, clock=CLOCK):
+        threading.Thread.__init__(self, name=name)
+        self.clock = clock
+        self.daemon = True
+        self.interval = interval
+        self.func = func
+        self.delay = delay
+        self.stopped = threading.Event()
+        self.exit_status = None
+
+    def run(self):
+        wait = self.delay
+        while True:
+            self.stopped.wait(wait)
+            if self.stopped.is_set():
+                return
+            begin = self.clock.monotonic()
+            try:
+                self.func()
+            except SystemExit as e:
+                self.exit_status = e.code
+                _thread.interrupt_main()
+                return
+            except Exception:
+                logging.exception('%s failed', self.name)
+            # keep the schedule, whatever the time spent in func
+            wait = max(self.interval - (self.clock.monotonic() - begin), 0)
+
+    def stop(self):
+        self.stopped.set()
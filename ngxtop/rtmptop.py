@@ -3,28 +3,65 @@ Nginx-rtmp-module stat parser.
 
 Need to install nginx-rtmp-module first.
 """
-import xml.dom.minidom
-import urllib2
+import socket
+import logging
+
+try:
+    import httplib
+except ImportError:
+    import http.client as httplib
+
+try:
+    import urlparse
+except ImportError:
+    import urllib.parse as urlparse
+
+try:
+    import xml.etree.cElementTree as ElementTree
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
 
 if __package__ is None:
-    from utils import error_exit
+    from clock import CLOCK
+    from utils import error_exit, intern
 else:
-    from .utils import error_exit
+    from .clock import CLOCK
+    from .utils import error_exit, intern
 
 
 STAT_URL = "http://127.0.0.1:8080/stat"
+# seconds to wait for a stat server to connect or answer
+STAT_TIMEOUT = 2.0
+# a failing stat server is retried after BACKOFF_MIN seconds, doubled on each failure up to BACKOFF_MAX
+BACKOFF_MIN = 1.0
+BACKOFF_MAX = 60.0
+
+# children of the <rtmp> root element - NginxRtmpInfo attribute and type
+SUMMARY_FIELDS = {
+    'nginx_version': ('nginx_version', str),
+    'nginx_rtmp_version': ('rtmp_version', str),
+    'compiler': ('compiler', str),
+    'built': ('built', str),
+    'pid': ('pid', int),
+    'uptime': ('uptime', int),
+    'naccepted': ('accepted', int),
+    'bw_in': ('bw_in', int),
+    'bw_out': ('bw_out', int),
+    'bytes_in': ('bytes_in', int),
+    'bytes_out': ('bytes_out', int),
+}
 
 
 def pass_for_node_value(root, node_name):
-    child = root.getElementsByTagName(node_name)
-
-    if len(child) >= 1 and child[0].firstChild:
-        return child[0].firstChild.data
-
-    return 0
+    # only direct children, a stream and its clients both have e.g. a `time`
+    value = root.findtext(node_name)
+    return value if value else 0
 
 
 class MetaInfo(object):
+    __slots__ = ('video_width', 'video_height', 'video_frame_rate', 'video_codec', 'video_profile', 'video_compat',
+                 'video_level', 'audio_codec', 'audio_profile', 'audio_channels', 'audio_sample_rate')
+
     def __init__(self):
         self.video_width = None
         self.video_height = None
@@ -39,7 +76,14 @@ class MetaInfo(object):
         self.audio_sample_rate = None
 
     def parse_info(self, meta_root):
-        video_child = meta_root.getElementsByTagName('video')[0]
+        video_child = meta_root.find('video')
+        if video_child is not None:
+            self.parse_video(video_child)
+        audio_child = meta_root.find('audio')
+        if audio_child is not None:
+            self.parse_audio(audio_child)
+
+    def parse_video(self, video_child):
         self.video_width = int(pass_for_node_value(video_child, 'width'))
         self.video_height = int(pass_for_node_value(video_child, 'height'))
         self.video_frame_rate = int(pass_for_node_value(video_child, 'frame_rate'))
@@ -48,26 +92,32 @@ class MetaInfo(object):
         self.video_compat = int(pass_for_node_value(video_child, 'compat'))
         self.video_level = float(pass_for_node_value(video_child, 'level'))
 
-        audio_child = meta_root.getElementsByTagName('audio')[0]
+    def parse_audio(self, audio_child):
         self.audio_codec = pass_for_node_value(audio_child, 'codec')
         self.audio_profile = pass_for_node_value(audio_child, 'profile')
         self.audio_channels = int(pass_for_node_value(audio_child, 'channels'))
         self.audio_sample_rate = int(pass_for_node_value(audio_child, 'sample_rate'))
 
     def print_info(self, output):
-        output.append('\t\tVideo Meta: width %d, height %d, frame_rate %d, codec %s, profile %s, compat %d, level %f' %
-                      (self.video_width, self.video_height, self.video_frame_rate, self.video_codec, self.video_profile,
-                       self.video_compat, self.video_level))
-        output.append('\t\tAudio Meta: codec %s, profile %s, channels %d, sample rate %d' %
-                      (self.audio_codec, self.audio_profile, self.audio_channels, self.audio_sample_rate))
+        if self.video_codec is not None:
+            output.append('\t\tVideo Meta: width %d, height %d, frame_rate %d, codec %s, profile %s, compat %d, '
+                          'level %f' %
+                          (self.video_width, self.video_height, self.video_frame_rate, self.video_codec,
+                           self.video_profile, self.video_compat, self.video_level))
+        if self.audio_codec is not None:
+            output.append('\t\tAudio Meta: codec %s, profile %s, channels %d, sample rate %d' %
+                          (self.audio_codec, self.audio_profile, self.audio_channels, self.audio_sample_rate))
 
 
 class ClientInfo(object):
+    __slots__ = ('id', 'address', 'time', 'flashver', 'pageurl', 'swfurl', 'dropped', 'avsync', 'timestamp',
+                 'is_publisher')
+
     def __init__(self, client_root):
         self.id = int(pass_for_node_value(client_root, 'id'))
         self.address = pass_for_node_value(client_root, 'address')
         self.time = int(pass_for_node_value(client_root, 'time'))
-        self.flashver = pass_for_node_value(client_root, 'flashver')
+        self.flashver = intern(pass_for_node_value(client_root, 'flashver'))
 
         self.pageurl = None
         self.swfurl = None
@@ -79,13 +129,20 @@ class ClientInfo(object):
         self.is_publisher = False
 
     def parse_info(self, client_root):
-        publish_child = client_root.getElementsByTagName('publishing')
-        if publish_child.length > 0:
+        if client_root.find('publishing') is not None:
             self.is_publisher = True
 
         if not self.is_publisher:
-            self.pageurl = pass_for_node_value(client_root, 'pageurl')
-            self.swfurl = pass_for_node_value(client_root, 'swfurl')
+            self.pageurl = intern(pass_for_node_value(client_root, 'pageurl'))
+            self.swfurl = intern(pass_for_node_value(client_root, 'swfurl'))
+
+    def same_as(self, other):
+        """
+        Check whether the client is described the same in another snapshot, its growing time aside.
+        :param other: ClientInfo of the same id in the previous snapshot
+        """
+        return (self.address == other.address and self.flashver == other.flashver and
+                self.pageurl == other.pageurl and self.is_publisher == other.is_publisher)
 
     def print_info(self, output):
         if self.is_publisher:
@@ -96,8 +153,11 @@ class ClientInfo(object):
 
 
 class StreamInfo(object):
+    __slots__ = ('name', 'time', 'bw_in', 'bytes_in', 'bw_out', 'bytes_out', 'bw_audio', 'bw_video', 'nclients',
+                 'meta_info', 'clients')
+
     def __init__(self, stream_root):
-        self.name = pass_for_node_value(stream_root, 'name')
+        self.name = intern(pass_for_node_value(stream_root, 'name'))
         self.time = int(pass_for_node_value(stream_root, 'time'))
         self.bw_in = int(pass_for_node_value(stream_root, 'bw_in'))
         self.bytes_in = int(pass_for_node_value(stream_root, 'bytes_in'))
@@ -110,16 +170,14 @@ class StreamInfo(object):
         self.meta_info = None
         self.clients = {}
 
-    def parse_info(self, stream_root):
-        meta_child = stream_root.getElementsByTagName('meta')
-        if meta_child.length > 0:
-            self.meta_info = MetaInfo()
-            self.meta_info.parse_info(meta_child[0])
-
-        client_child = stream_root.getElementsByTagName('client')
-        for client in client_child:
-            client_info = ClientInfo(client)
-            client_info.parse_info(client)
+    def parse_info(self, meta_info, clients):
+        """
+        Attach meta and clients parsed from the children of the stream element.
+        :param meta_info: MetaInfo of the stream, None if the stream is idle
+        :param clients: ClientInfo of every client of the stream
+        """
+        self.meta_info = meta_info
+        for client_info in clients:
             self.clients[client_info.id] = client_info
 
     def print_info(self, output):
@@ -135,16 +193,114 @@ class StreamInfo(object):
             output.append('\t\tStream Idel')
 
         output.append('\t\tClient Info:')
-        for client in self.clients.itervalues():
+        for client in self.clients.values():
             client.print_info(output)
 
 
-class NginxRtmpInfo(object):
-    def __init__(self, arguments):
-        self.arguments = arguments
-        self.processor = None
+def counter_delta(current, previous):
+    # counters start over when nginx restarts
+    return current - previous if current >= previous else current
+
+
+def stream_name(server, application, name):
+    """
+    Name of a stream in records, streams of the same name on other servers or applications are other streams.
+    :return: e.g. `127.0.0.1:8080/live/801`
+    """
+    return intern('%s/%s/%s' % (server, application, name))
+
+
+def diff_streams(previous, current, server):
+    """
+    Diff two snapshots of the streams of a server.
+    :param previous: (application, name) - StreamInfo of the previous snapshot, None if the new snapshot is the first
+    one, its counters are then a baseline for the next ones
+    :param current: (application, name) - StreamInfo of the new snapshot
+    :param server: name of the server
+    :return: records of new or changed streams and clients, records of departed clients
+    """
+    baseline = previous is None
+    if baseline:
+        previous = {}
+    records = []
+    departed = []
+    for key, stream_info in current.items():
+        name = stream_name(server, *key)
+        old = previous.get(key)
+        old_clients = old.clients if old is not None else {}
+        if old is not None:
+            in_bytes = counter_delta(stream_info.bytes_in, old.bytes_in)
+            out_bytes = counter_delta(stream_info.bytes_out, old.bytes_out)
+        elif baseline:
+            # sent before the first poll, not during the run
+            in_bytes = out_bytes = 0
+        else:
+            # new stream, everything was sent since the previous snapshot
+            in_bytes, out_bytes = stream_info.bytes_in, stream_info.bytes_out
+        stream = {
+            'request': name,
+            'in_bytes': in_bytes,
+            # records carry bandwidths in bytes per second, nginx-rtmp reports bits per second
+            'in_bw': stream_info.bw_in / 8.0,
+            'out_bytes': out_bytes,
+            'out_bw': stream_info.bw_out / 8.0,
+        }
+        changed = (old is None or stream['in_bytes'] or stream['out_bytes'] or
+                   (old.bw_in, old.bw_out) != (stream_info.bw_in, stream_info.bw_out))
+
+        for client_id, client in stream_info.clients.items():
+            old_client = old_clients.get(client_id)
+            if old_client is not None and client.same_as(old_client):
+                continue
+            record = {'request': name, 'remote_addr': client.address, 'time': client.time,
+                      'http_user_agent': client.flashver}
+            if changed:
+                # stream counters go with the first record only, they would be added up once per record
+                record.update(stream)
+                changed = False
+            records.append(record)
+        if changed and (stream_info.clients or in_bytes or out_bytes):
+            # a stream without clients only matters once it moves bytes
+            records.append(stream)
+
+        addresses = set(client.address for client in stream_info.clients.values())
+        for client_id, client in old_clients.items():
+            if client_id not in stream_info.clients and client.address not in addresses:
+                addresses.add(client.address)
+                departed.append({'request': name, 'remote_addr': client.address})
+
+    for key, stream_info in previous.items():
+        if key not in current:
+            for address in set(client.address for client in stream_info.clients.values()):
+                departed.append({'request': stream_name(server, *key), 'remote_addr': address})
+    return records, departed
+
+
+class StatServer(object):
+    """
+    One nginx-rtmp server polled for its /stat document, over a connection kept alive between polls.
+    """
+    def __init__(self, url, timeout=STAT_TIMEOUT):
+        self.url = url
+        parts = urlparse.urlparse(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            error_exit('Invalid RTMP stat URL: %s' % url)
+        # host and port, naming the streams of the server
+        self.name = parts.netloc
+        self.connection_class = httplib.HTTPSConnection if parts.scheme == 'https' else httplib.HTTPConnection
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path = parts.path or '/'
+        if parts.query:
+            self.path += '?' + parts.query
+        self.timeout = timeout
+        self.conn = None
+        self.failures = 0
+        self.retry_at = 0
+        # validators of the last document, for servers (or caching proxies in front of them) supporting them
+        self.etag = None
+        self.last_modified = None
 
-        self.rtmp_url = STAT_URL
         self.nginx_version = None
         self.rtmp_version = None
         self.compiler = None
@@ -157,79 +313,237 @@ class NginxRtmpInfo(object):
         self.bytes_in = None
         self.bytes_out = None
 
-        self.stream_infos = {}
+        # (application, stream name) - StreamInfo, None before the first poll
+        self.stream_infos = None
+
+    def due(self, now):
+        return now >= self.retry_at
+
+    def failed(self, now):
+        """
+        Close the connection and back off exponentially.
+        :param now: monotonic time of the failure
+        """
+        self.close()
+        self.failures += 1
+        self.retry_at = now + min(BACKOFF_MIN * 2 ** (self.failures - 1), BACKOFF_MAX)
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def request(self):
+        if self.conn is None:
+            self.conn = self.connection_class(self.host, self.port, timeout=self.timeout)
+        headers = {}
+        if self.etag is not None:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified is not None:
+            headers['If-Modified-Since'] = self.last_modified
+        self.conn.request('GET', self.path, headers=headers)
+        return self.conn.getresponse()
+
+    def poll(self):
+        """
+        Fetch and parse the stat document.
+        :return: stream infos of the document (see parse_stat), None if it didn't change since the previous poll
+        :raise: httplib.HTTPException or socket.error if the server can't be reached
+        """
+        stream_infos = None
+        reused = self.conn is not None
+        try:
+            response = self.request()
+        except (httplib.HTTPException, socket.error):
+            if not reused:
+                raise
+            # the server may have closed the kept alive connection since last poll, retry once on a new one
+            self.close()
+            response = self.request()
+
+        if response.status == 304:
+            response.read()
+        elif response.status == 200:
+            self.etag = response.getheader('ETag')
+            self.last_modified = response.getheader('Last-Modified')
+            stream_infos = self.parse_stat(response)
+            # the whole body must be read before the connection can be reused
+            response.read()
+        else:
+            response.read()
+            raise httplib.HTTPException('%s: HTTP %d %s' % (self.url, response.status, response.reason))
+        if response.will_close:
+            self.close()
+        self.failures = 0
+        return stream_infos
+
+    def parse_stat(self, source):
+        """
+        Parse a /stat document in a single pass, dropping every element once it has been turned into info objects,
+        so memory only grows with the elements of the stream being parsed.
+        Summary values are set on the server, the streams are returned to be diffed with the current stream_infos.
+        :param source: file object or file name of the document
+        :return: dict of (application, stream name) - StreamInfo
+        """
+        stream_infos = {}
+        # open elements, from the root
+        path = []
+        meta_info = None
+        clients = []
+        for event, element in ElementTree.iterparse(source, events=('start', 'end')):
+            if event == 'start':
+                path.append(element)
+                continue
+
+            path.pop()
+            if not path:
+                break
+            parent = path[-1]
+            tag, parent_tag = element.tag, parent.tag
+            if tag == 'client' and parent_tag == 'stream':
+                client_info = ClientInfo(element)
+                client_info.parse_info(element)
+                clients.append(client_info)
+            elif tag == 'meta' and parent_tag == 'stream':
+                meta_info = MetaInfo()
+                meta_info.parse_info(element)
+            elif tag == 'stream' and parent_tag == 'live':
+                stream_info = StreamInfo(element)
+                stream_info.parse_info(meta_info, clients)
+                # <application><name>...</name><live><stream>, the name has been parsed already
+                application = intern(pass_for_node_value(path[-2], 'name'))
+                stream_infos[(application, stream_info.name)] = stream_info
+                meta_info = None
+                clients = []
+            elif len(path) == 1:
+                if tag in SUMMARY_FIELDS:
+                    attr, kind = SUMMARY_FIELDS[tag]
+                    setattr(self, attr, kind(element.text or 0))
+            else:
+                # plain values are read from their element when it ends
+                continue
+            parent.remove(element)
+
+        return stream_infos
+
+    def print_info(self, output):
+        if self.pid is None:
+            output.append('\t%s: not available' % self.url)
+            return
+
+        output.append('\t%s' % self.url)
+        output.append('\tNginx version: %s, RTMP version: %s, Compiler: %s, Built: %s, PID: %d, Uptime: %ds.' %
+                      (self.nginx_version, self.rtmp_version, self.compiler, self.built, self.pid, self.uptime))
+        output.append('\tAccepted: %d, bw_in: %f Kbit/s, bytes_in: %02f MByte, '
+                      'bw_out: %02f Kbit/s, bytes_out: %02f MByte' %
+                      (self.accepted, self.bw_in / 1024.0, self.bytes_in / 1024.0 / 1024,
+                       self.bw_out / 1024.0, self.bytes_out / 1024.0 / 1024))
+
+
+class NginxRtmpInfo(object):
+    def __init__(self, arguments, clock=CLOCK):
+        self.arguments = arguments
+        self.clock = clock
+        self.processor = None
+        self.servers = None
 
     def set_processor(self, processor):
         self.processor = processor
 
-    def get_rtmp_url(self):
+    def get_rtmp_urls(self):
+        """
+        Get stat urls given with --rtmp-stat-url, comma separated, and listed in the --rtmp-stat-file.
+        :return: list of urls, the default url if none is given
+        """
+        urls = []
         rtmp_url = self.arguments['--rtmp-stat-url']
         if rtmp_url:
-            self.rtmp_url = rtmp_url
-        return self.rtmp_url
+            urls.extend(url.strip() for url in rtmp_url.split(',') if url.strip())
+        url_file = self.arguments['--rtmp-stat-file']
+        if url_file:
+            try:
+                with open(url_file) as f:
+                    lines = [line.strip() for line in f]
+            except IOError as e:
+                error_exit('Cannot read RTMP stat URL file %s: %s' % (url_file, e))
+            urls.extend(line for line in lines if line and not line.startswith('#'))
+        return urls or [STAT_URL]
 
-    def processor_process(self):
+    def get_rtmp_url(self):
+        return ', '.join(self.get_rtmp_urls())
+
+    def get_servers(self):
+        if self.servers is None:
+            timeout = float(self.arguments['--rtmp-stat-timeout'])
+            self.servers = [StatServer(url, timeout) for url in self.get_rtmp_urls()]
+        return self.servers
+
+    def processor_process(self, previous, current, server):
+        """
+        Send what changed between two snapshots of a server to the processor: a record for every new or changed
+        client and for streams whose counters moved, byte counters being the difference with the previous snapshot.
+        Clients which left are discarded from the processor.
+        :param previous: stream infos of the previous snapshot, None for the first one
+        :param current: stream infos of the new snapshot
+        :param server: name of the server
+        """
         if self.processor is None:
             return
 
-        records = {}
-        for stream_info in self.stream_infos.itervalues():
-            records['request'] = stream_info.name
-            records['in_bytes'] = stream_info.bytes_in
-            records['in_bw'] = stream_info.bw_in
-            records['out_bytes'] = stream_info.bytes_out
-            records['out_bw'] = stream_info.bw_out
-
-            for client in stream_info.clients.itervalues():
-                records['remote_addr'] = client.address
-                records['time'] = client.time
-                records['http_user_agent'] = client.flashver
-                self.processor.process(records)
+        records, departed = diff_streams(previous, current, server)
+        if records:
+            self.processor.process(records)
+        if departed:
+            self.processor.discard(departed)
+
+    def apply(self, server, stream_infos):
+        """
+        Process what changed since the current snapshot of a server and make the new one current. Both happen under
+        the lock of a SynchronizedProcessor, so a checkpoint never saves a snapshot without the changes it made.
+        :param server: StatServer polled
+        :param stream_infos: new snapshot of the server
+        """
+        lock = getattr(self.processor, 'lock', None)
+        if lock is None:
+            self.processor_process(server.stream_infos, stream_infos, server.name)
+            server.stream_infos = stream_infos
+            return
+        with lock:
+            self.processor_process(server.stream_infos, stream_infos, server.name)
+            server.stream_infos = stream_infos
+
+    def poll(self, server):
+        """
+        Poll a stat server and process its streams, unless it is backing off after a failure.
+        Each server is polled from its own thread, so a slow server doesn't hold the others.
+        :param server: StatServer to poll
+        """
+        now = self.clock.monotonic()
+        if not server.due(now):
+            return
+        try:
+            stream_infos = server.poll()
+        except (httplib.HTTPException, socket.error, ElementTree.ParseError) as e:
+            server.failed(now)
+            logging.warning('Cannot access RTMP URL %s: %s, retrying in %ds', server.url, e, server.retry_at - now)
+            return
+        if stream_infos is not None:
+            self.apply(server, stream_infos)
 
     def parse_info(self):
-        self.get_rtmp_url()
-        try:
-            response = urllib2.urlopen(self.rtmp_url)
-        except urllib2.URLError:
-            error_exit('Cannot access RTMP URL: %s' % self.rtmp_url)
-
-        dom = xml.dom.minidom.parseString(response.read())
-        root = dom.documentElement
-
-        self.nginx_version = pass_for_node_value(root, 'nginx_version')
-        self.rtmp_version = pass_for_node_value(root, 'nginx_rtmp_version')
-        self.compiler = pass_for_node_value(root, 'compiler')
-        self.built = pass_for_node_value(root, 'built')
-        self.pid = int(pass_for_node_value(root, 'pid'))
-        self.uptime = int(pass_for_node_value(root, 'uptime'))
-        self.accepted = int(pass_for_node_value(root, 'naccepted'))
-        self.bw_in = int(pass_for_node_value(root, 'bw_in'))
-        self.bw_out = int(pass_for_node_value(root, 'bw_out'))
-        self.bytes_in = int(pass_for_node_value(root, 'bytes_in'))
-        self.bytes_out = int(pass_for_node_value(root, 'bytes_out'))
-
-        live_child = root.getElementsByTagName('server')[0].getElementsByTagName(
-            'application')[0].getElementsByTagName('live')[0]
-        for stream_child in live_child.getElementsByTagName('stream'):
-            stream_info = StreamInfo(stream_child)
-            stream_info.parse_info(stream_child)
-            self.stream_infos[stream_info.name] = stream_info
-
-        self.processor_process()
+        for server in self.get_servers():
+            self.poll(server)
 
     def print_info(self):
         output = list()
         output.append('Summary:')
-        output.append('\tNginx version: %s, RTMP version: %s, Compiler: %s, Built: %s, PID: %d, Uptime: %ds.' %
-                      (self.nginx_version, self.rtmp_version, self.compiler, self.built, self.pid, self.uptime))
-        output.append('\tAccepted: %d, bw_in: %f Kbit/s, bytes_in: %02f MByte, '
-                      'bw_out: %02f Kbit/s, bytes_out: %02f MByte' %
-                      (self.accepted, self.bw_in / 1024.0, self.bytes_in / 1024.0 / 1024,
-                       self.bw_out / 1024.0, self.bytes_out / 1024.0 / 1024))
+        for server in self.get_servers():
+            server.print_info(output)
 
         output.append('Detail:')
-        output.append('\tStreams: %d' % len(self.stream_infos))
-        for stream in self.stream_infos.itervalues():
-            stream.print_info(output)
+        output.append('\tStreams: %d' % sum(len(server.stream_infos or {}) for server in self.get_servers()))
+        for server in self.get_servers():
+            for stream in (server.stream_infos or {}).values():
+                stream.print_info(output)
 
         return output
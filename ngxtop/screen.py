@@ -0,0 +1,125 @@
+"""
+Curses rendering of reports.
+
+The previous frame is kept and only the rows which changed are written, curses then only sends the cells which
+changed to the terminal, so a report refreshed every interval doesn't repaint the whole screen (which flickers over
+slow links). Reports are only asked for the lines that fit the screen from the current scroll offset.
+"""
+import curses
+import threading
+
+# how often keys are read, in seconds
+KEY_INTERVAL = 0.1
+STATUS = 'lines %d-%d%s | j/k: scroll, space/b: page, g: top, q: quit'
+
+SCROLL_KEYS = dict.fromkeys([ord('j'), curses.KEY_DOWN], 1)
+SCROLL_KEYS.update(dict.fromkeys([ord('k'), curses.KEY_UP], -1))
+PAGE_KEYS = dict.fromkeys([ord(' '), ord('f'), curses.KEY_NPAGE], 1)
+PAGE_KEYS.update(dict.fromkeys([ord('b'), curses.KEY_PPAGE], -1))
+TOP_KEYS = set([ord('g'), curses.KEY_HOME])
+QUIT_KEYS = set([ord('q'), ord('Q')])
+
+
+class ScreenRenderer(object):
+    """
+    Render reports on a curses window, writing only the rows changed since the previous frame.
+
+    The last row of the window is a status line with the visible range and the keys, the rows above show the report
+    from the scroll offset.
+    """
+    def __init__(self, scr, report):
+        """
+        :param scr: curses window
+        :param report: function building a report of at most the given number of lines
+        """
+        self.scr = scr
+        self.report = report
+        self.offset = 0
+        self.previous = []
+        self.size = None
+        # keys are read from another thread than the reports, curses calls must not interleave
+        self.lock = threading.RLock()
+        scr.nodelay(True)
+        scr.keypad(True)
+
+    def draw(self):
+        """
+        Build the report lines that fit the screen and write the rows which changed.
+        """
+        with self.lock:
+            height, width = self.scr.getmaxyx()
+            if (height, width) != self.size:
+                # resized, nothing on screen can be trusted
+                self.size = (height, width)
+                self.previous = []
+                self.scr.clear()
+            rows = max(height - 1, 1)
+
+            # one more line tells whether there is anything below the screen
+            output = self.report(self.offset + rows + 1)
+            lines = output.split('\n') if output else []
+            if lines and not lines[-1]:
+                lines.pop()
+            if self.offset and self.offset >= len(lines):
+                # the report got shorter than the scroll offset
+                self.offset = max(len(lines) - rows, 0)
+            visible = lines[self.offset:self.offset + rows]
+            more = ' (more)' if len(lines) > self.offset + rows else ''
+            status = STATUS % (self.offset + 1, self.offset + len(visible), more)
+
+            # the bottom right cell can't be written without an error, keep the last column free
+            frame = [line.expandtabs()[:width - 1] for line in visible]
+            frame.extend([''] * (rows - len(frame)))
+            frame.append(status[:width - 1])
+            self.write(frame)
+            self.scr.refresh()
+
+    def write(self, frame):
+        """
+        Write rows which differ from the previous frame.
+        :param frame: list of rows, each fitting the width of the window
+        """
+        for y, line in enumerate(frame):
+            if y < len(self.previous) and self.previous[y] == line:
+                continue
+            self.scr.move(y, 0)
+            self.scr.clrtoeol()
+            if line:
+                self.scr.addstr(y, 0, line)
+        self.previous = frame
+
+    def scroll(self, key):
+        """
+        Move the scroll offset according to a key.
+        :param key: key code from getch
+        :return: True if the offset changed
+        """
+        rows = max(self.scr.getmaxyx()[0] - 1, 1)
+        offset = self.offset
+        if key in SCROLL_KEYS:
+            offset += SCROLL_KEYS[key]
+        elif key in PAGE_KEYS:
+            offset += PAGE_KEYS[key] * rows
+        elif key in TOP_KEYS:
+            offset = 0
+        elif key in QUIT_KEYS:
+            raise SystemExit(0)
+        offset = max(offset, 0)
+        changed, self.offset = offset != self.offset, offset
+        return changed
+
+    def poll_keys(self):
+        """
+        Handle pending keys, redrawing at once if the screen scrolled. `q` exits.
+        """
+        with self.lock:
+            changed = False
+            key = self.scr.getch()
+            while key != -1:
+                if key == curses.KEY_RESIZE:
+                    changed = True
+                else:
+                    changed = self.scroll(key) or changed
+                key = self.scr.getch()
+            if changed:
+                self.draw()
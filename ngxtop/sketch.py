@@ -0,0 +1,275 @@
+"""
+Streaming sketches keeping fixed memory whatever the number of distinct values, used by --approx and percentiles.
+
+SpaceSaving finds heavy hitters: with k counters over a stream of N items, every item seen more than N / k times is
+kept, and the count of a kept item overestimates its true count by at most N / k (its `error`, usually much less).
+
+HyperLogLog estimates the number of distinct items in 2 ** precision bytes, with a standard error of
+1.04 / sqrt(2 ** precision): 1.6% for the default precision of 12 (4 KiB).
+
+LogHistogram estimates quantiles within a relative error of 1%, counting values in logarithmic buckets: request
+times from 1ms to 1h fit in about 750 buckets.
+
+All of them can be merged with the sketch of another processor (--workers, --state, window buckets), merged
+SpaceSaving counts overestimate by at most the sum of the bounds of both sketches.
+"""
+import heapq
+import hashlib
+import itertools
+import math
+import struct
+
+TOP_CAPACITY = 1024
+HLL_PRECISION = 12
+HISTOGRAM_ACCURACY = 0.01
+# values below are counted as 0, e.g. request times logged as 0.000
+HISTOGRAM_MIN_VALUE = 1e-9
+
+
+class SpaceSaving(object):
+    """
+    Space-Saving heavy hitters sketch (Metwally et al.) with a lazily updated heap of counters.
+    """
+    def __init__(self, capacity=TOP_CAPACITY):
+        """
+        :param capacity: number of items counted
+        """
+        self.capacity = capacity
+        # item - [count, overestimate]
+        self.counters = {}
+        # (count, sequence, item), counts are increased without updating the heap, entries are refreshed when popped
+        self.heap = []
+        self.sequence = itertools.count()
+        # total weight added
+        self.total = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['sequence'] = next(self.sequence)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.sequence = itertools.count(state['sequence'])
+
+    def __contains__(self, item):
+        return item in self.counters
+
+    def __len__(self):
+        return len(self.counters)
+
+    def add(self, item, weight=1):
+        """
+        Count an item.
+        :param item: hashable item
+        :param weight: weight of this occurrence
+        :return: the item evicted to make room for a new one, None if none was
+        """
+        self.total += weight
+        counter = self.counters.get(item)
+        if counter is not None:
+            counter[0] += weight
+            return None
+        if len(self.counters) < self.capacity:
+            self.counters[item] = [weight, 0]
+            heapq.heappush(self.heap, (weight, next(self.sequence), item))
+            return None
+
+        # the new item takes over the smallest counter, and its count as possible overestimate
+        count, victim = self.pop_min()
+        self.counters[item] = [count + weight, count]
+        heapq.heappush(self.heap, (count + weight, next(self.sequence), item))
+        return victim
+
+    def pop_min(self):
+        """
+        Remove the item with the smallest count.
+        :return: (count, item)
+        """
+        heap, counters = self.heap, self.counters
+        while True:
+            count, _, item = heap[0]
+            counter = counters.get(item)
+            if counter is None:
+                # discarded
+                heapq.heappop(heap)
+            elif counter[0] != count:
+                heapq.heapreplace(heap, (counter[0], next(self.sequence), item))
+            else:
+                heapq.heappop(heap)
+                del counters[item]
+                return count, item
+
+    def discard(self, item):
+        """
+        Stop counting an item, its heap entry is dropped when it comes up.
+        """
+        self.counters.pop(item, None)
+        if len(self.heap) > 2 * self.capacity:
+            self.rebuild()
+
+    def rebuild(self):
+        self.heap = [(counter[0], next(self.sequence), item) for item, counter in self.counters.items()]
+        heapq.heapify(self.heap)
+
+    def merge(self, other):
+        """
+        Merge the counts of another sketch, keeping the largest ones.
+        :param other: SpaceSaving to merge
+        """
+        self.total += other.total
+        for item, (count, error) in other.counters.items():
+            counter = self.counters.get(item)
+            if counter is None:
+                self.counters[item] = [count, error]
+            else:
+                counter[0] += count
+                counter[1] += error
+        if len(self.counters) > self.capacity:
+            kept = heapq.nlargest(self.capacity, self.counters.items(), key=lambda entry: entry[1][0])
+            self.counters = dict(kept)
+        self.rebuild()
+
+    def count(self, item):
+        """
+        :return: (count, overestimate) of an item, None if it isn't counted
+        """
+        counter = self.counters.get(item)
+        return tuple(counter) if counter is not None else None
+
+    def top(self, n=None):
+        """
+        :param n: number of items, all counted items by default
+        :return: list of (item, count, overestimate), largest counts first
+        """
+        entries = [(item, count, error) for item, (count, error) in self.counters.items()]
+        if n is None:
+            return sorted(entries, key=lambda entry: entry[1], reverse=True)
+        return heapq.nlargest(n, entries, key=lambda entry: entry[1])
+
+
+def hash64(value):
+    """
+    Hash stable across processes and runs (unlike hash() of strings), so sketches of workers and saved states merge.
+    """
+    if not isinstance(value, bytes):
+        value = str(value).encode('utf-8')
+    return struct.unpack('<Q', hashlib.md5(value).digest()[:8])[0]
+
+
+class HyperLogLog(object):
+    """
+    HyperLogLog distinct count estimator (Flajolet et al.), with linear counting for small cardinalities.
+    """
+    def __init__(self, precision=HLL_PRECISION):
+        """
+        :param precision: log2 of the number of registers, from 4 to 16
+        """
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+        # estimate as of the last change of the registers
+        self.estimate = 0
+
+    def add(self, value):
+        h = hash64(value)
+        index = h >> (64 - self.precision)
+        # position of the first 1 bit of the remaining bits
+        rest = h & ((1 << (64 - self.precision)) - 1)
+        rank = 64 - self.precision - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            self.estimate = None
+
+    def merge(self, other):
+        """
+        Merge another sketch of the same precision, estimating the distinct count of both streams together.
+        """
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+        self.estimate = None
+
+    def count(self):
+        """
+        :return: estimated number of distinct values added
+        """
+        if self.estimate is not None:
+            return self.estimate
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(float(m) / zeros)
+        self.estimate = int(round(estimate))
+        return self.estimate
+
+
+def percentile_rank(q, count):
+    """
+    :return: 1-based rank of the q quantile of count values, nearest rank method
+    """
+    # rounded so that e.g. 0.95 * 100 is rank 95, not 96
+    return max(int(math.ceil(round(q * count, 9))), 1)
+
+
+class LogHistogram(object):
+    """
+    Histogram of values in logarithmic buckets (as DDSketch, or HDR histograms) estimating quantiles within a relative
+    error of `accuracy`: bucket i counts the values in (gamma ** (i - 1), gamma ** i].
+    """
+    def __init__(self, accuracy=HISTOGRAM_ACCURACY):
+        """
+        :param accuracy: relative error of estimated quantiles
+        """
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.multiplier = 1 / math.log(self.gamma)
+        # bucket index - number of values
+        self.buckets = {}
+        # number of values below HISTOGRAM_MIN_VALUE
+        self.zeros = 0
+        self.total = 0
+
+    def __len__(self):
+        return self.total
+
+    def add(self, value):
+        self.total += 1
+        if value < HISTOGRAM_MIN_VALUE:
+            self.zeros += 1
+            return
+        index = int(math.ceil(math.log(value) * self.multiplier))
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def merge(self, other):
+        """
+        Merge another histogram of the same accuracy.
+        """
+        buckets = self.buckets
+        for index, count in other.buckets.items():
+            buckets[index] = buckets.get(index, 0) + count
+        self.zeros += other.zeros
+        self.total += other.total
+
+    def copy(self):
+        histogram = LogHistogram(self.accuracy)
+        histogram.merge(self)
+        return histogram
+
+    def quantile(self, q):
+        """
+        :param q: quantile, from 0 to 1
+        :return: estimate of the smallest value at least q of the values are lower than or equal to (nearest rank),
+        None if no value was added
+        """
+        if not self.total:
+            return None
+        rank = percentile_rank(q, self.total)
+        if rank <= self.zeros:
+            return 0.0
+        seen = self.zeros
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                break
+        # middle of the bucket in relative terms, within accuracy of any value of the bucket
+        return 2 * self.gamma ** index / (self.gamma + 1)
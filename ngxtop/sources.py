@@ -0,0 +1,109 @@
+"""
+Access log line sources, and the merge of records of several access logs.
+"""
+import gzip
+import heapq
+import os
+import mmap
+
+if __package__ is None:
+    from utils import parse_time_local
+else:
+    from .utils import parse_time_local
+
+
+class MmapSource(object):
+    """
+    Lines of a regular file read through a read-only memory map.
+
+    Patterns are matched against the map in place, so only the captured fields are ever copied out of the file.
+    Iterating the source itself yields decoded lines, for consumers which need the whole line as text.
+    """
+    def __init__(self, path, start=0, end=None):
+        self.path = path
+        self.start = start
+        self.end = end
+        # offset after the last line consumed
+        self.offset = start
+
+    def spans(self):
+        """
+        Scan the mapped file for newlines.
+        :return: iterator over (map, start, end) of every line, end excludes the newline
+        """
+        with open(self.path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            end = size if self.end is None else min(self.end, size)
+            if self.offset >= end:
+                return
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                find = mapped.find
+                position = self.offset
+                while position < end:
+                    newline = find(b'\n', position, size)
+                    line_end = size if newline < 0 else newline
+                    self.offset = line_end + 1 if newline >= 0 else size
+                    yield mapped, position, line_end
+                    position = self.offset
+            finally:
+                mapped.close()
+
+    def matches(self, pattern, hints=()):
+        """
+        Match a bytes pattern against every line.
+        :param pattern: compiled bytes pattern
+        :param hints: bytes every line must contain to be matched at all
+        :return: iterator over match objects, None for lines not matching
+        """
+        for mapped, start, end in self.spans():
+            if hints and not all(mapped.find(hint, start, end) >= 0 for hint in hints):
+                yield None
+            else:
+                yield pattern.match(mapped, start, end)
+
+    def __iter__(self):
+        for mapped, start, end in self.spans():
+            yield mapped[start:end].decode('utf-8', 'replace')
+
+
+class GzipSource(object):
+    """
+    Decoded lines of a gzip compressed file, e.g. an access log rotated by logrotate with compress.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        with gzip.open(self.path, 'rb') as f:
+            for line in f:
+                yield line.decode('utf-8', 'replace')
+
+
+def timed_records(records, order):
+    """
+    Decorate records of a log for merge_by_time.
+    :param records: records with time_local
+    :param order: order of the log among the merged ones
+    :return: iterator over (time, order, sequence, record), records without a valid time_local keep the time of the
+    previous one, so they keep their place in their log
+    """
+    time = 0
+    for sequence, record in enumerate(records):
+        try:
+            time = parse_time_local(record['time_local'])
+        except (KeyError, ValueError):
+            pass
+        yield time, order, sequence, record
+
+
+def merge_by_time(sources):
+    """
+    Merge records of several access logs into one time ordered stream, records of each log being in time order as
+    nginx writes them: a k-way merge keeping one record of every log in memory, consuming logs lazily.
+    :param sources: iterators over records with time_local, one per log
+    :return: iterator over records of all logs, records of the same time in the order of their logs
+    """
+    decorated = [timed_records(records, order) for order, records in enumerate(sources)]
+    for _, _, _, record in heapq.merge(*decorated):
+        yield record
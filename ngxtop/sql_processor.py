@@ -1,61 +1,268 @@
 """
 Records and statistic processor
 """
-import time
 import logging
 import sqlite3
 import tabulate
 from contextlib import closing
 
+if __package__ is None:
+    from aggregator import GroupAggregation, PercentileAggregate
+    from clock import CLOCK
+    from window import TimeBuckets
+else:
+    from .aggregator import GroupAggregation, PercentileAggregate
+    from .clock import CLOCK
+    from .window import TimeBuckets
+
+# records written to sqlite in one transaction
+BATCH_SIZE = 1000
+# pending records are written at least that often (seconds), so reports in follow mode stay current
+FLUSH_INTERVAL = 1.0
+# the database only lives in memory, durability is worth nothing here
+PRAGMAS = {
+    'journal_mode': 'OFF',
+    'synchronous': 'OFF',
+    'cache_size': -64 * 1024,  # KiB
+    'temp_store': 'MEMORY',
+}
+
 
 class SQLProcessor(object):
-    def __init__(self, report_queries, fields, index_fields=None):
+    def __init__(self, report_queries, fields, index_fields=None,
+                 batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL, pragmas=None, window=0, clock=CLOCK):
+        self.clock = clock
+        # monotonic time of the first record
         self.begin = False
         self.report_queries = report_queries
+        # queries maintained while processing records, rows only need to be stored for the others
+        self.aggregations = [query for query in report_queries if isinstance(query, GroupAggregation)]
+        self.store_rows = len(self.aggregations) < len(report_queries)
+        self.record_count = 0
         self.index_fields = index_fields if index_fields is not None else []
+        self.fields = fields
         self.column_list = ','.join(fields)
-        self.holder_list = ','.join(':%s' % var for var in fields)
-        self.conn = sqlite3.connect(':memory:')
+        # with a window, records are kept in one table per time bucket and `log` is a view over all of them
+        self.table = None if window else 'log'
+        self.insert = None
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pragmas = pragmas if pragmas is not None else PRAGMAS
+        self.pending = []
+        self.last_flush = clock.monotonic()
+        # processors are pickled from the task thread of the worker pool in --workers mode
+        self.conn = sqlite3.connect(':memory:', check_same_thread=False)
         self.init_db()
 
+        # aggregations are maintained both since start and per time bucket of the window
+        self.buckets = None
+        if window:
+            self.buckets = TimeBuckets(window, self.create_bucket)
+            self.roll(clock.monotonic())
+
+    def __getstate__(self):
+        # sqlite connection can't be pickled, ship the rows instead
+        self.flush()
+        state = self.__dict__.copy()
+        state['conn'] = self.rows()
+        return state
+
+    def __setstate__(self, state):
+        rows = state.pop('conn')
+        self.__dict__.update(state)
+        self.conn = sqlite3.connect(':memory:', check_same_thread=False)
+        self.init_db()
+        if not self.store_rows:
+            return
+        if self.buckets is not None:
+            for table, _ in self.buckets.values():
+                self.create_table(table)
+            self.create_view()
+        self.insert_rows(rows)
+
     def process(self, records):
-        self.begin = time.time()
-        insert = 'insert into log (%s) values (%s)' % (self.column_list, self.holder_list)
-        logging.info('sqlite insert: %s', insert)
+        # records of a batch are processed at the same time
+        now = self.clock.monotonic()
+        if not self.begin:
+            self.begin = now
+        fields = self.fields
+        aggregations = self.aggregations
+        buckets = self.buckets
+        if buckets is not None and now >= buckets.end:
+            self.roll(now)
+        bucket_aggregations = buckets.current[1] if buckets is not None else ()
+        for r in records:
+            self.record_count += 1
+            for aggregation in aggregations:
+                aggregation.update(r)
+            for aggregation in bucket_aggregations:
+                aggregation.update(r)
+            if not self.store_rows:
+                continue
+            self.pending.append(tuple(r.get(field) for field in fields))
+            if len(self.pending) >= self.batch_size:
+                self.flush()
+        if self.pending and now - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def discard(self, records):
+        """
+        Records of departed clients are kept, the log is a history of requests.
+        """
+        pass
+
+    def flush(self):
+        """
+        Write pending records in a single transaction.
+        """
+        rows, self.pending = self.pending, []
+        self.last_flush = self.clock.monotonic()
+        if rows:
+            self.insert_rows(rows)
+
+    def create_bucket(self, index):
+        """
+        Create storage of a new time bucket.
+        :param index: bucket index
+        :return: (table name, aggregations of the bucket)
+        """
+        table = None
+        if self.store_rows:
+            table = 'log_%d' % index
+            self.create_table(table)
+        return table, [aggregation.fresh() for aggregation in self.aggregations]
+
+    def roll(self, now):
+        """
+        Move to the time bucket covering given time, dropping buckets which fell out of the window.
+        :param now: monotonic time
+        """
+        # pending rows belong to the previous bucket
+        self.flush()
+        expired = self.buckets.advance(now)
+        if not self.store_rows:
+            return
+
         with closing(self.conn.cursor()) as cursor:
-            for r in records:
-                cursor.execute(insert, r)
+            for table, _ in expired:
+                cursor.execute('DROP TABLE %s' % table)
+        self.create_view()
+        self.table = self.buckets.current[0]
+        self.insert = self.build_insert(self.table)
 
-    def report(self):
+    def create_view(self):
+        tables = [table for table, _ in self.buckets.values()]
+        with closing(self.conn.cursor()) as cursor:
+            cursor.execute('DROP VIEW IF EXISTS log')
+            cursor.execute('CREATE VIEW log AS %s' %
+                           ' UNION ALL '.join('SELECT * FROM %s' % table for table in tables))
+
+    def window_aggregations(self):
+        """
+        Merge aggregations of all buckets in the window.
+        :return: one aggregation per report aggregation, covering the window
+        """
+        merged = [aggregation.fresh() for aggregation in self.aggregations]
+        for _, aggregations in self.buckets.values():
+            for aggregation, bucket_aggregation in zip(merged, aggregations):
+                aggregation.merge(bucket_aggregation)
+        return merged
+
+    def merge(self, other):
+        """
+        Merge records collected by another processor, e.g. a worker process parsing a part of the log.
+        :param other: SQLProcessor to merge
+        """
+        if other.begin and (not self.begin or other.begin < self.begin):
+            self.begin = other.begin
+        self.record_count += other.record_count
+        for aggregation, other_aggregation in zip(self.aggregations, other.aggregations):
+            aggregation.merge(other_aggregation)
+        if self.buckets is not None and other.buckets is not None:
+            for aggregation, other_aggregation in zip(self.buckets.current[1], other.window_aggregations()):
+                aggregation.merge(other_aggregation)
+        if self.store_rows:
+            self.insert_rows(other.rows())
+
+    def rows(self):
+        if not self.store_rows:
+            # aggregations only, with a window there isn't even a log table
+            return []
+        self.flush()
+        with closing(self.conn.cursor()) as cursor:
+            cursor.execute('SELECT %s FROM log' % self.column_list)
+            return cursor.fetchall()
+
+    def insert_rows(self, rows):
+        with self.conn:
+            self.conn.executemany(self.insert, rows)
+
+    def report(self, max_lines=None):
+        """
+        Build the report.
+        :param max_lines: number of lines of the screen, None for no limit
+        :return: report text
+        """
         if not self.begin:
             return ''
+        now = self.clock.monotonic()
+        if self.buckets is not None:
+            self.roll(now)
+        self.flush()
         count = self.count()
-        duration = time.time() - self.begin
+        duration = now - self.begin
         status = 'running for %.0f seconds, %d records processed: %.2f req/sec'
         output = [status % (duration, count, count / duration)]
+
+        tables = []
+        window_aggregations = self.window_aggregations() if self.buckets is not None else None
         with closing(self.conn.cursor()) as cursor:
             for query in self.report_queries:
-                if isinstance(query, tuple):
-                    label, query = query
+                if isinstance(query, GroupAggregation):
+                    if window_aggregations is not None:
+                        window = window_aggregations[self.aggregations.index(query)]
+                        label = '%s [last %ds]' % (query.label, self.buckets.window)
+                        tables.append((label, window.headers(), window.rows()))
+                    tables.append((query.label, query.headers(), query.rows()))
                 else:
-                    label = ''
-                cursor.execute(query)
-                columns = (d[0] for d in cursor.description)
-                result = tabulate.tabulate(cursor.fetchall(), headers=columns, tablefmt='orgtbl', floatfmt='.3f')
-                output.append('%s\n%s' % (label, result))
-        return '\n\n'.join(output)
+                    if isinstance(query, tuple):
+                        label, query = query
+                    else:
+                        label = ''
+                    cursor.execute(query)
+                    columns = [d[0] for d in cursor.description]
+                    tables.append((label, columns, cursor.fetchall()))
+
+        for label, columns, rows in tables:
+            result = tabulate.tabulate(rows, headers=columns, tablefmt='orgtbl', floatfmt='.3f')
+            output.append('%s\n%s' % (label, result))
+        output = '\n\n'.join(output)
+        if max_lines is not None:
+            output = '\n'.join(output.split('\n')[:max_lines])
+        return output
 
     def init_db(self):
-        create_table = 'create table log (%s)' % self.column_list
+        with closing(self.conn.cursor()) as cursor:
+            for name, value in sorted(self.pragmas.items()):
+                cursor.execute('PRAGMA %s = %s' % (name, value))
+        self.conn.create_aggregate('percentile', 2, PercentileAggregate)
+        if self.table == 'log':
+            self.create_table(self.table)
+            self.insert = self.build_insert(self.table)
+            logging.info('sqlite insert: %s', self.insert)
+
+    def build_insert(self, table):
+        return 'insert into %s (%s) values (%s)' % (table, self.column_list, ','.join('?' * len(self.fields)))
+
+    def create_table(self, table):
+        create_table = 'create table %s (%s)' % (table, self.column_list)
         with closing(self.conn.cursor()) as cursor:
             logging.info('sqlite init: %s', create_table)
             cursor.execute(create_table)
             for idx, field in enumerate(self.index_fields):
-                sql = 'create index log_idx%d on log (%s)' % (idx, field)
+                sql = 'create index %s_idx%d on %s (%s)' % (table, idx, table, field)
                 logging.info('sqlite init: %s', sql)
                 cursor.execute(sql)
 
     def count(self):
-        with closing(self.conn.cursor()) as cursor:
-            cursor.execute('SELECT count(1) FROM log')
-            return cursor.fetchone()[0]
+        return self.record_count
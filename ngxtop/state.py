@@ -0,0 +1,133 @@
+"""
+State file keeping the aggregates of a run and the position reached in the access log.
+
+The processor is pickled (as it already is for worker processes) together with the inode and offset of the access
+log it covers, and the last snapshot of every rtmp stat server. A run started with the same state file and the same
+options picks up at that offset: follow mode doesn't lose the history nor the lines written while it was stopped,
+and a repeated --no-follow run only parses what was appended since.
+
+The file is written to a temporary file renamed over the previous one, so an interrupted save never leaves a
+truncated state behind.
+"""
+import os
+import logging
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+if __package__ is None:
+    from clock import CLOCK, ResumedClock
+else:
+    from .clock import CLOCK, ResumedClock
+
+# bumped when processors change shape, states saved by older versions are ignored
+STATE_VERSION = 2
+# follow mode saves the state at most that often (seconds)
+CHECKPOINT_INTERVAL = 10.0
+# options shaping the records and the processor, a state saved with other values doesn't apply
+STATE_ARGUMENTS = ['--access-log', '--log-format', '--config', '--filter', '--pre-filter', '--window', '--group-by',
+                   '--order-by', '--limit', '--stream-pattern', '--approx', '--engine', '--a', 'print', 'top', 'avg',
+                   'sum', 'percentile', 'query', '<var>', '<query>']
+
+
+def state_key(arguments):
+    """
+    :param arguments: command line arguments
+    :return: the values of the options a state depends on
+    """
+    return tuple((name, arguments.get(name)) for name in STATE_ARGUMENTS)
+
+
+def file_position(path, offset=0):
+    """
+    :param path: access log
+    :param offset: offset reached in it
+    :return: ((device, inode), offset) position in the file
+    """
+    stat = os.stat(path)
+    return (stat.st_dev, stat.st_ino), offset
+
+
+def resume_offset(path, position):
+    """
+    Find where to resume parsing a file.
+    :param path: access log
+    :param position: (inode, offset) saved, None if nothing was saved
+    :return: offset to start from: the saved one if the file is still the same, 0 if it was rotated or truncated
+    meanwhile, None if there is no saved position
+    """
+    if position is None:
+        return None
+    inode, offset = position
+    stat = os.stat(path)
+    if (stat.st_dev, stat.st_ino) == inode and stat.st_size >= offset:
+        return offset
+    logging.info('%s was rotated or truncated since the state was saved, parsing it from the start', path)
+    return 0
+
+
+class StateFile(object):
+    def __init__(self, path, key, interval=CHECKPOINT_INTERVAL, clock=CLOCK):
+        """
+        :param path: state file
+        :param key: options the state depends on, see state_key
+        :param interval: minimum time between checkpoints, seconds
+        :param clock: time source of the checkpoint schedule
+        """
+        self.path = path
+        self.key = key
+        self.interval = interval
+        self.clock = clock
+        # monotonic time of the last save, the first checkpoint is always due
+        self.last_save = None
+
+    def load(self):
+        """
+        Read the saved state.
+        :return: state dict with processor, position and rtmp snapshots, None if nothing applicable was saved
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                state = pickle.load(f)
+        except (IOError, OSError):
+            return None
+        except Exception as e:
+            logging.warning('ignoring unreadable state file %s: %s', self.path, e)
+            return None
+        if state.get('version') != STATE_VERSION or state.get('key') != self.key:
+            logging.warning('ignoring state file %s saved with other options', self.path)
+            return None
+
+        # monotonic times of the processor go on from the saved ones
+        state['processor'].clock = ResumedClock(state['time'], state['monotonic'])
+        return state
+
+    def due(self):
+        return self.last_save is None or self.clock.monotonic() - self.last_save >= self.interval
+
+    def save(self, processor, position, rtmp=None):
+        """
+        Write the state, replacing the previous one atomically.
+        :param processor: processor covering the log up to given position
+        :param position: (inode, offset) in the access log, None if it isn't a file
+        :param rtmp: last snapshot (stream infos) of every rtmp stat server, by url
+        """
+        state = {
+            'version': STATE_VERSION,
+            'key': self.key,
+            'time': processor.clock.time(),
+            'monotonic': processor.clock.monotonic(),
+            'processor': processor,
+            'position': position,
+            'rtmp': rtmp or {},
+        }
+        temporary = self.path + '.tmp'
+        with open(temporary, 'wb') as f:
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(temporary, self.path)
+        self.last_save = self.clock.monotonic()
+        logging.info('state saved to %s at %s', self.path, position)
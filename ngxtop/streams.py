@@ -0,0 +1,99 @@
+"""
+Classification of requests into the hls stream they belong to.
+
+Stream patterns are request paths where `$stream` marks the stream name, e.g. `/live/$stream.m3u8`. Patterns shaped
+`<prefix>$stream<suffix>` or `<prefix>$stream<separator>$var<suffix>` are checked with string operations, other
+ones with a regular expression. Players request the same playlists and fragments over and over, so the stream of
+recent requests is cached and most requests are classified by a single dict lookup.
+"""
+import re
+
+if __package__ is None:
+    from config_parser import REGEX_LOG_FORMAT_VARIABLE, REGEX_SPECIAL_CHARS
+    from utils import LRUCache, intern
+else:
+    from .config_parser import REGEX_LOG_FORMAT_VARIABLE, REGEX_SPECIAL_CHARS
+    from .utils import LRUCache, intern
+
+STREAM_PATTERNS = ['/live/$stream.m3u8', '/live/$stream-$frag.ts']
+# requests whose stream is kept in the cache
+STREAM_CACHE_SIZE = 16384
+# a variable followed by a single character and a suffix without variables, e.g. `-$frag.ts`
+REGEX_FRAGMENT = re.compile(r'^([^$]+)\$[a-zA-Z0-9_]+([^$]*)$')
+
+
+def request_path(request):
+    """
+    Get the path of a request line, e.g. `/live/801.m3u8` of `GET /live/801.m3u8?k=1 HTTP/1.1`.
+    :return: the path, None if the request isn't a request line
+    """
+    start, end = request.find(' ') + 1, request.rfind(' ')
+    if end < start:
+        return None
+    query = request.find('?', start, end)
+    return request[start:query if query >= 0 else end]
+
+
+def compile_pattern(pattern):
+    """
+    Compile a stream pattern.
+    :return: (prefix, suffix, separator, regex): patterns shaped `<prefix>$stream<suffix>` or
+    `<prefix>$stream<separator>$var<suffix>` are matched with string operations, the same way as their regular
+    expression (variables matching greedily) and have no regex; other patterns only have a regex
+    """
+    prefix, stream, rest = pattern.partition('$stream')
+    if not stream:
+        raise ValueError('stream pattern without $stream: %s' % pattern)
+    separator = None
+    if '$' in rest:
+        fragment = REGEX_FRAGMENT.match(rest)
+        if fragment is not None and len(fragment.group(1)) == 1:
+            separator, rest = fragment.groups()
+    if '$' in prefix or '$' in rest:
+        regex = re.sub(REGEX_SPECIAL_CHARS, r'\\\1', pattern)
+        regex = re.compile(re.sub(REGEX_LOG_FORMAT_VARIABLE, '(?P<\\1>.*)', regex) + r'\Z')
+        return None, None, None, regex
+    return prefix, rest, separator, None
+
+
+class StreamClassifier(object):
+    """
+    Map requests to stream names: the stream of hls playlists and fragments, the request itself otherwise
+    (e.g. rtmp stream names).
+    """
+    def __init__(self, patterns=None, cache_size=STREAM_CACHE_SIZE):
+        """
+        :param patterns: request path patterns, $stream marking the stream name, STREAM_PATTERNS by default
+        :param cache_size: number of requests whose stream is cached
+        """
+        self.patterns = list(patterns if patterns is not None else STREAM_PATTERNS)
+        self.compiled = [compile_pattern(pattern) for pattern in self.patterns]
+        self.cache = LRUCache(cache_size)
+
+    def classify(self, request):
+        """
+        Classify a request without looking at the cache.
+        """
+        path = request_path(request)
+        if path is None:
+            return request
+        # patterns are tried in order, inlined as this runs for every request missing the cache
+        for prefix, suffix, separator, regex in self.compiled:
+            if regex is not None:
+                match = regex.match(path)
+                if match is not None:
+                    return intern(match.group('stream'))
+            elif path.startswith(prefix) and path.endswith(suffix) and len(path) >= len(prefix) + len(suffix):
+                stream = path[len(prefix):len(path) - len(suffix)]
+                if separator is None:
+                    return intern(stream)
+                stream, found, _ = stream.rpartition(separator)
+                if found:
+                    return intern(stream)
+        return request
+
+    def __call__(self, request):
+        stream = self.cache.get(request)
+        if stream is None:
+            stream = self.cache[request] = self.classify(request)
+        return stream
@@ -0,0 +1,259 @@
+"""
+Event driven `tail -F` of access log files.
+
+On Linux the directory of the followed file is watched with inotify, so new lines are read as soon as they are
+written, otherwise the file is polled. Rotation (rename and create) and truncation (copytruncate) are detected by
+inode and size, the rotated file is drained and the new one is followed from its beginning.
+
+Several files are followed at once by MultiTailer, which reads whichever has new lines and waits on all of them
+together when none has.
+"""
+import os
+import time
+import errno
+import select
+import ctypes
+import ctypes.util
+
+CHUNK_SIZE = 64 * 1024
+# chunks read at once at most, a large backlog (e.g. resuming from a saved offset) is yielded as it is read
+READ_CHUNKS = 16
+POLL_INTERVAL = 0.1
+# lines read from a file before giving the other followed files their turn
+BATCH_LINES = 1000
+# inotify can miss a rotation happening between two checks, look at the file at least that often anyway
+WATCH_TIMEOUT = 1.0
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+
+class InotifyWatcher(object):
+    """
+    Wait for changes in the directory of a file through inotify.
+    """
+    def __init__(self, path):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        directory = os.path.dirname(os.path.abspath(path))
+        if libc.inotify_add_watch(self.fd, directory.encode('utf-8'), WATCH_MASK) < 0:
+            error = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error, 'inotify_add_watch failed for %s' % directory)
+        self.timeout = WATCH_TIMEOUT
+
+    def wait(self):
+        readable, _, _ = select.select([self.fd], [], [], self.timeout)
+        if readable:
+            self.drain()
+
+    def drain(self):
+        # the events themselves don't matter, the tailer checks the file anyway
+        try:
+            while os.read(self.fd, CHUNK_SIZE):
+                pass
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollWatcher(object):
+    """
+    Fallback for platforms without inotify: sleep briefly before checking the file again.
+    """
+    def __init__(self, interval=POLL_INTERVAL):
+        self.interval = self.timeout = interval
+        # nothing to select on
+        self.fd = None
+
+    def wait(self):
+        time.sleep(self.interval)
+
+    def close(self):
+        pass
+
+
+def create_watcher(path):
+    try:
+        return InotifyWatcher(path)
+    except (OSError, AttributeError, TypeError):
+        # no inotify on this platform (or watch limit reached)
+        return PollWatcher()
+
+
+def wait_any(watchers):
+    """
+    Wait for changes of any of several files, as long as the most impatient watcher would.
+    :param watchers: watchers of the files
+    """
+    timeout = min(watcher.timeout for watcher in watchers)
+    fds = [watcher.fd for watcher in watchers if watcher.fd is not None]
+    if not fds:
+        time.sleep(timeout)
+        return
+    readable, _, _ = select.select(fds, [], [], timeout)
+    for watcher in watchers:
+        if watcher.fd in readable:
+            watcher.drain()
+
+
+class Tailer(object):
+    def __init__(self, path, from_end=True, watcher=None, start=None, checkpoint=None):
+        """
+        :param path: file to follow
+        :param from_end: skip the current content of the file
+        :param watcher: waits for changes, inotify or polling by default
+        :param start: offset to resume from instead, e.g. where a previous run stopped
+        :param checkpoint: called with ((device, inode), offset) whenever every line before offset has been consumed
+        """
+        self.path = path
+        self.from_end = from_end
+        self.watcher = watcher
+        self.start = start
+        self.checkpoint = checkpoint
+        self.file = None
+        self.inode = None
+        # offset after the last line yielded
+        self.offset = 0
+
+    def open(self, from_end):
+        self.file = open(self.path, 'rb')
+        stat = os.fstat(self.file.fileno())
+        self.inode = (stat.st_dev, stat.st_ino)
+        self.offset = stat.st_size if from_end else 0
+        if self.start is not None:
+            self.offset, self.start = min(self.start, stat.st_size), None
+        self.file.seek(self.offset)
+
+    def rotated(self):
+        """
+        Check whether the followed path now refers to another file
+        :return: True if the path exists and is not the opened file
+        """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            # moved away and not created again yet
+            return False
+        return (stat.st_dev, stat.st_ino) != self.inode
+
+    def truncated(self):
+        return os.fstat(self.file.fileno()).st_size < self.offset
+
+    def read_lines(self, buffer):
+        """
+        Read what is available in large chunks, READ_CHUNKS of them at most.
+        :param buffer: incomplete last line left by the previous read
+        :return: (complete lines, incomplete last line, whether the end of the file was reached)
+        """
+        chunks = [buffer]
+        end = False
+        for _ in range(READ_CHUNKS):
+            chunk = self.file.read(CHUNK_SIZE)
+            if not chunk:
+                end = True
+                break
+            chunks.append(chunk)
+        lines = b''.join(chunks).split(b'\n')
+        return lines[:-1], lines[-1], end
+
+    def lines(self, idle=False):
+        """
+        Open the file now and follow it.
+        :param idle: yield None instead of waiting whenever there is no new line, to wait for other files as well
+        :return: iterator over new lines, including the trailing newline
+        """
+        if self.watcher is None:
+            self.watcher = create_watcher(self.path)
+        self.open(self.from_end)
+        return self.follow(idle)
+
+    def follow(self, idle=False):
+        buffer = b''
+        try:
+            while True:
+                if self.checkpoint is not None:
+                    # the consumer came back for more, lines yielded so far are dealt with
+                    self.checkpoint((self.inode, self.offset))
+                lines, buffer, end = self.read_lines(buffer)
+                for line in lines:
+                    self.offset += len(line) + 1
+                    yield line.decode('utf-8', 'replace') + '\n'
+                if lines or not end:
+                    continue
+
+                if self.rotated():
+                    # nothing is written to the old file once the new one exists, drain it and switch
+                    end = False
+                    while not end:
+                        lines, buffer, end = self.read_lines(buffer)
+                        if end and buffer:
+                            lines.append(buffer)
+                            buffer = b''
+                        for line in lines:
+                            yield line.decode('utf-8', 'replace') + '\n'
+                    self.file.close()
+                    self.open(from_end=False)
+                elif self.truncated():
+                    self.file.seek(0)
+                    self.offset = 0
+                    buffer = b''
+                elif idle:
+                    yield None
+                else:
+                    self.watcher.wait()
+        finally:
+            if self.file is not None:
+                self.file.close()
+            self.watcher.close()
+
+
+class MultiTailer(object):
+    """
+    Follow several files at once, e.g. access logs of several virtual hosts.
+    """
+    def __init__(self, tailers):
+        """
+        :param tailers: Tailer of every file
+        """
+        self.tailers = tailers
+
+    def batches(self):
+        """
+        Open the files now and follow them, reading them in turn.
+        :return: iterator over (index of the file, lines read from it), waiting while no file has new lines
+        """
+        return self.interleave([tailer.lines(idle=True) for tailer in self.tailers])
+
+    def interleave(self, follows):
+        try:
+            while True:
+                idle = True
+                for index, lines in enumerate(follows):
+                    batch = []
+                    for line in lines:
+                        if line is None:
+                            break
+                        batch.append(line)
+                        if len(batch) >= BATCH_LINES:
+                            idle = False
+                            break
+                    if batch:
+                        yield index, batch
+                if idle:
+                    wait_any([tailer.watcher for tailer in self.tailers])
+        finally:
+            for lines in follows:
+                lines.close()
@@ -1,20 +1,17 @@
 import sys
 import logging
+import calendar
+from collections import OrderedDict
 
+try:
+    from sys import intern as intern_str
+except ImportError:
+    intern_str = intern  # python 2 builtin
 
-def choose_one(choices, prompt):
-    for idx, choice in enumerate(choices):
-        print('%d. %s' % (idx + 1, choice))
-    selected = None
-    if sys.version[0] == '3':
-        raw_input = input
-    while not selected or selected <= 0 or selected > len(choices):
-        selected = raw_input(prompt)
-        try:
-            selected = int(selected)
-        except ValueError:
-            selected = None
-    return choices[selected - 1]
+try:
+    string_types = basestring  # python 2
+except NameError:
+    string_types = str
 
 
 def trace(sequence, phase=''):
@@ -34,3 +31,98 @@ def to_int(value):
 
 def to_float(value):
     return float(value) if value and value != '-' else 0.0
+
+
+def to_number(value):
+    """
+    Numeric value of captured text, e.g. fields which aren't converted when parsed, for aggregations.
+    :return: the int or float value, None if the text isn't a number such as `-`; other values are returned as is
+    """
+    if not isinstance(value, string_types):
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+
+
+def intern(value):
+    """
+    Intern strings repeated across many objects, e.g. user agents. Any other value is returned as is.
+    """
+    return intern_str(value) if isinstance(value, str) else value
+
+
+class LRUCache(object):
+    """
+    Mapping keeping only the most recently used entries.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.data = OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            value = self.data.pop(key)
+        except KeyError:
+            return default
+        # most recently used entries are kept at the end
+        self.data[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self.data.pop(key, None)
+        self.data[key] = value
+        if len(self.data) > self.size:
+            self.data.popitem(last=False)
+
+    def __len__(self):
+        return len(self.data)
+
+
+MONTHS = dict((name, idx) for idx, name in enumerate(
+    ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'], 1))
+
+
+class TimeLocalParser(object):
+    """
+    Parser of nginx $time_local values, `16/May/2016:10:38:08 +0800`, into UTC epoch seconds.
+
+    Consecutive lines nearly always share their timestamp, so the last value is remembered, and the start of day of
+    recent dates is cached, leaving only integer slicing for other seconds of a known day.
+    """
+    def __init__(self, cache_size=64):
+        self.last = (None, None)
+        self.days = LRUCache(cache_size)
+
+    def __call__(self, value):
+        last_value, last_result = self.last
+        if value == last_value:
+            return last_result
+
+        if len(value) != 26 or value[2] != '/' or value[11] != ':':
+            raise ValueError('invalid time_local: %r' % value)
+        try:
+            # `dd/Mon/yyyy:HH:MM:SS +hhmm`, split into the date (with the zone) and the time of day
+            date = value[:11] + value[20:]
+            day = self.days.get(date)
+            if day is None:
+                offset = int(value[22:24]) * 3600 + int(value[24:26]) * 60
+                if value[21] == '-':
+                    offset = -offset
+                elif value[21] != '+':
+                    raise ValueError
+                day = calendar.timegm((int(value[7:11]), MONTHS[value[3:6]], int(value[0:2]), 0, 0, 0)) - offset
+                self.days[date] = day
+            result = day + int(value[12:14]) * 3600 + int(value[15:17]) * 60 + int(value[18:20])
+        except (KeyError, IndexError, ValueError):
+            raise ValueError('invalid time_local: %r' % value)
+
+        self.last = (value, result)
+        return result
+
+
+parse_time_local = TimeLocalParser()
@@ -0,0 +1,163 @@
+"""
+Time bucketed storage for sliding window retention, and rings of recent traffic for rates.
+"""
+import array
+from collections import deque
+
+# number of buckets a window is divided into, the window slides by one bucket at a time
+WINDOW_BUCKETS = 12
+# seconds covered by each interval of rate rings
+RATE_INTERVAL = 2.0
+# intervals of a rate ring, the width of its sparkline
+RATE_SLOTS = 30
+
+
+class TimeBuckets(object):
+    """
+    Fixed width time buckets covering a sliding window.
+
+    Values of a whole bucket are dropped at once when it falls out of the window.
+    """
+    def __init__(self, window, factory, count=WINDOW_BUCKETS):
+        """
+        :param window: window length in seconds
+        :param factory: called with the bucket index to create the value of a new bucket
+        :param count: number of buckets in the window
+        """
+        self.window = window
+        self.width = float(window) / count
+        self.count = count
+        self.factory = factory
+        # (bucket index, value), oldest first
+        self.buckets = deque()
+        # end of the current bucket, records before that time belong to it
+        self.end = 0
+
+    def advance(self, now):
+        """
+        Start the bucket covering given time and drop the buckets fallen out of the window.
+        :param now: current time in seconds
+        :return: values of the dropped buckets
+        """
+        index = int(now // self.width)
+        self.end = (index + 1) * self.width
+        if not self.buckets or index > self.buckets[-1][0]:
+            self.buckets.append((index, self.factory(index)))
+
+        expired = []
+        while self.buckets[0][0] <= index - self.count:
+            expired.append(self.buckets.popleft()[1])
+        return expired
+
+    @property
+    def index(self):
+        return self.buckets[-1][0]
+
+    @property
+    def current(self):
+        return self.buckets[-1][1]
+
+    def values(self):
+        return [value for _, value in self.buckets]
+
+
+def interval(time):
+    """
+    :param time: epoch seconds
+    :return: number of the rate interval of given time
+    """
+    return int(time // RATE_INTERVAL)
+
+
+class RateRing(object):
+    """
+    Bytes and requests of each of the last time intervals, in a fixed size array used as a ring: memory doesn't
+    depend on traffic, and bursts or stalls show up interval by interval instead of being averaged away.
+
+    Intervals are numbered from the epoch, so rings of several processors line up when merged.
+    """
+    # hundreds of thousands of clients have one
+    __slots__ = ('counts', 'last')
+
+    def __init__(self, slots=RATE_SLOTS, typecode='d'):
+        """
+        :param slots: number of intervals covered
+        :param typecode: array type of the counts, 'f' halves the memory of the ring
+        """
+        # bytes and requests of interval i are at 2 * (i % slots) and the next item
+        self.counts = array.array(typecode, [0]) * (2 * slots)
+        # interval of the latest traffic, None until something is added
+        self.last = None
+
+    def __len__(self):
+        return len(self.counts) // 2
+
+    def advance(self, index):
+        """
+        Move to a later interval, clearing the intervals passed over.
+        :param index: interval number
+        """
+        last = self.last
+        if last is not None and index <= last:
+            return
+        if last is not None:
+            counts, slots = self.counts, len(self.counts) // 2
+            for skipped in range(last + 1, min(index, last + slots) + 1):
+                position = 2 * (skipped % slots)
+                counts[position] = counts[position + 1] = 0
+        self.last = index
+
+    def add(self, index, size, requests=1):
+        """
+        Count traffic, traffic older than the ring is dropped.
+        :param index: interval the traffic happened in, see interval()
+        :param size: bytes
+        :param requests: number of requests
+        """
+        counts, last = self.counts, self.last
+        if index != last:
+            if last is None or index > last:
+                self.advance(index)
+            elif index <= last - len(counts) // 2:
+                return
+        position = 2 * (index % (len(counts) // 2))
+        counts[position] += size
+        counts[position + 1] += requests
+
+    def series(self, time, requests=False):
+        """
+        :param time: epoch seconds of the latest interval
+        :param requests: requests instead of bytes
+        :return: bytes (or requests) of every interval of the ring up to the latest one (in progress), oldest first
+        """
+        counts, slots, last = self.counts, len(self.counts) // 2, self.last
+        if last is None:
+            return [0] * slots
+        end = max(interval(time), last)
+        # intervals after the last traffic are empty, whatever the ring still holds
+        return [counts[2 * (index % slots) + requests] if index <= last else 0
+                for index in range(end - slots + 1, end + 1)]
+
+    def rate(self, time, intervals=1, requests=False):
+        """
+        :param time: epoch seconds of the latest interval, see series
+        :param intervals: number of complete intervals before the latest one to average, 1 for the current rate
+        :param requests: requests instead of bytes
+        :return: bytes (or requests) per second
+        """
+        intervals = min(intervals, len(self) - 1)
+        return sum(self.series(time, requests)[-1 - intervals:-1]) / (intervals * RATE_INTERVAL)
+
+    def merge(self, other):
+        """
+        Add the intervals of another ring still covered by this one.
+        :param other: RateRing to merge
+        """
+        if other.last is None:
+            return
+        self.advance(other.last)
+        slots, other_slots = len(self), len(other)
+        for index in range(max(self.last - slots, other.last - other_slots) + 1, other.last + 1):
+            position, other_position = 2 * (index % slots), 2 * (index % other_slots)
+            self.counts[position] += other.counts[other_position]
+            self.counts[position + 1] += other.counts[other_position + 1]
@@ -27,7 +27,10 @@ setup(
     keywords='cli monitoring nginx system',
 
     packages=['ngxtop'],
-    install_requires=['docopt', 'tabulate', 'pyparsing', 'python-dateutil'],
+    install_requires=['docopt', 'tabulate', 'pyparsing'],
+    extras_require={
+        'numpy': ['numpy'],
+    },
 
     entry_points={
         'console_scripts': [
@@ -0,0 +1,17 @@
+"""
+Helpers shared by tests.
+"""
+
+
+class FakeClock(object):
+    """
+    Clock whose time only moves when a test sets it, for processors and pollers taking a clock.
+    """
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
@@ -0,0 +1,96 @@
+import random
+
+from ngxtop.aggregator import GroupAggregation, Count, Sum, Avg, Min, Max, Percentile
+from ngxtop.sql_processor import SQLProcessor
+
+FIELDS = ['request_path', 'status_type', 'bytes_sent']
+COLUMNS = [Count('count'), Avg('avg_bytes_sent', 'bytes_sent'), Sum('sum_bytes_sent', 'bytes_sent'),
+           Min('min_bytes_sent', 'bytes_sent'), Max('max_bytes_sent', 'bytes_sent'),
+           Count('2xx', 'status_type', 2), Count('4xx', 'status_type', 4)]
+
+
+def build_records(count):
+    rand = random.Random(1)
+    for _ in range(count):
+        yield {'request_path': '/live/%d.ts' % rand.randrange(20),
+               'status_type': rand.choice((2, 2, 3, 4)),
+               'bytes_sent': rand.choice((None, rand.randrange(1000)))}
+
+
+def run_sql(query):
+    processor = SQLProcessor([('all', query)], FIELDS)
+    processor.process(build_records(500))
+    processor.flush()
+    return processor.conn.execute(query).fetchall()
+
+
+def test_group_aggregation_matches_sql():
+    aggregation = GroupAggregation('detail', ['request_path'], COLUMNS, 'count')
+    for record in build_records(500):
+        aggregation.update(record)
+    # order of groups with the same count is not defined
+    assert sorted(aggregation.rows()) == sorted(run_sql(aggregation.sql()))
+    counts = [row[1] for row in aggregation.rows()]
+    assert counts == sorted(counts, reverse=True)
+
+
+def test_aggregation_of_unconverted_field():
+    # body_bytes_sent isn't converted when parsed, sqlite reads its numeric text for sum and avg
+    columns = [Avg('avg_body_bytes_sent', 'body_bytes_sent'), Sum('sum_body_bytes_sent', 'body_bytes_sent'),
+               Min('min_body_bytes_sent', 'body_bytes_sent'), Max('max_body_bytes_sent', 'body_bytes_sent')]
+    records = [{'body_bytes_sent': value} for value in ('612', '9', None, '1024', '0')]
+    aggregation = GroupAggregation('summary', [], columns)
+    for record in records:
+        aggregation.update(record)
+    processor = SQLProcessor([('all', aggregation.sql())], ['body_bytes_sent'])
+    processor.process(records)
+    processor.flush()
+    assert aggregation.rows()[0][:2] == processor.conn.execute(aggregation.sql()).fetchall()[0][:2] == (411.25, 1645)
+    # sqlite compares text as such, the aggregations compare numbers
+    assert aggregation.rows()[0][2:] == (0, 1024)
+
+
+def test_summary_aggregation_without_records():
+    aggregation = GroupAggregation('summary', [], COLUMNS, 'count', 10)
+    assert aggregation.rows() == run_sql(aggregation.sql().replace('FROM log', 'FROM log WHERE 0'))
+
+
+def test_merge_aggregations():
+    records = list(build_records(500))
+    whole = GroupAggregation('detail', ['request_path'], COLUMNS, 'count', 5)
+    first = GroupAggregation('detail', ['request_path'], COLUMNS, 'count', 5)
+    second = GroupAggregation('detail', ['request_path'], COLUMNS, 'count', 5)
+    for idx, record in enumerate(records):
+        whole.update(record)
+        (first if idx % 2 else second).update(record)
+    first.merge(second)
+    assert first.groups == whole.groups
+
+
+def test_sql_processor_reports_aggregations_without_storing_rows():
+    aggregation = GroupAggregation('top request_path', ['request_path'], [Count('count')], 'count', 3)
+    processor = SQLProcessor([aggregation], FIELDS)
+    processor.process(build_records(100))
+    assert processor.count() == 100
+    assert processor.rows() == []
+    assert 'top request_path' in processor.report()
+
+
+def test_percentile_matches_sql_and_merges():
+    columns = [Percentile('p50', 'bytes_sent', 50), Percentile('p99', 'bytes_sent', 99)]
+    records = list(build_records(500))
+    whole = GroupAggregation('percentiles', ['status_type'], columns)
+    first = GroupAggregation('percentiles', ['status_type'], columns)
+    second = GroupAggregation('percentiles', ['status_type'], columns)
+    for idx, record in enumerate(records):
+        whole.update(record)
+        (first if idx % 2 else second).update(record)
+    # sqlite runs the same estimate as an aggregate function
+    assert sorted(whole.rows()) == sorted(run_sql(whole.sql()))
+
+    merged = first.fresh()
+    merged.merge(first)
+    merged.merge(second)
+    assert sorted(merged.rows()) == sorted(whole.rows())
+    # merging copied the histograms of the merged queries, which keep being updated on their own
+    assert all(merged.groups[key][0] is not acc[0] for key, acc in first.groups.items())
@@ -0,0 +1,62 @@
+import pytest
+
+pytest.importorskip('numpy')
+
+from ngxtop.aggregator import GroupAggregation, Count, Sum, Avg, Min, Max, Percentile
+from ngxtop.columnar import ColumnarProcessor
+
+RECORDS = [
+    {'request_path': '/a', 'remote_addr': '10.0.0.1', 'status': 200, 'bytes_sent': 100, 'request_time': 0.5},
+    {'request_path': '/b', 'remote_addr': '10.0.0.2', 'status': 404, 'bytes_sent': 10, 'request_time': 0.1},
+    {'request_path': '/a', 'remote_addr': '10.0.0.2', 'status': 200, 'bytes_sent': 300, 'request_time': None},
+    {'request_path': '/c', 'remote_addr': '10.0.0.3', 'status': 500, 'bytes_sent': 0, 'request_time': 1.5},
+    {'request_path': '/a', 'remote_addr': '10.0.0.3', 'status': 404, 'bytes_sent': 50},
+]
+FIELDS = ['request_path', 'remote_addr', 'status', 'bytes_sent', 'request_time']
+QUERIES = [
+    GroupAggregation('top', ['request_path'], [Count('count')], 'count', 2),
+    GroupAggregation('status', ['request_path', 'status'], [Count('count'), Count('404', 'status', 404)]),
+    GroupAggregation('avg', [], [Avg('avg', 'request_time'), Sum('sum', 'bytes_sent'), Min('min', 'bytes_sent'),
+                                 Max('max', 'request_time')]),
+    GroupAggregation('print', ['remote_addr'], []),
+]
+
+
+def incremental_rows(query, records):
+    query = query.fresh()
+    for record in records:
+        query.update(record)
+    return query.rows()
+
+
+@pytest.mark.parametrize('query', QUERIES, ids=[query.label for query in QUERIES])
+def test_columnar_rows_match_incremental_aggregation(query):
+    processor = ColumnarProcessor(QUERIES, FIELDS)
+    processor.process(RECORDS)
+    assert sorted(processor.rows(query)) == sorted(incremental_rows(query, RECORDS))
+
+
+def test_merge_re_encodes_values():
+    processor = ColumnarProcessor(QUERIES, FIELDS)
+    processor.process(RECORDS[:2])
+    other = ColumnarProcessor(QUERIES, FIELDS)
+    other.process(RECORDS[2:])
+    processor.merge(other)
+    assert processor.count() == len(RECORDS)
+    assert processor.rows(QUERIES[0]) == [('/a', 3), ('/b', 1)]
+    assert 'running for' in processor.report()
+
+
+def test_empty_aggregation_has_one_row():
+    processor = ColumnarProcessor(QUERIES, FIELDS)
+    processor.process([])
+    assert processor.rows(QUERIES[2]) == [(None, None, None, None)]
+    assert processor.rows(QUERIES[0]) == []
+
+
+def test_percentiles_are_exact():
+    query = GroupAggregation('percentiles', ['request_path'],
+                             [Percentile('p50', 'request_time', 50), Percentile('p99', 'bytes_sent', 99)])
+    processor = ColumnarProcessor([query], FIELDS)
+    processor.process(RECORDS)
+    assert sorted(processor.rows(query)) == [('/a', 0.5, 300.0), ('/b', 0.1, 10.0), ('/c', 1.5, 0.0)]
@@ -58,3 +58,49 @@ def test_access_logs_with_format_name():
     assert len(logs) == 2
     assert logs['/path/to/main.log'] == 'main'
     assert logs['/path/to/test.log'] == 'te st'
+
+
+def test_build_pattern_combined():
+    line = '192.168.1.10 - - [27/Apr/2016:07:04:48 +0000] "GET /live/801-261550546.m3u8 HTTP/1.1" 206 147 ' \
+           '"http://192.168.1.12:8080/?cname=801" "Mozilla/5.0 (Linux; Android 4.4.2) Safari/537.36"\n'
+    match = config_parser.build_pattern('combined').match(line)
+    assert match is not None
+    record = match.groupdict()
+    assert record['remote_addr'] == '192.168.1.10'
+    assert record['time_local'] == '27/Apr/2016:07:04:48 +0000'
+    assert record['request'] == 'GET /live/801-261550546.m3u8 HTTP/1.1'
+    assert record['status'] == '206'
+    assert record['body_bytes_sent'] == '147'
+    assert record['http_referer'] == 'http://192.168.1.12:8080/?cname=801'
+    assert record['http_user_agent'] == 'Mozilla/5.0 (Linux; Android 4.4.2) Safari/537.36'
+
+
+def test_build_pattern_rejects_malformed_status():
+    line = '192.168.1.10 - - [27/Apr/2016:07:04:48 +0000] "GET / HTTP/1.1" abc 147 "-" "-"'
+    assert config_parser.build_pattern('combined').match(line) is None
+
+
+def test_build_pattern_unquoted_variables():
+    pattern = config_parser.build_pattern('$remote_addr:$remote_port $request_time $request')
+    record = pattern.match('10.0.0.1:4242 0.125 GET /index.html HTTP/1.1').groupdict()
+    assert record['remote_addr'] == '10.0.0.1'
+    assert record['remote_port'] == '4242'
+    assert record['request_time'] == '0.125'
+    assert record['request'] == 'GET /index.html HTTP/1.1'
+
+
+def test_detect_log_config_finds_every_access_log(tmpdir):
+    config = tmpdir.join('nginx.conf')
+    config.write('''
+        http {
+            log_format  hls  '$remote_addr [$time_local] "$request"';
+            access_log /var/log/nginx/access.log;
+            server {
+                access_log /var/log/nginx/hls.access.log hls;
+                access_log /var/log/nginx/access.log;
+            }
+        }
+    ''')
+    logs = config_parser.detect_log_config({'--config': str(config)})
+    assert logs == [('/var/log/nginx/access.log', config_parser.LOG_FORMAT_COMBINED),
+                    ('/var/log/nginx/hls.access.log', '$remote_addr [$time_local] "$request"')]
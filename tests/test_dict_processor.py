@@ -0,0 +1,137 @@
+from ngxtop.dict_processor import DictProcessor, sparkline
+from ngxtop.window import RateRing
+
+from helpers import FakeClock
+
+
+def record(remote_addr, stream='801', size=100):
+    return {'request': 'GET /live/%s.m3u8 HTTP/1.1' % stream, 'remote_addr': remote_addr,
+            'bytes_sent': size, 'body_bytes_sent': size}
+
+
+def test_window_drops_clients_that_left():
+    clock = FakeClock(1000)
+    processor = DictProcessor(window=60, clock=clock)
+    processor.process([record('10.0.0.1'), record('10.0.0.2'), record('10.0.0.3', stream='802')])
+    clock.now = 1030
+    processor.process([record('10.0.0.1')])
+
+    clock.now = 1065
+    processor.roll(clock.now)
+    assert list(processor.streams) == ['801']
+    assert list(processor.streams['801'].clients) == ['10.0.0.1']
+    # since start totals are kept for streams still alive
+    assert processor.streams['801'].out_bytes == 300
+
+    clock.now = 1095
+    processor.roll(clock.now)
+    assert processor.streams == {}
+
+
+def test_report_times_in_seconds():
+    clock = FakeClock(1463395100)
+    processor = DictProcessor(clock=clock)
+    processor.process([dict(record('10.0.0.1', size=2048), time_local='16/May/2016:10:38:08 +0000')])
+    # rtmp clients give the milliseconds they have been connected for
+    processor.process([{'request': '802', 'remote_addr': '10.0.0.2', 'time': 30000, 'out_bw': 4096}])
+    assert processor.streams['802'].clients['10.0.0.2'].join_ts == 1463395070
+
+    clock.now += 8
+    report = processor.report()
+    assert 'Clients: 2 OutMBytes: 0 OutKBytes/s 4 Time 38s' in report
+    assert 'Stream: 801 OutMBytes: 0 OutKBytes/s 0 Time 20s' in report
+    assert 'Client: 10.0.0.2 Info:  Time 38s' in report
+
+
+def test_report_lists_top_streams_and_clients():
+    clock = FakeClock(1000)
+    processor = DictProcessor(clock=clock, limit=2, order_by='bytes')
+    processor.process([record('10.0.0.%d' % idx, stream='80%d' % (idx % 3), size=100 * idx) for idx in range(1, 10)])
+    report = processor.report()
+    detail = report.split('Detail:\n')[1].splitlines()
+    # all the traffic is in the interval in progress, which rates don't count yet
+    stream_rates = ' NowKBytes/s 0 AvgKBytes/s 0 Req/s 0.0 |%s#|' % (' ' * 29)
+    client_rates = ' NowKBytes/s 0 |%s#|' % (' ' * 9)
+    # 800 sent 3+6+9 hundred bytes, 802 2+5+8 and 801 1+4+7
+    assert detail == [
+        '\tStream: 800 OutMBytes: 0 OutKBytes/s 1 Time 0s' + stream_rates,
+        '\t\tClient: 10.0.0.9%s Info:  Time 0s' % client_rates,
+        '\t\tClient: 10.0.0.6%s Info:  Time 0s' % client_rates,
+        '\t\t... 1 more clients',
+        '\tStream: 802 OutMBytes: 0 OutKBytes/s 1 Time 0s' + stream_rates,
+        '\t\tClient: 10.0.0.8%s Info:  Time 0s' % client_rates,
+        '\t\tClient: 10.0.0.5%s Info:  Time 0s' % client_rates,
+        '\t\t... 1 more clients',
+        '\t... 1 more streams',
+    ]
+    assert len(processor.report(max_lines=6).splitlines()) == 6
+
+
+def test_stream_patterns():
+    patterns = ['/live/$stream.m3u8', '/live/$stream-$frag.ts', '/hls/$app/$stream/index.m3u8']
+    processor = DictProcessor(stream_patterns=patterns)
+    assert processor.get_stream('GET /live/801.m3u8?token=1 HTTP/2.0') == '801'
+    # the stream name runs up to the last separator, like a greedy regular expression
+    assert processor.get_stream('HEAD /live/801-hd-1234.ts HTTP/1.1') == '801-hd'
+    assert processor.get_stream('GET /hls/app/802/index.m3u8 HTTP/1.1') == '802'
+    assert processor.get_stream('GET /live/801.mp4 HTTP/1.1') == 'GET /live/801.mp4 HTTP/1.1'
+    # rtmp records name their stream directly
+    assert processor.get_stream('803') == '803'
+    assert processor.get_stream('GET /live/801-hd-1234.ts HTTP/1.1') == '801-hd'
+
+
+def test_stream_latency_percentiles():
+    processor = DictProcessor(clock=FakeClock(1000), latency=True)
+    assert 'request_time' in processor.fields
+    processor.process([dict(record('10.0.0.%d' % (idx % 5)), request_time=idx / 100.0) for idx in range(1, 101)])
+    other = DictProcessor(clock=FakeClock(1000), latency=True)
+    other.process([dict(record('10.0.0.1', stream='802'), request_time=0.0)])
+    processor.merge(other)
+    report = processor.report()
+    # estimates of 0.5, 0.95 and 0.99 within 1%
+    assert '| Latency p50 0.502s p95 0.951s p99 0.990s\n' in report
+    assert '| Latency p50 0.000s p95 0.000s p99 0.000s\n' in report
+    # logs without request_time
+    assert 'request_time' not in DictProcessor().fields
+
+
+def test_stream_rates_and_sparklines():
+    clock = FakeClock(1463395100)
+    processor = DictProcessor(clock=clock)
+    # 2s intervals from 10:38:00, a burst of 3 requests, a stall, then 2 requests
+    records = [dict(record('10.0.0.1', size=4096), time_local='16/May/2016:10:38:%02d +0000' % second)
+               for second in (0, 0, 1, 4, 5)]
+    processor.process(records)
+    rates = processor.streams['801'].rates
+    assert rates.series(1463395086, requests=True)[-4:] == [3, 0, 2, 0]
+    # in the interval following the last requests
+    clock.now = 1463395087
+    line = processor.report().split('Detail:\n')[1].splitlines()[0]
+    # 8KiB in the last complete interval, 20KiB over the 58s of complete intervals of the ring
+    expected = ' NowKBytes/s 4 AvgKBytes/s 0 Req/s 1.0 |%s# + |' % (' ' * 26)
+    assert line.endswith(expected)
+
+    # the ring of a log ending before it covers is shown as of the end of the log
+    clock.now += 3600
+    assert expected + '\n' in processor.report()
+
+    other = DictProcessor(clock=clock)
+    other.process([dict(record('10.0.0.2', size=4096), time_local='16/May/2016:10:38:01 +0000')])
+    processor.merge(other)
+    assert rates.series(1463395086, requests=True)[-4:] == [4, 0, 2, 0]
+
+
+def test_rate_ring_wraps_around():
+    ring = RateRing(slots=4)
+    for index in (10, 10, 11, 13):
+        ring.add(index, 100)
+    # series are read at a time, of interval 13 and 17
+    assert ring.series(26) == [200, 100, 0, 100]
+    assert ring.series(26, requests=True) == [2, 1, 0, 1]
+    assert ring.series(34) == [0, 0, 0, 0]
+    # too old for the ring
+    ring.add(9, 100)
+    ring.add(15, 50)
+    assert ring.series(30) == [0, 100, 0, 50]
+    assert ring.rate(30) == 0 and ring.rate(32) == 25
+    assert sparkline(ring.series(30)) == ' # ='
@@ -0,0 +1,54 @@
+import pytest
+
+from ngxtop.filters import compile_filter, compile_pre_filter, expression_names, line_hints
+from ngxtop.httptop import NginxHttpInfo
+from ngxtop.sources import MmapSource
+
+LINES = [
+    '10.0.0.1 - - [16/May/2016:10:38:08 +0000] "GET /live/801.m3u8 HTTP/1.1" 200 100 "-" "agent"\n',
+    '10.0.0.2 - - [16/May/2016:10:38:08 +0000] "GET /live/801-1.ts?k=404 HTTP/1.1" 200 4040 "-" "agent"\n',
+    '10.0.0.3 - - [16/May/2016:10:38:09 +0000] "GET /vod/802-1.ts HTTP/1.1" 404 0 "-" "agent"\n',
+    '10.0.0.4 - - [16/May/2016:10:38:09 +0000] "GET /live/802-1.ts HTTP/1.1" 500 - "-" "agent"\n',
+]
+
+
+def test_compile_filter():
+    record = {'status': 404, 'request_path': '/live/801.m3u8', 'bytes_sent': 0}
+    assert expression_names('status >= 400 and len(request_path) > 3') == ['request_path', 'status']
+    assert compile_filter('status >= 400')(record)
+    assert not compile_filter('status >= 400 and request_path.startswith("/vod")')(record)
+    assert compile_filter('bytes_sent == 0 or status == 200')(record)
+    assert compile_filter('True')(record)
+    assert compile_pre_filter("'/live/' in line")(LINES[0])
+    with pytest.raises(KeyError):
+        compile_filter('unknown == 1')(record)
+
+
+@pytest.mark.parametrize('expression, hints', [
+    ('status == 404', ['404']),
+    ('404 == status and request_path.startswith("/live/")', ['404', '/live/']),
+    ("'.ts' in request and remote_addr == '10.0.0.2'", ['.ts', '10.0.0.2']),
+    ('status >= 400', []),
+    ('status == 404 or status == 500', []),
+    ('status_type == 4 and bytes_sent == 100', []),
+    ('status == 0', []),
+    ('request_path.endswith(".ts") and not http_referer == "-"', ['.ts']),
+])
+def test_line_hints(expression, hints):
+    assert line_hints(expression) == hints
+
+
+@pytest.mark.parametrize('expression', [
+    'status == 404', 'status >= 400', 'request_path.startswith("/live/") and status == 200',
+    'bytes_sent == 0 and status == 404', "'801' in request_path",
+])
+def test_hints_keep_matching_lines(tmpdir, expression):
+    path = tmpdir.join('access.log')
+    path.write(''.join(LINES))
+    arguments = {'--log-format': 'combined', '--pre-filter': None, '--filter': expression}
+    http_info = NginxHttpInfo(arguments)
+
+    expected = [line for line in LINES if compile_filter(expression)(next(http_info.parse_log([line]), None))]
+    for source in (LINES, MmapSource(str(path))):
+        records = list(http_info.build_records(source))
+        assert [r['remote_addr'] for r in records] == [line.split()[0] for line in expected]
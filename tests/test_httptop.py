@@ -0,0 +1,73 @@
+import pytest
+
+from ngxtop import httptop
+from ngxtop.config_parser import build_pattern
+from ngxtop.httptop import NginxHttpInfo, LogRecord
+from ngxtop.sql_processor import SQLProcessor
+
+LINE = '10.0.0.1 - - [16/May/2016:10:38:08 +0000] "GET /live/801.m3u8?k=1 HTTP/1.1" 404 147 "-" "agent"'
+
+
+def test_build_pattern_captures_given_fields():
+    pattern = build_pattern('combined', set(['status', 'remote_addr']))
+    assert pattern.match(LINE).groupdict() == {'remote_addr': '10.0.0.1', 'status': '404'}
+
+
+def test_parse_log_projection():
+    http_info = NginxHttpInfo({'--log-format': 'combined', '--filter': 'status_type == 4'})
+    http_info.set_processor(SQLProcessor([], ['remote_addr', 'bytes_sent']))
+    record, = http_info.parse_log([LINE])
+    # captured for the processor and the filter, with what they are derived from
+    assert record == {'remote_addr': '10.0.0.1', 'status': 404, 'status_type': 4, 'body_bytes_sent': '147',
+                      'bytes_sent': 147}
+
+
+def test_log_record_derives_fields_on_access():
+    http_info = NginxHttpInfo({'--log-format': 'combined', '--filter': None})
+    record, = http_info.parse_log([LINE])
+    assert isinstance(record, LogRecord)
+    assert record['status'] == 404
+    assert not dict.__contains__(record, 'request_path')
+    assert 'request_path' in record
+    assert record.get('request_path') == '/live/801.m3u8'
+    assert dict.__contains__(record, 'request_path')
+    assert (record['status_type'], record['bytes_sent'], record['request_time']) == (4, 147, 0.0)
+    assert record.get('unknown', 'default') == 'default'
+
+
+@pytest.mark.parametrize('workers', ['1', '2'])
+def test_parse_info_uses_format_of_the_access_log(tmpdir, workers):
+    # e.g. the single access log found in the nginx config, with its own log_format
+    path = tmpdir.join('hls.access.log')
+    path.write(''.join('10.0.0.%d "GET /live/801.m3u8 HTTP/1.1" 200\n' % idx for idx in range(5)))
+    http_info = NginxHttpInfo({'--log-format': 'combined', '--filter': None, '--pre-filter': None,
+                               '--no-follow': True, '--workers': workers})
+    http_info.access_logs = [(str(path), '$remote_addr "$request" $status')]
+    http_info.access_log = str(path)
+    processor = SQLProcessor([('count', 'select count(1) from log')], ['remote_addr'])
+    http_info.set_processor(processor)
+    http_info.parse_info()
+    assert processor.count() == 5
+
+
+def test_follow_logs_compiles_filters_once_per_log(tmpdir, monkeypatch):
+    paths = [str(tmpdir.join('%d.access.log' % idx)) for idx in range(2)]
+    batches = [(0, [LINE]), (1, [LINE.replace('404', '200')]), (0, [LINE, LINE])]
+    compiled = []
+
+    class Batches(object):
+        # batches of lines read from the logs, by index of the log
+        def __init__(self, tailers):
+            self.tailers = tailers
+
+        def batches(self):
+            return batches
+
+    monkeypatch.setattr(httptop, 'Tailer', lambda path: path)
+    monkeypatch.setattr(httptop, 'MultiTailer', Batches)
+    monkeypatch.setattr(httptop, 'compile_filter', lambda exp: compiled.append(exp) or (lambda r: r['status'] == 404))
+    http_info = NginxHttpInfo({'--log-format': 'combined', '--filter': 'status == 404', '--pre-filter': None})
+    http_info.access_logs = [(path, 'combined') for path in paths]
+    http_info.set_processor(SQLProcessor([], ['remote_addr']))
+    assert len(list(http_info.follow_logs())) == 3
+    assert compiled == ['status == 404'] * 2
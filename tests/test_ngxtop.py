@@ -0,0 +1,92 @@
+import curses
+import shlex
+
+import pytest
+from docopt import docopt
+
+from ngxtop import ngxtop
+
+LINE = '10.0.0.%d - - [16/May/2016:10:38:%02d +0000] "GET /live/801-%d.ts HTTP/1.1" 200 %d "-" "agent"\n'
+
+
+def write_log(tmpdir, count):
+    path = tmpdir.join('access.log')
+    path.write(''.join(LINE % (idx % 3, idx % 60, idx % 2, idx) for idx in range(count)))
+    return str(path)
+
+
+def run(monkeypatch, capsys, argv):
+    """
+    Run ngxtop with the given command line arguments, without a terminal
+    :return: standard output
+    """
+    monkeypatch.setattr(curses, 'initscr', lambda: None)
+    monkeypatch.setattr(curses, 'endwin', lambda: None)
+    ngxtop.NginxTop(docopt(ngxtop.__doc__, argv=argv)).run()
+    return capsys.readouterr().out
+
+
+def table_rows(output):
+    """
+    :return: cells of the rows of the last table printed
+    """
+    rows = []
+    for line in output.strip().split('\n')[::-1]:
+        if not line.startswith('|') or line.startswith('|-'):
+            break
+        rows.insert(0, [cell.strip() for cell in line.strip('|').split('|')])
+    return rows
+
+
+def test_query_command(tmpdir, monkeypatch, capsys):
+    path = write_log(tmpdir, 10)
+    output = run(monkeypatch, capsys, ['--no-follow', '-l', path, 'query',
+                                       'select status_type, count(1) as hits, sum(bytes_sent) as total from log'])
+    assert table_rows(output) == [['2', '10', '45']]
+
+
+def test_window_with_workers(tmpdir, monkeypatch, capsys):
+    path = write_log(tmpdir, 100)
+    output = run(monkeypatch, capsys, ['--no-follow', '-j', '2', '--window', '60', '-l', path, 'top', 'request_path'])
+    # equal counts, in the order partial results of workers were merged
+    assert sorted(table_rows(output)) == [['/live/801-0.ts', '50'], ['/live/801-1.ts', '50']]
+
+
+def test_window_with_state(tmpdir, monkeypatch, capsys):
+    path = write_log(tmpdir, 10)
+    argv = ['--no-follow', '--window', '60', '--state', str(tmpdir.join('state')), '-l', path, 'top', 'request_path']
+    run(monkeypatch, capsys, argv)
+    with open(path, 'a') as f:
+        f.write(LINE % (0, 0, 0, 0))
+    output = run(monkeypatch, capsys, argv)
+    assert table_rows(output) == [['/live/801-0.ts', '6'], ['/live/801-1.ts', '5']]
+
+
+def test_examples_build_their_processor(tmpdir, monkeypatch):
+    path = write_log(tmpdir, 1)
+    monkeypatch.setattr(curses, 'initscr', lambda: None)
+    monkeypatch.setattr(curses, 'endwin', lambda: None)
+    examples = [line.strip()[len('$ ngxtop'):] for line in ngxtop.__doc__.split('Examples:')[1].split('\n')
+                if line.strip().startswith('$ ngxtop')]
+    assert len(examples) >= 5
+    for example in examples:
+        argv = shlex.split(example)
+        if 'percentile' in argv:
+            # needs a log format with the variable
+            argv += ['-f', '$remote_addr [$time_local] "$request" $status $body_bytes_sent $request_time']
+        if '-l' not in argv:
+            ngxtop.NginxTop(docopt(ngxtop.__doc__, argv=argv + ['-l', path])).build_processor()
+
+
+def test_percentile_of_unconverted_field(tmpdir, monkeypatch, capsys):
+    path = write_log(tmpdir, 10)
+    output = run(monkeypatch, capsys, ['--no-follow', '-l', path, 'percentile', 'body_bytes_sent', '-g', 'status',
+                                       '-o', 'p50(body_bytes_sent)'])
+    assert [row[:2] for row in table_rows(output)] == [['200', '10']]
+
+
+def test_percentile_of_variable_not_in_log_format(tmpdir, monkeypatch, capsys):
+    path = write_log(tmpdir, 10)
+    with pytest.raises(SystemExit):
+        run(monkeypatch, capsys, ['--no-follow', '-l', path, 'percentile', 'request_time'])
+    assert 'request_time which is not in the log format' in capsys.readouterr().err
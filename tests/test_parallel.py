@@ -0,0 +1,54 @@
+from ngxtop import parallel
+from ngxtop.dict_processor import DictProcessor
+from ngxtop.httptop import NginxHttpInfo
+from ngxtop.sources import MmapSource
+from ngxtop.sql_processor import SQLProcessor
+
+LINE = '10.0.0.%d - - [16/May/2016:10:38:08 +0000] "GET /live/801-%d.m3u8 HTTP/1.1" 200 %d "-" "agent"\n'
+
+
+def write_log(tmpdir, count):
+    path = tmpdir.join('access.log')
+    path.write(''.join(LINE % (idx % 7, idx % 3, idx) for idx in range(count)))
+    return str(path)
+
+
+def build_http_info(path, processor):
+    arguments = {'--access-log': path, '--log-format': 'combined', '--no-follow': True, '--workers': '3',
+                 '--pre-filter': None, '--filter': None}
+    http_info = NginxHttpInfo(arguments)
+    http_info.access_log = path
+    http_info.set_processor(processor)
+    return http_info
+
+
+def test_split_file_aligned_to_lines(tmpdir):
+    path = write_log(tmpdir, 100)
+    ranges = parallel.split_file(path, 7)
+    assert ranges[0][0] == 0
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end == start
+    lines = [line + '\n' for start, end in ranges for line in MmapSource(path, start, end)]
+    with open(path) as f:
+        assert lines == f.readlines()
+
+
+def test_parallel_process_dict_processor(tmpdir):
+    path = write_log(tmpdir, 300)
+    http_info = build_http_info(path, DictProcessor())
+    parallel.parallel_process(http_info, 3)
+
+    streams = http_info.processor.streams
+    assert sorted(streams) == ['801-0', '801-1', '801-2']
+    assert sum(stream.out_bytes for stream in streams.values()) == sum(range(300))
+    assert all(len(stream.clients) == 7 for stream in streams.values())
+
+
+def test_parallel_process_sql_processor(tmpdir):
+    path = write_log(tmpdir, 300)
+    processor = SQLProcessor([('count', 'select count(1) from log')], ['remote_addr', 'bytes_sent'])
+    http_info = build_http_info(path, processor)
+    parallel.parallel_process(http_info, 3)
+
+    assert processor.count() == 300
+    assert sum(row[1] for row in processor.rows()) == sum(range(300))
@@ -0,0 +1,60 @@
+import time
+import threading
+
+import pytest
+
+from ngxtop.reporter import BATCH_RECORDS, PeriodicThread, SynchronizedProcessor
+from ngxtop.sql_processor import SQLProcessor
+
+
+def test_synchronized_processor_reports_while_source_blocks():
+    processor = SynchronizedProcessor(SQLProcessor([('count', 'select count(1) from log')], ['remote_addr']))
+    more = threading.Event()
+
+    def records():
+        yield {'remote_addr': '10.0.0.1'}
+        more.wait(5)
+
+    ingest = threading.Thread(target=processor.process, args=(records(),))
+    ingest.start()
+    try:
+        time.sleep(0.05)
+        # the source is blocked waiting for lines, reporting must not be
+        assert 'count(1)' in processor.report()
+        assert processor.count() == 1
+    finally:
+        more.set()
+        ingest.join()
+
+
+def test_synchronized_processor_processes_batches():
+    batches = []
+
+    class Recorder(object):
+        def process(self, records):
+            batches.append(len(records))
+
+    SynchronizedProcessor(Recorder()).process({'remote_addr': '10.0.0.1'} for _ in range(2 * BATCH_RECORDS + 1))
+    assert batches == [BATCH_RECORDS, BATCH_RECORDS, 1]
+
+
+def test_periodic_thread_runs_on_schedule():
+    calls = []
+    reporter = PeriodicThread('test', 0.01, lambda: calls.append(time.time()), delay=0)
+    reporter.start()
+    time.sleep(0.1)
+    reporter.stop()
+    reporter.join()
+    assert len(calls) >= 3
+
+
+def test_periodic_thread_exit_interrupts_main_thread():
+    def done():
+        raise SystemExit(3)
+
+    reporter = PeriodicThread('test', 1, done, delay=0)
+    with pytest.raises(KeyboardInterrupt):
+        reporter.start()
+        for _ in range(100):
+            time.sleep(0.05)
+    assert reporter.exit_status == 3
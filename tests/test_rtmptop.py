@@ -0,0 +1,254 @@
+import io
+import threading
+
+import pytest
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+
+from ngxtop import rtmptop
+from ngxtop.dict_processor import DictProcessor
+from ngxtop.reporter import SynchronizedProcessor
+from ngxtop.rtmptop import NginxRtmpInfo, StatServer
+
+from helpers import FakeClock
+
+STAT = b'''<?xml version="1.0" encoding="utf-8" ?>
+<rtmp>
+<nginx_version>1.9.15</nginx_version><nginx_rtmp_version>1.1.4</nginx_rtmp_version>
+<compiler>gcc</compiler><built>May 16 2016</built><pid>42</pid><uptime>3600</uptime><naccepted>7</naccepted>
+<bw_in>100</bw_in><bytes_in>1000</bytes_in><bw_out>200</bw_out><bytes_out>2000</bytes_out>
+<server><application><name>live</name><live>
+<stream>
+<name>801</name>
+<client><id>1</id><address>192.168.1.2</address><time>99000</time><flashver>FMLE/3.0</flashver><publishing/></client>
+<client><id>2</id><address>10.0.0.1</address><time>5000</time><flashver>LNX 9,0,124,2</flashver>
+<pageurl>http://example.com/</pageurl><swfurl>http://example.com/player.swf</swfurl></client>
+<time>100000</time><bw_in>100</bw_in><bytes_in>1000</bytes_in><bw_out>200</bw_out><bytes_out>2000</bytes_out>
+<meta><audio><codec>AAC</codec><profile>LC</profile><channels>2</channels><sample_rate>44100</sample_rate></audio></meta>
+<nclients>2</nclients><publishing/><active/>
+</stream>
+<stream><name>802</name><time>300</time><nclients>0</nclients></stream>
+<nclients>2</nclients>
+</live></application>
+<application><name>vod</name><live>
+<stream><name>801</name><time>50</time>
+<client><id>3</id><address>10.0.0.2</address><time>40</time><flashver>LNX 9,0,124,2</flashver></client>
+<nclients>1</nclients></stream>
+</live></application></server>
+</rtmp>
+'''
+
+
+class StatHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.connections.add(self.client_address)
+        status, body = self.server.responses.get(self.path, (404, b'not found'))
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StatStub(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, responses):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StatHandler)
+        self.responses = responses
+        self.connections = set()
+
+    def url(self, path):
+        return 'http://127.0.0.1:%d%s' % (self.server_address[1], path)
+
+
+@pytest.fixture
+def stub():
+    server = StatStub({'/stat': (200, STAT), '/broken': (500, b'oops')})
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def arguments(urls, url_file=None):
+    return {'--rtmp-stat-url': urls, '--rtmp-stat-file': url_file, '--rtmp-stat-timeout': '2.0'}
+
+
+class Recorder(object):
+    def __init__(self):
+        self.records = []
+        self.departed = []
+
+    def process(self, records):
+        self.records.extend(dict(record) for record in records)
+
+    def discard(self, records):
+        self.departed.extend(records)
+
+
+def test_parse_stat():
+    info = StatServer('http://127.0.0.1/stat')
+    stream_infos = info.parse_stat(io.BytesIO(STAT))
+    assert (info.nginx_version, info.pid, info.uptime, info.accepted) == ('1.9.15', 42, 3600, 7)
+    assert (info.bytes_in, info.bytes_out) == (1000, 2000)
+    # every application is parsed
+    assert sorted(stream_infos) == [('live', '801'), ('live', '802'), ('vod', '801')]
+    assert stream_infos[('vod', '801')].time == 50
+
+    stream = stream_infos[('live', '801')]
+    # clients come before the stream's own time, it must not be taken from them
+    assert stream.time == 100000
+    assert stream.nclients == 2
+    assert sorted(stream.clients) == [1, 2]
+    publisher, player = stream.clients[1], stream.clients[2]
+    assert publisher.is_publisher and publisher.pageurl is None
+    assert not player.is_publisher
+    assert (player.address, player.time, player.pageurl) == ('10.0.0.1', 5000, 'http://example.com/')
+    # audio only streams have no video meta
+    assert stream.meta_info.audio_channels == 2 and stream.meta_info.video_codec is None
+
+    idle = stream_infos[('live', '802')]
+    assert (idle.time, idle.clients, idle.meta_info) == (300, {}, None)
+
+
+def test_poll_servers_over_kept_alive_connections(stub, tmpdir):
+    url_file = tmpdir.join('urls')
+    url_file.write('# edges\n%s\n\n' % stub.url('/stat'))
+    info = NginxRtmpInfo(arguments(stub.url('/stat'), str(url_file)))
+    recorder = Recorder()
+    info.set_processor(recorder)
+    assert len(info.get_servers()) == 2
+
+    info.parse_info()
+    info.parse_info()
+    # 2 polls of 2 servers, over a single connection per server
+    assert len(stub.connections) == 2
+    # nothing changed on the second poll
+    assert len(recorder.records) == 2 * 3
+    assert set(record['remote_addr'] for record in recorder.records) == {'192.168.1.2', '10.0.0.1', '10.0.0.2'}
+    assert '\t\tStream Idel' in info.print_info()
+
+
+def test_snapshot_is_applied_with_its_changes(stub):
+    info = NginxRtmpInfo(arguments(stub.url('/stat')))
+    server, = info.get_servers()
+    observed = []
+
+    class Observer(Recorder):
+        def process(self, records):
+            # a checkpoint would wait for the lock, the snapshot becomes current together with its changes
+            thread = threading.Thread(target=lambda: observed.append(processor.lock.acquire(False)))
+            thread.start()
+            thread.join()
+            observed.append(server.stream_infos)
+            Recorder.process(self, records)
+
+    processor = SynchronizedProcessor(Observer())
+    info.set_processor(processor)
+    info.parse_info()
+    assert set(observed) == {False, None}
+    assert sorted(server.stream_infos) == [('live', '801'), ('live', '802'), ('vod', '801')]
+
+
+def test_failing_server_backs_off(stub):
+    clock = FakeClock(1000.0)
+    info = NginxRtmpInfo(arguments('%s,http://127.0.0.1:1/stat' % stub.url('/broken')), clock=clock)
+    broken, refused = info.get_servers()
+    info.parse_info()
+    assert (broken.failures, broken.retry_at) == (1, 1000 + rtmptop.BACKOFF_MIN)
+    assert (refused.failures, refused.retry_at) == (1, 1000 + rtmptop.BACKOFF_MIN)
+
+    # not polled before the retry time
+    info.parse_info()
+    assert broken.failures == 1
+    clock.now = 1001.0
+    info.parse_info()
+    assert (broken.failures, broken.retry_at) == (2, 1001 + 2 * rtmptop.BACKOFF_MIN)
+    assert 'not available' in info.print_info()[1]
+
+
+def snapshot(document):
+    return StatServer('http://127.0.0.1/stat').parse_stat(io.BytesIO(document))
+
+
+def test_diff_streams():
+    previous = snapshot(STAT)
+    # time of clients grows between polls, the player left, a new one joined and the stream sent 500 more bytes
+    document = STAT.replace(b'<time>99000</time>', b'<time>101000</time>')
+    document = document.replace(b'<id>2</id><address>10.0.0.1</address>', b'<id>4</id><address>10.0.0.9</address>')
+    document = document.replace(b'2000</bytes_out>\n<meta>', b'2500</bytes_out>\n<meta>')
+    records, departed = rtmptop.diff_streams(previous, snapshot(document), 'edge')
+
+    assert records == [{'request': 'edge/live/801', 'remote_addr': '10.0.0.9', 'time': 5000,
+                        'http_user_agent': 'LNX 9,0,124,2', 'in_bytes': 0, 'in_bw': 12.5, 'out_bytes': 500,
+                        'out_bw': 25.0}]
+    assert departed == [{'request': 'edge/live/801', 'remote_addr': '10.0.0.1'}]
+
+    # the vod application is gone, its clients with it
+    document = document.split(b'<application><name>vod</name>')[0] + b'</server></rtmp>'
+    records, departed = rtmptop.diff_streams(snapshot(STAT), snapshot(document), 'edge')
+    assert {'request': 'edge/vod/801', 'remote_addr': '10.0.0.2'} in departed
+
+
+def test_diff_keeps_dict_processor_totals():
+    processor = DictProcessor()
+    info = NginxRtmpInfo(arguments(None))
+    info.set_processor(processor)
+    info.processor_process({}, snapshot(STAT), 'edge')
+    info.processor_process(snapshot(STAT), snapshot(STAT), 'edge')
+    # counters added once
+    assert processor.streams['edge/live/801'].out_bytes == 2000
+    assert sorted(processor.streams['edge/live/801'].clients) == ['10.0.0.1', '192.168.1.2']
+    assert sorted(processor.streams['edge/vod/801'].clients) == ['10.0.0.2']
+
+    info.processor_process(snapshot(STAT), {}, 'edge')
+    assert processor.streams == {}
+
+
+def test_same_stream_name_on_two_servers():
+    processor = DictProcessor()
+    info = NginxRtmpInfo(arguments(None))
+    info.set_processor(processor)
+    info.processor_process({}, snapshot(STAT), 'edge1')
+    info.processor_process({}, snapshot(STAT.replace(b'<time>100000</time><bw_in>100</bw_in>',
+                                                     b'<time>100000</time><bw_in>400</bw_in>')), 'edge2')
+    first, second = processor.streams['edge1/live/801'], processor.streams['edge2/live/801']
+    assert (first.in_bw, second.in_bw) == (12.5, 50.0)
+
+    # the player leaves the second server only
+    document = STAT.replace(b'<id>2</id><address>10.0.0.1</address>', b'<id>4</id><address>10.0.0.9</address>')
+    info.processor_process(snapshot(STAT), snapshot(document), 'edge2')
+    assert '10.0.0.1' in first.clients
+    assert '10.0.0.1' not in second.clients
+
+
+def test_first_poll_is_a_baseline():
+    processor = DictProcessor()
+    info = NginxRtmpInfo(arguments(None))
+    info.set_processor(processor)
+    first = snapshot(STAT)
+    info.processor_process(None, first, 'edge')
+    # lifetime counters of the first poll aren't traffic of the run
+    assert processor.streams['edge/live/801'].out_bytes == 0
+    assert sorted(processor.streams['edge/live/801'].clients) == ['10.0.0.1', '192.168.1.2']
+
+    # the stream without clients is now pushed to, its bytes count all the same
+    document = STAT.replace(b'<stream><name>802</name><time>300</time>',
+                            b'<stream><name>802</name><time>300</time><bytes_in>700</bytes_in>')
+    document = document.replace(b'2000</bytes_out>\n<meta>', b'2500</bytes_out>\n<meta>')
+    info.processor_process(first, snapshot(document), 'edge')
+    assert processor.streams['edge/live/801'].out_bytes == 500
+    assert processor.streams['edge/live/802'].in_bytes == 700
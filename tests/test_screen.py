@@ -0,0 +1,103 @@
+import curses
+
+import pytest
+
+from ngxtop.screen import ScreenRenderer
+
+
+class FakeWindow(object):
+    def __init__(self, height, width):
+        self.height, self.width = height, width
+        self.rows = [''] * height
+        self.written = []
+        self.keys = []
+        self.y = 0
+
+    def getmaxyx(self):
+        return self.height, self.width
+
+    def nodelay(self, flag):
+        pass
+
+    def keypad(self, flag):
+        pass
+
+    def clear(self):
+        self.rows = [''] * self.height
+
+    def move(self, y, x):
+        self.y = y
+
+    def clrtoeol(self):
+        self.rows[self.y] = ''
+
+    def addstr(self, y, x, text):
+        assert len(text) < self.width or y < self.height - 1
+        self.rows[y] = text
+        self.written.append(y)
+
+    def refresh(self):
+        pass
+
+    def getch(self):
+        return self.keys.pop(0) if self.keys else -1
+
+
+class Report(object):
+    def __init__(self, lines):
+        self.lines = lines
+        self.max_lines = []
+
+    def __call__(self, max_lines):
+        self.max_lines.append(max_lines)
+        return '\n'.join(self.lines[:max_lines])
+
+
+def test_draw_only_writes_changed_rows():
+    window = FakeWindow(5, 20)
+    report = Report(['line %d' % idx for idx in range(3)])
+    screen = ScreenRenderer(window, report)
+    screen.draw()
+    assert window.rows[:3] == ['line 0', 'line 1', 'line 2']
+    assert window.rows[4].startswith('lines 1-3 |')
+    assert report.max_lines == [5]
+
+    window.written = []
+    report.lines[1] = 'changed'
+    screen.draw()
+    assert window.written == [1]
+    assert window.rows[:3] == ['line 0', 'changed', 'line 2']
+
+
+def test_keys_scroll_and_page():
+    window = FakeWindow(5, 80)
+    report = Report(['line %d' % idx for idx in range(20)])
+    screen = ScreenRenderer(window, report)
+    screen.draw()
+    assert 'lines 1-4 (more)' in window.rows[4]
+
+    window.keys = [ord('j'), ord('j'), ord(' ')]
+    screen.poll_keys()
+    assert screen.offset == 6
+    assert window.rows[:4] == ['line 6', 'line 7', 'line 8', 'line 9']
+    # only the lines up to the bottom of the screen are built
+    assert report.max_lines[-1] == 11
+
+    window.keys = [curses.KEY_PPAGE, curses.KEY_PPAGE]
+    screen.poll_keys()
+    assert screen.offset == 0
+
+    window.keys = [ord('q')]
+    with pytest.raises(SystemExit):
+        screen.poll_keys()
+
+
+def test_offset_follows_shrinking_report():
+    window = FakeWindow(3, 80)
+    report = Report(['line %d' % idx for idx in range(10)])
+    screen = ScreenRenderer(window, report)
+    screen.offset = 8
+    report.lines = report.lines[:4]
+    screen.draw()
+    assert screen.offset == 2
+    assert window.rows[:2] == ['line 2', 'line 3']
@@ -0,0 +1,105 @@
+import random
+
+from ngxtop.aggregator import ApproxTopAggregation
+from ngxtop.dict_processor import DictProcessor
+from ngxtop.sketch import HyperLogLog, LogHistogram, SpaceSaving, percentile_rank
+
+
+def zipf_items(count, seed=0):
+    rand = random.Random(seed)
+    return ['/live/%d.ts' % int(rand.paretovariate(1.2)) for _ in range(count)]
+
+
+def test_space_saving_keeps_heavy_hitters_within_bound():
+    items = zipf_items(20000)
+    sketch = SpaceSaving(50)
+    for item in items:
+        sketch.add(item)
+    exact = {}
+    for item in items:
+        exact[item] = exact.get(item, 0) + 1
+
+    bound = len(items) / 50.0
+    assert len(sketch) == 50
+    for item, count in exact.items():
+        if count > bound:
+            assert item in sketch
+    for item, count, error in sketch.top():
+        assert exact[item] <= count <= exact[item] + error
+        assert error <= bound
+    assert [item for item, _, _ in sketch.top(3)] == sorted(exact, key=exact.get, reverse=True)[:3]
+
+
+def test_space_saving_merge_and_discard():
+    left, right = SpaceSaving(10), SpaceSaving(10)
+    for idx in range(100):
+        left.add('a' if idx % 2 else 'x%d' % idx)
+        right.add('a' if idx % 3 else 'y%d' % idx)
+    left.merge(right)
+    assert len(left) == 10
+    assert left.top(1)[0][0] == 'a'
+    assert left.total == 200
+
+    left.discard('a')
+    assert 'a' not in left
+    # the discarded counter doesn't come back when making room
+    for idx in range(20):
+        left.add('z%d' % idx)
+    assert len(left) == 10
+
+
+def test_hyperloglog_estimates_distinct_count():
+    left, right = HyperLogLog(), HyperLogLog()
+    for idx in range(20000):
+        left.add('10.0.%d.%d' % (idx // 256, idx % 256))
+        right.add('10.1.%d.%d' % (idx // 256, idx % 256))
+    assert abs(left.count() - 20000) < 20000 * 0.05
+    left.merge(right)
+    assert abs(left.count() - 40000) < 40000 * 0.05
+
+    small = HyperLogLog()
+    for idx in range(100):
+        small.add(idx)
+        small.add(idx)
+    assert small.count() == 100
+
+
+def test_log_histogram_estimates_quantiles_within_accuracy():
+    rand = random.Random(0)
+    values = [rand.lognormvariate(-3, 1.5) for _ in range(20000)] + [0.0] * 500
+    left, right = LogHistogram(), LogHistogram()
+    for idx, value in enumerate(values):
+        (left if idx % 2 else right).add(value)
+    left.merge(right)
+    assert len(left) == len(values)
+
+    values.sort()
+    for q in (0, 0.01, 0.5, 0.95, 0.99, 0.999, 1):
+        exact = values[percentile_rank(q, len(values)) - 1]
+        assert abs(left.quantile(q) - exact) <= exact * 0.01
+    assert LogHistogram().quantile(0.5) is None
+
+
+def test_approx_top_aggregation():
+    query = ApproxTopAggregation('top', ['request_path'], limit=2, capacity=20)
+    for item in zipf_items(5000):
+        query.update({'request_path': item})
+    rows = query.rows()
+    assert query.headers() == ['request_path', 'count', 'max_error']
+    assert [row[0] for row in rows] == ['/live/1.ts', '/live/2.ts']
+
+
+def test_dict_processor_tracks_most_active_clients():
+    processor = DictProcessor(approx=True)
+    processor.capacity = 20
+    records = [{'request': 'GET /live/801.m3u8 HTTP/1.1', 'remote_addr': '10.0.0.%d' % (idx % 200),
+                'bytes_sent': 10} for idx in range(1000)]
+    # 10.0.0.1 is the most active client
+    records += [{'request': 'GET /live/801.m3u8 HTTP/1.1', 'remote_addr': '10.0.0.1', 'bytes_sent': 10}] * 100
+    processor.process(records)
+    stream = processor.streams['801']
+    assert len(stream.clients) == 20
+    assert '10.0.0.1' in stream.clients
+    # estimated, standard error 1.6%
+    assert abs(stream.client_count() - 200) <= 6
+    assert 'Clients: %d ' % stream.client_count() in processor.report()
@@ -0,0 +1,87 @@
+import gzip
+
+from ngxtop.config_parser import build_binary_pattern
+from ngxtop.httptop import NginxHttpInfo
+from ngxtop.sources import GzipSource, MmapSource
+from ngxtop.sql_processor import SQLProcessor
+
+LINES = [
+    '10.0.0.1 - - [16/May/2016:10:38:08 +0000] "GET /live/801.m3u8 HTTP/1.1" 200 147 "-" "agent"',
+    'garbage',
+    '10.0.0.2 - - [16/May/2016:10:38:09 +0000] "GET /live/801-1.ts HTTP/1.1" 206 1024 "-" "agent"',
+]
+
+
+def test_mmap_source_lines(tmpdir):
+    path = tmpdir.join('access.log')
+    # last line without trailing newline is still read
+    path.write('\n'.join(LINES))
+    source = MmapSource(str(path))
+    assert list(source) == LINES
+    assert source.offset == len('\n'.join(LINES))
+
+
+def test_mmap_source_empty_file(tmpdir):
+    path = tmpdir.join('access.log')
+    path.write('')
+    assert list(MmapSource(str(path))) == []
+
+
+def test_parse_log_from_mmap_source(tmpdir):
+    path = tmpdir.join('access.log')
+    path.write('\n'.join(LINES) + '\n')
+    matches = list(MmapSource(str(path)).matches(build_binary_pattern('combined')))
+    assert matches[1] is None
+
+    http_info = NginxHttpInfo({'--log-format': 'combined'})
+    records = list(http_info.parse_log(MmapSource(str(path))))
+    assert [r['remote_addr'] for r in records] == ['10.0.0.1', '10.0.0.2']
+    assert [r['bytes_sent'] for r in records] == [147, 1024]
+    assert records[1]['request_path'] == '/live/801-1.ts'
+
+
+def test_parse_log_from_mmap_source_decodes_required_fields(tmpdir):
+    path = tmpdir.join('access.log')
+    path.write('\n'.join(LINES) + '\n')
+
+    http_info = NginxHttpInfo({'--log-format': 'combined', '--filter': 'status == 206'})
+    http_info.set_processor(SQLProcessor([], ['remote_addr', 'request_path']))
+    records = list(http_info.parse_log(MmapSource(str(path))))
+    assert 'http_user_agent' not in records[0]
+    assert records[1]['status'] == 206
+    assert records[1]['request_path'] == '/live/801-1.ts'
+
+
+def vhost_line(host, second):
+    return '%s [16/May/2016:10:38:%02d +0000] "GET /live/801.m3u8 HTTP/1.1" 200 147\n' % (host, second)
+
+
+def test_merge_logs_in_time_order(tmpdir):
+    current, rotated, other = [str(tmpdir.join(name)) for name in ('a.log', 'a.log.1.gz', 'b.log')]
+    with open(current, 'w') as f:
+        f.write(''.join(LINES[0].replace('10:38:08', '10:38:%02d' % second) + '\n' for second in (4, 6)))
+    with gzip.open(rotated, 'wb') as f:
+        f.write(''.join(LINES[0].replace('10:38:08', '10:38:%02d' % second) + '\n' for second in (1, 3)).encode())
+    with open(other, 'w') as f:
+        # another format, and a garbage line keeping its place
+        f.write(''.join([vhost_line('10.0.0.2', 2), 'garbage\n', vhost_line('10.0.0.2', 4), vhost_line('10.0.0.2', 5)]))
+    assert [line[:8] for line in GzipSource(rotated)] == ['10.0.0.1'] * 2
+
+    http_info = NginxHttpInfo({'--log-format': 'combined', '--filter': None, '--pre-filter': None})
+    http_info.access_logs = [(current, 'combined'), (rotated, 'combined'),
+                             (other, '$remote_addr [$time_local] "$request" $status $body_bytes_sent')]
+    http_info.set_processor(SQLProcessor([], ['remote_addr']))
+    records = list(http_info.merge_logs())
+    assert [(r['remote_addr'], r['time_local'][18:20]) for r in records] == [
+        ('10.0.0.1', '01'), ('10.0.0.2', '02'), ('10.0.0.1', '03'), ('10.0.0.1', '04'), ('10.0.0.2', '04'),
+        ('10.0.0.2', '05'), ('10.0.0.1', '06')]
+
+
+def test_access_log_globs(tmpdir):
+    for name in ('a.access.log', 'a.access.log.1.gz', 'b.access.log', 'error.log'):
+        tmpdir.join(name).write('')
+    http_info = NginxHttpInfo({'--log-format': 'combined', '--access-log': '%s/*.access.log*, %s/error.log'
+                               % (tmpdir, tmpdir)})
+    assert http_info.get_access_logs() == [(str(tmpdir.join(name)), 'combined') for name in (
+        'a.access.log', 'a.access.log.1.gz', 'b.access.log', 'error.log')]
+    assert http_info.access_log == str(tmpdir.join('a.access.log'))
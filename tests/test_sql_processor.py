@@ -0,0 +1,51 @@
+from ngxtop.aggregator import GroupAggregation, Count
+from ngxtop.sql_processor import SQLProcessor
+
+from helpers import FakeClock
+
+QUERIES = [('top', 'select remote_addr, count(1) as count from log group by remote_addr order by count desc')]
+
+
+def build_records(count):
+    return [{'remote_addr': '10.0.0.%d' % (idx % 3), 'bytes_sent': idx} for idx in range(count)]
+
+
+def test_process_in_batches():
+    processor = SQLProcessor(QUERIES, ['remote_addr', 'bytes_sent'], batch_size=7)
+    processor.process(build_records(20))
+    assert len(processor.pending) == 6
+    assert processor.count() == 20
+    assert len(processor.rows()) == 20
+
+
+def test_missing_fields_are_null():
+    processor = SQLProcessor(QUERIES, ['remote_addr', 'status'])
+    processor.process(build_records(2))
+    assert processor.rows() == [('10.0.0.0', None), ('10.0.0.1', None)]
+
+
+def test_report_flushes_pending_records():
+    processor = SQLProcessor(QUERIES, ['remote_addr', 'bytes_sent'], batch_size=100, flush_interval=3600)
+    processor.begin = 1
+    processor.pending.append(('10.0.0.9', 1))
+    assert '10.0.0.9' in processor.report()
+
+
+def test_window_drops_expired_buckets():
+    clock = FakeClock(1000)
+    aggregation = GroupAggregation('top', ['remote_addr'], [Count('count')], 'count')
+    processor = SQLProcessor([aggregation, ('rows', 'select count(1) as rows from log')],
+                             ['remote_addr', 'bytes_sent'], window=60, clock=clock)
+    processor.process(build_records(3))
+    clock.now = 1030
+    processor.process(build_records(2))
+    assert len(processor.rows()) == 5
+
+    # first bucket is out of the window, second one is still in
+    clock.now = 1065
+    report = processor.report()
+    assert 'top [last 60s]' in report
+    assert len(processor.rows()) == 2
+    assert processor.window_aggregations()[0].rows() == [('10.0.0.0', 1), ('10.0.0.1', 1)]
+    assert processor.count() == 5
+    assert aggregation.rows()[0] == ('10.0.0.0', 2)
@@ -0,0 +1,97 @@
+import os
+
+from ngxtop import tail
+from ngxtop.httptop import NginxHttpInfo
+from ngxtop.sql_processor import SQLProcessor
+from ngxtop.state import StateFile, file_position, resume_offset, state_key
+
+from helpers import FakeClock
+
+LINE = '10.0.0.%d - - [16/May/2016:10:38:08 +0000] "GET /live/801.m3u8 HTTP/1.1" 200 147 "-" "agent"\n'
+ARGUMENTS = {'--log-format': 'combined', '--filter': None, '--pre-filter': None, '--no-follow': True,
+             '--workers': '1'}
+
+
+def append(path, lines):
+    with open(path, 'a') as f:
+        f.write(''.join(lines))
+
+
+def run(path, state):
+    """
+    --no-follow run of an access log with a state file
+    :return: processor, number of lines parsed
+    """
+    http_info = NginxHttpInfo(dict(ARGUMENTS, **{'--access-log': path}))
+    http_info.access_log = path
+    processor = SQLProcessor([('count', 'select count(1) from log')], ['remote_addr'])
+    saved = state.load()
+    if saved is not None:
+        processor = saved['processor']
+    http_info.set_processor(processor)
+    http_info.set_state(lambda position, force: state.save(processor, position), saved and saved['position'])
+    parsed = []
+    build_records = http_info.build_records
+    http_info.build_records = lambda lines, log_format=None: build_records((parsed.append(1) or line for line in lines),
+                                                                         log_format)
+    http_info.parse_info()
+    return processor, len(parsed)
+
+
+def test_no_follow_only_parses_appended_lines(tmpdir):
+    path = str(tmpdir.join('access.log'))
+    state = StateFile(str(tmpdir.join('state')), 'key')
+    append(path, [LINE % idx for idx in range(3)])
+    processor, parsed = run(path, state)
+    assert (processor.count(), parsed) == (3, 3)
+
+    append(path, [LINE % idx for idx in range(3, 5)])
+    processor, parsed = run(path, state)
+    assert (processor.count(), parsed) == (5, 2)
+    assert processor.rows() == [('10.0.0.%d' % idx,) for idx in range(5)]
+    assert not os.path.exists(state.path + '.tmp')
+
+
+def test_rotated_file_is_parsed_from_start(tmpdir):
+    path = str(tmpdir.join('access.log'))
+    append(path, [LINE % 1, LINE % 2])
+    position = file_position(path, len(LINE % 1))
+    assert resume_offset(path, position) == len(LINE % 1)
+    assert resume_offset(path, None) is None
+
+    os.rename(path, path + '.1')
+    append(path, [LINE % 3])
+    assert resume_offset(path, position) == 0
+
+
+def test_state_saved_with_other_options_is_ignored(tmpdir):
+    path = str(tmpdir.join('state'))
+    clock = FakeClock(1000)
+    processor = SQLProcessor([], ['remote_addr'], clock=clock)
+    processor.process([{'remote_addr': '10.0.0.1'}])
+    StateFile(path, 'key').save(processor, None)
+
+    assert StateFile(path, 'other key').load() is None
+    saved = StateFile(path, 'key').load()
+    assert saved['processor'].count() == 1
+    # monotonic time carries on from the saved one, the processor started before
+    assert saved['processor'].clock.monotonic() >= processor.begin
+
+
+def test_state_key_depends_on_engine():
+    # processors of other engines aren't interchangeable
+    assert state_key(dict(ARGUMENTS, **{'--engine': 'sqlite'})) != state_key(dict(ARGUMENTS, **{'--engine': 'numpy'}))
+
+
+def test_tailer_resumes_and_checkpoints_consumed_lines(tmpdir):
+    path = str(tmpdir.join('access.log'))
+    append(path, ['a\n', 'b\n'])
+    checkpoints = []
+    tailer = tail.Tailer(path, watcher=tail.PollWatcher(0.01), start=2, checkpoint=checkpoints.append)
+    lines = tailer.lines()
+    assert next(lines) == 'b\n'
+    assert checkpoints[-1][1] == 2
+
+    append(path, ['c\n'])
+    assert next(lines) == 'c\n'
+    assert checkpoints[-1][1] == 4
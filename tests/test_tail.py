@@ -0,0 +1,82 @@
+import os
+
+from ngxtop import tail
+
+
+def append(path, data):
+    with open(path, 'a') as f:
+        f.write(data)
+
+
+def test_follow_from_end(tmpdir):
+    path = str(tmpdir.join('access.log'))
+    append(path, 'old\n')
+    lines = tail.Tailer(path, watcher=tail.PollWatcher(0.01)).lines()
+    append(path, 'new\npartial')
+    assert next(lines) == 'new\n'
+    append(path, ' line\n')
+    assert next(lines) == 'partial line\n'
+
+
+def test_follow_rename_rotation(tmpdir):
+    path = str(tmpdir.join('access.log'))
+    append(path, 'a\n')
+    tailer = tail.Tailer(path, from_end=False, watcher=tail.PollWatcher(0.01))
+    lines = tailer.lines()
+    assert next(lines) == 'a\n'
+
+    append(path, 'b\n')
+    os.rename(path, path + '.1')
+    append(path + '.1', 'c\n')
+    append(path, 'd\n')
+    assert [next(lines) for _ in range(3)] == ['b\n', 'c\n', 'd\n']
+    assert tailer.offset == 2
+
+
+def test_follow_copytruncate_rotation(tmpdir):
+    path = str(tmpdir.join('access.log'))
+    append(path, 'first line\n')
+    lines = tail.Tailer(path, from_end=False, watcher=tail.PollWatcher(0.01)).lines()
+    assert next(lines) == 'first line\n'
+
+    with open(path, 'w') as f:
+        f.write('x\n')
+    assert next(lines) == 'x\n'
+
+
+def test_inotify_watcher_wakes_up_on_write(tmpdir):
+    path = str(tmpdir.join('access.log'))
+    append(path, '')
+    watcher = tail.create_watcher(path)
+    lines = tail.Tailer(path, watcher=watcher).lines()
+    append(path, 'line\n')
+    assert next(lines) == 'line\n'
+
+
+def test_multi_tailer_interleaves_files(tmpdir):
+    paths = [str(tmpdir.join(name)) for name in ('a.log', 'b.log')]
+    for path in paths:
+        append(path, 'old\n')
+    batches = tail.MultiTailer([tail.Tailer(path, watcher=tail.PollWatcher(0.01)) for path in paths]).batches()
+    append(paths[1], 'b1\nb2\n')
+    assert next(batches) == (1, ['b1\n', 'b2\n'])
+    append(paths[0], 'a1\n')
+    append(paths[1], 'b3\n')
+    assert [next(batches) for _ in range(2)] == [(0, ['a1\n']), (1, ['b3\n'])]
+    batches.close()
+
+
+def test_large_backlog_is_read_in_steps(tmpdir):
+    path = str(tmpdir.join('access.log'))
+    line = 'x' * 99 + '\n'
+    backlog = tail.CHUNK_SIZE * tail.READ_CHUNKS * 3
+    append(path, line * (backlog // len(line)))
+    # a line longer than a read doesn't wait for the watcher
+    append(path, 'y' * backlog + '\n')
+    tailer = tail.Tailer(path, from_end=False, watcher=tail.PollWatcher(3600))
+    lines = tailer.lines()
+    assert next(lines) == line
+    assert tailer.file.tell() <= tail.CHUNK_SIZE * tail.READ_CHUNKS
+    count = backlog // len(line) - 1
+    assert [next(lines) for _ in range(count)] == [line] * count
+    assert next(lines) == 'y' * backlog + '\n'
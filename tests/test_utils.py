@@ -0,0 +1,33 @@
+import pytest
+
+from ngxtop.utils import LRUCache, TimeLocalParser
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache['a'] = 1
+    cache['b'] = 2
+    assert cache.get('a') == 1
+    cache['c'] = 3
+    assert (cache.get('a'), cache.get('b'), cache.get('c')) == (1, None, 3)
+    assert len(cache) == 2
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('16/May/2016:10:38:08 +0000', 1463395088),
+    ('16/May/2016:10:38:09 +0000', 1463395089),
+    ('01/Jan/2017:00:00:00 +0800', 1483200000),
+    ('31/Dec/2016:23:59:59 -0530', 1483248599),
+])
+def test_parse_time_local(value, expected):
+    parser = TimeLocalParser()
+    assert parser(value) == expected
+    # cached
+    assert parser(value) == expected
+
+
+@pytest.mark.parametrize('value', ['', '-', '16/Foo/2016:10:38:08 +0000', '16/May/2016 10:38:08 +0000',
+                                   '16/May/2016:10:38:08 0000', '2016-05-16T10:38:08+00:00'])
+def test_parse_time_local_invalid(value):
+    with pytest.raises(ValueError):
+        TimeLocalParser()(value)